@@ -0,0 +1,138 @@
+from contextlib import ExitStack
+from functools import wraps
+from tempfile import SpooledTemporaryFile
+from wsgiref.util import FileWrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils.decorators import classonlymethod
+
+from api.profiling import current_profile
+
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+
+def close_broken_connections():
+    """Закрывает соединения потока, сломанные ошибкой базы."""
+    for connection in connections.all():
+        if connection.connection is None or not connection.errors_occurred:
+            continue
+        if connection.is_usable():
+            connection.errors_occurred = False
+        else:
+            connection.close()
+
+
+def offload(func):
+    """Синхронная функция как корутина, выполняемая в пуле потоков.
+
+    У каждого потока своё соединение с базой, поэтому запросы,
+    запущенные через asyncio.gather, выполняются параллельно.
+    Потоков в пуле немного, и их соединения живут вместе с ними:
+    новое соединение на каждый вызов стоило бы дороже самого запроса.
+    Сигналы начала и конца запроса до этих потоков не доходят, поэтому
+    CONN_MAX_AGE и проверку соединения вызов применяет сам, как и
+    замер запросов QueryProfilingMiddleware.
+    """
+    @wraps(func)
+    def call(*args, **kwargs):
+        close_old_connections()
+        profile = current_profile.get()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    if (
+                            profile is not None
+                            and profile not in connection.execute_wrappers
+                    ):
+                        stack.enter_context(
+                            connection.execute_wrapper(profile)
+                        )
+                return func(*args, **kwargs)
+        finally:
+            close_broken_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def spool(response):
+    """Тело потокового ответа, прочитанное в пуле потоков.
+
+    ASGI-обработчик Django 3.2 перебирает части в цикле событий, где
+    запросы к базе запрещены, а асинхронных итераторов не принимает.
+    Поэтому поток читается здесь, а части копятся во временном файле:
+    в памяти остаётся не больше STREAMING_SPOOL_MAX_SIZE байт, цикл
+    событий отдаёт файл частями и не ждёт базу.
+    """
+    spooled = SpooledTemporaryFile(max_size=settings.STREAMING_SPOOL_MAX_SIZE)
+    for part in response.streaming_content:
+        spooled.write(part)
+    spooled.seek(0)
+    return FileWrapper(spooled, STREAMING_CHUNK_SIZE)
+
+
+class AsyncViewSetMixin:
+    """Асинхронное обслуживание вьюсета под ASGI.
+
+    С ASYNC_VIEWS as_view() возвращает асинхронное представление.
+    GET-действие, для которого у вьюсета есть корутина
+    async_<действие>, выполняется ею; остальные запросы целиком
+    обрабатывает синхронный вьюсет в пуле потоков, так что воркер
+    не простаивает, пока поток ждёт базу.
+    """
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_VIEWS:
+            return view
+
+        @offload
+        def sync_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if response.streaming:
+                response.streaming_content = spool(response)
+            elif hasattr(response, 'render'):
+                response.render()
+            return response
+
+        @wraps(view)
+        async def async_view(request, *args, **kwargs):
+            handler = f'async_{actions.get("get")}'
+            if request.method != 'GET' or not hasattr(cls, handler):
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            if 'head' not in actions:
+                actions['head'] = actions['get']
+            self.action_map = actions
+            for method, action in actions.items():
+                setattr(self, method, getattr(self, action))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.async_dispatch(
+                getattr(self, handler), request, *args, **kwargs
+            )
+
+        return async_view
+
+    async def async_dispatch(self, handler, request, *args, **kwargs):
+        """APIView.dispatch для корутины-обработчика: аутентификация,
+        проверка прав и рендеринг ответа выполняются в пуле потоков."""
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await offload(self.initial)(request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs
+        )
+        if hasattr(self.response, 'render'):
+            await offload(self.response.render)()
+        return self.response
+
+    def serialize(self, instance, many=False):
+        return self.get_serializer(instance, many=many).data
@@ -0,0 +1,152 @@
+import copy
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from recipes.cache import auth_state
+
+User = get_user_model()
+
+TOKEN_KEY = 'auth:token:{}'
+SIGNED_TOKEN_SALT = 'api.authentication.signed-token'
+SIGNED_TOKEN_FIELDS = User.SIGNED_TOKEN_FIELDS
+# Ключи токенов из базы шестнадцатеричные, в подписанных есть ':'.
+SIGNED_TOKEN_SEPARATOR = ':'
+
+
+class TokenCache:
+    """Токены, уже найденные в базе: LRU на TTL секунд в памяти
+    процесса и кэш Django как второй уровень для остальных процессов.
+
+    Запись действительна, пока пользователь активен и не изменилась
+    его версия авторизации: её меняют выход, смена пароля и блокировка
+    (см. CreateUser.save). Отзыв виден всем процессам только через
+    общий кэш, поэтому без него (SHARED_CACHE) токены каждый раз
+    ищутся в базе.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._tokens = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def cache_key(key):
+        return TOKEN_KEY.format(sha256(key.encode()).hexdigest())
+
+    @staticmethod
+    def is_current(token, version):
+        return auth_state(token.user_id) == (version, True)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is not None:
+                self._tokens.move_to_end(key)
+        if entry is not None:
+            token, version, expires = entry
+            if expires > time.monotonic() and self.is_current(token, version):
+                # Представления могут менять request.user, поэтому каждый
+                # запрос получает свою копию.
+                return copy.deepcopy(token)
+            self.forget(key)
+        entry = cache.get(self.cache_key(key))
+        if entry is None or not self.is_current(*entry):
+            return None
+        self._remember(key, *entry)
+        return entry[0]
+
+    def set(self, key, token, version):
+        cache.set(self.cache_key(key), (token, version), self.ttl)
+        self._remember(key, token, version)
+
+    def _remember(self, key, token, version):
+        with self._lock:
+            self._tokens[key] = (token, version, time.monotonic() + self.ttl)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.size:
+                self._tokens.popitem(last=False)
+
+    def forget(self, key):
+        with self._lock:
+            self._tokens.pop(key, None)
+        cache.delete(self.cache_key(key))
+
+
+token_cache = TokenCache(
+    settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL
+) if settings.SHARED_CACHE else None
+
+
+def make_signed_token(user):
+    """Самодостаточный токен: id, поля профиля для request.user
+    и версия авторизации, подписанные SECRET_KEY."""
+    return signing.dumps(
+        [
+            user.pk,
+            user.auth_version,
+            *(getattr(user, field) for field in SIGNED_TOKEN_FIELDS)
+        ],
+        salt=SIGNED_TOKEN_SALT
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе на каждый запрос.
+
+    Обычные токены ищутся в базе только при промахе TokenCache.
+    С AUTH_SIGNED_TOKENS вход выдаёт подписанные токены, которые
+    проверяются без базы вообще: пользователь собирается из полей
+    токена, остальные поля догружаются, только если к ним обратятся.
+    Версия авторизации и активность пользователя берутся из общего
+    кэша, а при промахе - из базы; без общего кэша подписанные токены
+    не включаются (см. settings).
+    """
+
+    def authenticate_credentials(self, key):
+        if settings.AUTH_SIGNED_TOKENS and SIGNED_TOKEN_SEPARATOR in key:
+            return self.authenticate_signed(key)
+        if token_cache is None:
+            return super().authenticate_credentials(key)
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token, user.auth_version)
+        return token.user, token
+
+    def authenticate_signed(self, key):
+        try:
+            user_id, version, *values = signing.loads(
+                key, salt=SIGNED_TOKEN_SALT,
+                max_age=settings.AUTH_SIGNED_TOKEN_MAX_AGE
+            )
+        except (signing.BadSignature, ValueError):
+            raise AuthenticationFailed('Недействительный токен.')
+        if len(values) != len(SIGNED_TOKEN_FIELDS):
+            raise AuthenticationFailed('Недействительный токен.')
+        state = auth_state(user_id)
+        if state is None or not state[1]:
+            raise AuthenticationFailed('Пользователь неактивен или удален.')
+        if version != state[0]:
+            raise AuthenticationFailed('Токен отозван.')
+        values = dict(
+            zip(SIGNED_TOKEN_FIELDS, values), id=user_id, is_active=True
+        )
+        # from_db ждёт значения в порядке полей модели.
+        names = [
+            field.attname for field in User._meta.concrete_fields
+            if field.attname in values
+        ]
+        return User.from_db(
+            DEFAULT_DB_ALIAS, names, [values[name] for name in names]
+        ), key
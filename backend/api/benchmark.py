@@ -0,0 +1,293 @@
+import asyncio
+import base64
+import json
+import statistics
+import threading
+import time
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import AsyncClient, Client
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from api.async_views import offload
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+
+class ClientDriver:
+    """Запросы внутри процесса через django.test.Client: без сети
+    и сервера приложений, только Django и база."""
+
+    def __init__(self, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        self.client = Client(**headers)
+
+    def request(self, method, path, body=None):
+        response = self.client.generic(
+            method, path,
+            json.dumps(body) if body is not None else '',
+            content_type='application/json'
+        )
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        return response.status_code, size
+
+    def close(self):
+        connection.close()
+
+
+class AsyncClientDriver:
+    """Запросы внутри процесса через ASGI-обработчик Django
+    (django.test.AsyncClient): все клиенты работают в одном цикле
+    событий, как запросы одного ASGI-воркера."""
+
+    def __init__(self, token=None):
+        self.client = AsyncClient()
+        # Заголовки AsyncClient передаются в каждый запрос.
+        self.headers = {'authorization': f'Token {token}'} if token else {}
+
+    async def request(self, method, path, body=None):
+        response = await self.client.generic(
+            method, path,
+            json.dumps(body) if body is not None else '',
+            content_type='application/json',
+            **self.headers
+        )
+        if response.streaming:
+            # Потоковый ответ читает базу по мере итерации.
+            size = await offload(sum)(
+                len(chunk) for chunk in response.streaming_content
+            )
+        else:
+            size = len(response.content)
+        return response.status_code, size
+
+
+class HTTPDriver:
+    """Запросы к запущенному серверу по HTTP."""
+
+    def __init__(self, base_url, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Content-Type': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Token {token}'
+
+    def request(self, method, path, body=None):
+        request = Request(
+            self.base_url + path,
+            data=json.dumps(body).encode() if body is not None else None,
+            headers=self.headers,
+            method=method
+        )
+        try:
+            with urlopen(request) as response:
+                return response.status, len(response.read())
+        except HTTPError as error:
+            return error.code, len(error.read())
+
+    def close(self):
+        pass
+
+
+def image_data_uri():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), 'orange').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def benchmark_user(email=None):
+    """Пользователь с подписками и корзиной и его токен."""
+    users = User.objects.all()
+    if email:
+        users = users.filter(email=email)
+    else:
+        users = users.filter(
+            subscribers__isnull=False, is_in_shopping_cart__isnull=False
+        ).order_by('pk')
+    user = users.first()
+    if user is None:
+        return None, None
+    return user, Token.objects.get_or_create(user=user)[0].key
+
+
+def scenarios(user):
+    """Сценарии: имя -> (нужна ли авторизация, функция номера запроса,
+    возвращающая метод, путь и тело)."""
+    recipe_ids = list(
+        Recipe.objects.order_by('-favorites_count', '-pk').values_list(
+            'pk', flat=True
+        )[:100]
+    )
+    author_ids = list(
+        User.objects.filter(recipes_count__gt=0).order_by(
+            '-followers_count'
+        ).values_list('pk', flat=True)[:20]
+    )
+    slugs = list(Tag.objects.values_list('slug', flat=True))
+    ingredients = list(Ingredient.objects.values_list('pk', 'name')[:200])
+    words = [name.split()[0] for _, name in ingredients[::10]]
+    prefixes = [name[:3] for _, name in ingredients[::10]]
+    tag_ids = list(Tag.objects.values_list('pk', flat=True))
+    image = image_data_uri()
+
+    def get(path):
+        return lambda number: ('GET', path(number), None)
+
+    def create(number):
+        return 'POST', '/api/recipes/', {
+            'name': f'Нагрузочный рецепт {number}',
+            'text': 'Рецепт, созданный нагрузочным тестом.',
+            'cooking_time': 10,
+            'tags': tag_ids[:1 + number % len(tag_ids)],
+            'image': image,
+            'ingredients': [
+                {'id': pk, 'amount': 10 + number % 50}
+                for pk, _ in ingredients[number % 20:number % 20 + 5]
+            ],
+        }
+
+    def pick(values):
+        return lambda number: values[number % len(values)]
+
+    return {
+        'recipes.list': (False, get(lambda number: '/api/recipes/')),
+        'recipes.list.page': (False, get(
+            lambda number: f'/api/recipes/?page={2 + number % 5}'
+        )),
+        'recipes.list.tags': (False, get(
+            lambda number: f'/api/recipes/?tags={pick(slugs)(number)}'
+        )),
+        'recipes.list.author': (False, get(
+            lambda number: f'/api/recipes/?author={pick(author_ids)(number)}'
+        )),
+        'recipes.list.search': (False, get(
+            lambda number: f'/api/recipes/?search={pick(words)(number)}'
+        )),
+        'recipes.list.is_favorited': (True, get(
+            lambda number: '/api/recipes/?is_favorited=1'
+        )),
+        'recipes.list.is_in_shopping_cart': (True, get(
+            lambda number: '/api/recipes/?is_in_shopping_cart=1'
+        )),
+        'recipes.detail': (False, get(
+            lambda number: f'/api/recipes/{pick(recipe_ids)(number)}/'
+        )),
+        'users.subscriptions': (True, get(
+            lambda number: '/api/users/subscriptions/?recipes_limit=3'
+        )),
+        'recipes.download_shopping_cart': (True, get(
+            lambda number: '/api/recipes/download_shopping_cart/?format=txt'
+        )),
+        'ingredients.search': (False, get(
+            lambda number: f'/api/ingredients/?name={pick(prefixes)(number)}'
+        )),
+        'recipes.create': (True, create),
+    }
+
+
+def run_scenario(make_driver, build, requests, concurrency, warmup=0):
+    """Выполняет requests запросов в concurrency потоках; у каждого
+    потока свой клиент. Возвращает пропускную способность
+    и перцентили времени ответа в мс."""
+    driver = make_driver()
+    for number in range(warmup):
+        driver.request(*build(number))
+    driver.close()
+    timings, errors, sizes = [], [], []
+    numbers = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker():
+        driver = make_driver()
+        try:
+            while True:
+                with lock:
+                    number = next(numbers, None)
+                if number is None:
+                    return
+                method, path, body = build(number)
+                start = time.perf_counter()
+                status, size = driver.request(method, path, body)
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    timings.append(elapsed)
+                    sizes.append(size)
+                    if status >= 400:
+                        errors.append(status)
+        finally:
+            driver.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return scenario_result(timings, errors, sizes, wall)
+
+
+async def run_scenario_async(make_driver, build, requests, concurrency,
+                             warmup=0):
+    """То же, что run_scenario, но concurrency клиентов - задачи
+    одного цикла событий, а драйвер асинхронный."""
+    driver = make_driver()
+    for number in range(warmup):
+        await driver.request(*build(number))
+    timings, errors, sizes = [], [], []
+    numbers = iter(range(requests))
+
+    async def worker():
+        driver = make_driver()
+        for number in numbers:
+            method, path, body = build(number)
+            start = time.perf_counter()
+            status, size = await driver.request(method, path, body)
+            timings.append((time.perf_counter() - start) * 1000)
+            sizes.append(size)
+            if status >= 400:
+                errors.append(status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return scenario_result(timings, errors, sizes, wall)
+
+
+def scenario_result(timings, errors, sizes, wall):
+    percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'requests': len(timings),
+        'errors': len(errors),
+        'throughput': len(timings) / wall,
+        'mean': statistics.mean(timings),
+        'p50': percentiles[49],
+        'p95': percentiles[94],
+        'p99': percentiles[98],
+        'bytes': statistics.mean(sizes),
+    }
+
+
+def compare(baseline, results):
+    """Изменение p50, p95 и пропускной способности в процентах
+    относительно сохранённого прогона."""
+    changes = {}
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        changes[name] = {
+            metric: (result[metric] - old[metric]) / old[metric] * 100
+            for metric in ('p50', 'p95', 'throughput') if old[metric]
+        }
+    return changes
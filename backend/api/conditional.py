@@ -0,0 +1,68 @@
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from recipes.cache import get_version, relations_version_name
+
+
+def make_etag(*parts):
+    return quote_etag(
+        md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    )
+
+
+class ConditionalResponseMixin:
+    """Отвечает 304 на If-None-Match / If-Modified-Since до сериализации.
+
+    Наследник описывает валидаторы в get_validators(): части ETag
+    и, если ответ не персональный, время последнего изменения.
+    """
+
+    def get_validators(self, request):
+        """Возвращает (части ETag, last_modified) или None."""
+        raise NotImplementedError
+
+    def get_user_etag_parts(self, request):
+        """Персональные поля ответа тоже должны менять ETag."""
+        if not request.user.is_authenticated:
+            return ('anonymous',)
+        return (
+            request.user.pk,
+            get_version(relations_version_name(request.user.pk))
+        )
+
+    def check_conditional(self, request, validators):
+        """ETag и время изменения ответа и готовый ответ 304,
+        если клиент уже получил актуальную версию."""
+        etag_parts, last_modified = validators
+        etag = make_etag(request.get_full_path(), *etag_parts)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        return etag, timestamp, get_conditional_response(
+            request, etag=etag, last_modified=timestamp
+        )
+
+    def finish_conditional(self, response, etag, timestamp):
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def conditional(self, handler, request, *args, **kwargs):
+        validators = self.get_validators(request)
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        etag, timestamp, response = self.check_conditional(
+            request, validators
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        return self.finish_conditional(response, etag, timestamp)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
@@ -1,34 +1,87 @@
-from django_filters import AllValuesMultipleFilter, CharFilter, FilterSet
+from django_filters import (
+    CharFilter,
+    ChoiceFilter,
+    FilterSet,
+    MultipleChoiceFilter
+)
+from rest_framework.filters import OrderingFilter
 
+from recipes.autocomplete import ingredient_autocomplete
+from recipes.cache import tag_cache
 from recipes.models import Ingredient, Recipe
+from recipes.search import recipe_search
+
+TAGS_MODES = (('any', 'Любой из тегов'), ('all', 'Все теги'))
+
+
+def tag_choices():
+    """Слаги тегов из кэша справочника, без запроса к базе."""
+    return [(tag.slug, tag.name) for tag in tag_cache.objects().values()]
+
+
+class UniqueOrderingFilter(OrderingFilter):
+    """Сортировка из ?ordering= с id последним полем: у рецептов
+    с одинаковыми счётчиками иначе нет определённого порядка, и соседние
+    страницы повторяли бы или теряли рецепты."""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering = [*ordering, '-id']
+        return ordering
 
 
 class IngredientSearchFilter(FilterSet):
     """Фильтр для ингредиентов."""
 
-    name = CharFilter(field_name='name', lookup_expr='istartswith')
+    name = CharFilter(method='name_filter')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def name_filter(self, queryset, name, value):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        return ingredient_autocomplete.filter(queryset, value)
+
 
 class RecipeSearchFilter(FilterSet):
     """Фильтр для рецептов."""
 
-    tags = AllValuesMultipleFilter(
+    tags = MultipleChoiceFilter(
         label='tags',
-        field_name='tags__slug'
+        choices=tag_choices,
+        method='tags_filter'
     )
+    tags_mode = ChoiceFilter(choices=TAGS_MODES, method='tags_mode_filter')
     is_favorited = CharFilter(method='is_favorited_filter')
     is_in_shopping_cart = CharFilter(method='is_in_shopping_cart_filter')
+    search = CharFilter(method='search_filter')
 
     class Meta:
         model = Recipe
         fields = (
-            'author', 'tags', 'is_favorited', 'is_in_shopping_cart'
+            'author', 'tags', 'tags_mode', 'is_favorited',
+            'is_in_shopping_cart', 'search'
+        )
+
+    def tags_filter(self, queryset, name, value):
+        """Рецепты с любым из тегов, с tags_mode=all - со всеми."""
+        ids = {tag.slug: pk for pk, tag in tag_cache.objects().items()}
+        # Тег, удалённый после проверки слагов, ничего не находит.
+        return queryset.with_tags(
+            [ids.get(slug) for slug in value],
+            match_all=self.form.cleaned_data.get('tags_mode') == 'all'
         )
 
+    def tags_mode_filter(self, queryset, name, value):
+        """Режим учитывается в tags_filter."""
+        return queryset
+
+    def search_filter(self, queryset, name, value):
+        """Полнотекстовый поиск, более релевантные рецепты первыми."""
+        return recipe_search.filter(queryset, value)
+
     def is_favorited_filter(self, queryset, name, value):
         """Получаем рецепты которые находятся в избранном."""
         if value and self.request.user.is_authenticated:
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from api.benchmark import (
+    AsyncClientDriver,
+    ClientDriver,
+    HTTPDriver,
+    benchmark_user,
+    compare,
+    run_scenario,
+    run_scenario_async,
+    scenarios
+)
+from recipes.models import FavoriteRecipe, Recipe, ShoppingRecipe
+from users.models import Follow
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure throughput and p50/p95/p99 latency of the key API '
+        'endpoints and save the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests per scenario'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Parallel clients per scenario'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Requests per scenario that are not measured'
+        )
+        parser.add_argument(
+            '--url',
+            help='Load a running server at this base URL instead of '
+                 'calling Django in-process with the test client'
+        )
+        parser.add_argument(
+            '--asgi', action='store_true',
+            help='Call Django in-process through its ASGI handler, with '
+                 'all clients in one event loop like a single ASGI worker; '
+                 'compare with a run without it to see the per-worker '
+                 'gain of ASYNC_VIEWS'
+        )
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            help='Only run this scenario; may be repeated'
+        )
+        parser.add_argument(
+            '--user',
+            help='E-mail of the user for authenticated scenarios; by '
+                 'default the first one with subscriptions and a cart'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the results to this JSON file'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON file of an earlier run to compare with'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs.get('requests') < 2 or kwargs.get('concurrency') < 1:
+            raise CommandError(
+                'Percentiles need --requests of at least 2 and '
+                '--concurrency of at least 1.'
+            )
+        user, token = benchmark_user(kwargs.get('user'))
+        if user is None:
+            raise CommandError(
+                'No suitable user found, run generate_data first.'
+            )
+        available = scenarios(user)
+        names = kwargs.get('scenarios') or list(available)
+        unknown = set(names) - set(available)
+        if unknown:
+            raise CommandError(
+                f'Unknown scenarios: {", ".join(sorted(unknown))}. '
+                f'Available: {", ".join(available)}.'
+            )
+        url = kwargs.get('url')
+        asgi = kwargs.get('asgi')
+        if url and asgi:
+            raise CommandError('--url and --asgi cannot be combined.')
+        results = {}
+        # Тестовый клиент обращается к хосту testserver.
+        with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+        ):
+            for name in names:
+                authenticated, build = available[name]
+                key = token if authenticated else None
+
+                def make_driver():
+                    if url:
+                        return HTTPDriver(url, key)
+                    if asgi:
+                        return AsyncClientDriver(key)
+                    return ClientDriver(key)
+
+                run = run_scenario
+                if asgi:
+                    def run(*args):
+                        return asyncio.run(run_scenario_async(*args))
+                results[name] = result = run(
+                    make_driver, build, kwargs.get('requests'),
+                    kwargs.get('concurrency'), kwargs.get('warmup')
+                )
+                self.stdout.write(
+                    f'{name}: {result["throughput"]:.1f} req/s, '
+                    f'p50={result["p50"]:.1f}ms p95={result["p95"]:.1f}ms '
+                    f'p99={result["p99"]:.1f}ms errors={result["errors"]}'
+                )
+        report = {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'commit': git_commit(),
+                'vendor': connection.vendor,
+                'debug': bool(settings.DEBUG),
+                'driver': url or (
+                    'django.test.AsyncClient' if asgi else 'django.test.Client'
+                ),
+                'async_views': settings.ASYNC_VIEWS,
+                'requests': kwargs.get('requests'),
+                'concurrency': kwargs.get('concurrency'),
+                'user': user.email,
+                'data': {
+                    model._meta.label: model.objects.count()
+                    for model in (
+                        Recipe, Follow, FavoriteRecipe, ShoppingRecipe
+                    )
+                },
+            },
+            'results': results,
+        }
+        if kwargs.get('compare'):
+            with open(kwargs['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            self.stdout.write(
+                f'compared with {baseline["meta"].get("commit")}:'
+            )
+            for name, changes in compare(baseline, results).items():
+                self.stdout.write(f'{name}: ' + ' '.join(
+                    f'{metric} {change:+.1f}%'
+                    for metric, change in changes.items()
+                ))
+        if kwargs.get('output'):
+            with open(kwargs['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'results written to {kwargs["output"]}'
+            ))
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import benchmark_user
+from api.plans import analyze, hot_queries, sequential_scans, table_rows
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the hot API queries and fail if any of them plans '
+        'a sequential scan of a large table'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='Sequential scans of tables with fewer rows are allowed; '
+                 'the database must hold at least this many recipes, '
+                 'see generate_data'
+        )
+        parser.add_argument(
+            '--user',
+            help='E-mail of the user for personal queries; by default '
+                 'the first one with subscriptions and a cart'
+        )
+        parser.add_argument(
+            '--query', action='append', dest='queries',
+            help='Only check this query; may be repeated'
+        )
+
+    def handle(self, *args, **kwargs):
+        min_rows = kwargs.get('min_rows')
+        if Recipe.objects.count() < min_rows:
+            raise CommandError(
+                f'Fewer than {min_rows} recipes: plans of a small database '
+                'say nothing about production, run generate_data first'
+            )
+        user, _ = benchmark_user(kwargs.get('user'))
+        if user is None:
+            raise CommandError('No user with subscriptions and a cart')
+        analyze()
+        queries = hot_queries(user)
+        names = kwargs.get('queries') or list(queries)
+        unknown = set(names) - set(queries)
+        if unknown:
+            raise CommandError(f'Unknown queries: {", ".join(unknown)}')
+        rows = {}
+        failures = []
+        for name in names:
+            scans = []
+            for table in sequential_scans(queries[name]):
+                if table not in rows:
+                    rows[table] = table_rows(table)
+                if rows[table] >= min_rows:
+                    scans.append(f'{table} ({rows[table]} rows)')
+            if scans:
+                failures.append(name)
+                self.stdout.write(
+                    f'{name}: sequential scan of {", ".join(scans)}'
+                )
+            else:
+                self.stdout.write(f'{name}: ok')
+        if failures:
+            raise CommandError(
+                f'{len(failures)} of {len(names)} queries scan large '
+                f'tables on {connection.vendor}: {", ".join(failures)}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(names)} queries use indexes on {connection.vendor}'
+        ))
@@ -0,0 +1,85 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+from api.profiling import RequestProfile, current_profile, profile_store
+from foodgram.db.routers import (
+    SAFE_METHODS,
+    pin_to_primary,
+    read_from_primary,
+    replicas
+)
+
+
+class QueryProfilingMiddleware:
+    """Считает запросы к базе, их время, время представления и размер
+    ответа для каждого запроса.
+
+    Замеры PROFILING_SAMPLE_RATE доли запросов сохраняются в хранилище
+    для страницы админки; с PROFILING_HEADERS каждый ответ получает
+    заголовки X-Query-Count и Server-Timing.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED and not settings.PROFILING_HEADERS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = (
+            settings.PROFILING_ENABLED
+            and random.random() < settings.PROFILING_SAMPLE_RATE
+        )
+        if not sampled and not settings.PROFILING_HEADERS:
+            return self.get_response(request)
+        request.profile = profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        sample = profile.sample(request, response)
+        if sampled:
+            profile_store.add(sample)
+        if settings.PROFILING_HEADERS:
+            response['X-Query-Count'] = sample['queries']
+            response['Server-Timing'] = profile.server_timing(sample)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """Каждый запрос начинает читать из основной базы; после
+    изменяющего запроса пользователь закрепляется за ней, чтобы
+    сразу видеть свои изменения."""
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_request(self, request):
+        read_from_primary()
+
+    def process_response(self, request, response):
+        read_from_primary()
+        user = getattr(request, 'user', None)
+        if (
+                request.method not in SAFE_METHODS
+                and user is not None
+                and user.is_authenticated
+        ):
+            pin_to_primary(user.pk)
+        return response
@@ -1,10 +1,52 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.paginator import InvalidPage, Page
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 
 class PageSizeNumberPagination(PageNumberPagination):
     page_size_query_param = 'limit'
 
+    def page_bounds(self, request):
+        """Номер страницы и границы среза, если их можно узнать без
+        подсчёта записей, иначе None: тогда страницу выбирает
+        paginate_queryset."""
+        page_size = self.get_page_size(request)
+        try:
+            number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            return None
+        if not page_size or number < 1:
+            return None
+        return number, (number - 1) * page_size, number * page_size
+
+    def paginate_rows(self, rows, count, number, request):
+        """То же, что paginate_queryset, для уже прочитанных строк
+        страницы и отдельно посчитанного числа записей."""
+        paginator = self.django_paginator_class(
+            [], self.get_page_size(request)
+        )
+        paginator.count = count
+        try:
+            number = paginator.validate_number(number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=number, message=str(exc)
+            ))
+        self.page = Page(rows, number, paginator)
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
     def get_paginated_response(self, data):
         return Response({
             'count': self.page.paginator.count,
@@ -12,3 +54,179 @@ class PageSizeNumberPagination(PageNumberPagination):
             'previous': self.get_previous_link(),
             'results': data
         })
+
+
+def estimate_count(queryset):
+    """Оценка числа строк из плана запроса PostgreSQL вместо COUNT(*)."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация по (-created_at, -id).
+
+    Следующая страница выбирается условием по ключу последней строки,
+    поэтому глубокие страницы стоят столько же, сколько первая. Общее
+    число записей считается только по запросу: ?count=exact или
+    ?count=estimate.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = urlsafe_b64decode(
+                encoded.encode('ascii')
+            ).decode('ascii').split('|')
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (BinasciiError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    @staticmethod
+    def encode_cursor(created_at, pk):
+        return urlsafe_b64encode(
+            f'{created_at.isoformat()}|{pk}'.encode('ascii')
+        ).decode('ascii')
+
+    def page_queryset(self, queryset, request, key=('created_at', 'pk')):
+        """Запрос строк страницы, с одной лишней для проверки next.
+        key - поля даты и id рецепта в запросе."""
+        created_field, pk_field = key
+        position = self.decode_cursor(request)
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(
+                Q(**{f'{created_field}__lt': created_at})
+                | Q(**{created_field: created_at, f'{pk_field}__lt': pk})
+            )
+        page_size = self.get_page_size(request)
+        return queryset.order_by(
+            f'-{created_field}', f'-{pk_field}'
+        )[:page_size + 1]
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.page_queryset(queryset, request))
+        return self.paginate_rows(
+            rows, self.get_count(queryset, request), request
+        )
+
+    def paginate_rows(self, rows, count, request):
+        """Страница из строк page_queryset и числа записей."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.next_cursor = (
+            self.encode_cursor(
+                rows[page_size - 1].created_at, rows[page_size - 1].pk
+            )
+            if len(rows) > page_size else None
+        )
+        self.count = count
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data
+        })
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорная пагинация ленты, собранной из нескольких источников.
+
+    Из каждого источника читается страница по его индексу, страницы
+    сливаются по (-created_at, -id) без повторов. Возвращаются id
+    рецептов страницы; число записей не считается.
+    """
+
+    def paginate_queryset(self, sources, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        rows = sorted(
+            {
+                row
+                for queryset, key in sources
+                for row in self.page_queryset(
+                    queryset, request, key
+                ).values_list(*key)
+            },
+            reverse=True
+        )
+        self.next_cursor = (
+            self.encode_cursor(*rows[page_size - 1])
+            if len(rows) > page_size else None
+        )
+        self.count = None
+        return [pk for _, pk in rows[:page_size]]
+
+
+class RecipePagination(PageSizeNumberPagination):
+    """Постраничная пагинация, а с параметром ?cursor= - курсорная.
+    Курсор привязан к порядку по дате, поэтому при явной сортировке
+    (?ordering=) и при поиске (?search=) используются номера страниц."""
+
+    keyset_class = KeysetPagination
+    search_query_param = 'search'
+
+    def is_keyset(self, request):
+        return (
+            self.keyset_class.cursor_query_param in request.query_params
+            and api_settings.ORDERING_PARAM not in request.query_params
+            and self.search_query_param not in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.keyset_class() if self.is_keyset(request) else None
+        if self.keyset is not None:
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,169 @@
+import zlib
+
+from reportlab.pdfbase.ttfonts import SUBSETN, TTFont, makeToUnicodeCMap
+
+
+class PDFStream:
+    """PDF, который отдаётся по страницам.
+
+    Страница записывается, как только заполнена, и больше не хранится.
+    Объекты, которым нужен весь документ - подмножества шрифта
+    с использованными символами, ресурсы, дерево страниц и таблица
+    смещений, - пишутся в конце; их номера заняты заранее, и страницы
+    ссылаются на них до записи. Символы получают коды шрифта reportlab
+    (TTFont.splitString) по мере появления, так что в файл попадают
+    только нужные глифы.
+    """
+
+    def __init__(self, pagesize, font, font_size):
+        self.width, self.height = pagesize
+        self.font = font
+        self.font_size = font_size
+        self.offsets = {}
+        self.position = 0
+        self.numbers = 0
+        self.catalog = self.allocate()
+        self.pages = self.allocate()
+        self.resources = self.allocate()
+        self.kids = []
+
+    def allocate(self):
+        self.numbers += 1
+        return self.numbers
+
+    def write(self, data):
+        self.position += len(data)
+        return data
+
+    def object(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        if stream is None:
+            return self.write(f'{number} 0 obj\n{body}\nendobj\n'.encode())
+        stream = zlib.compress(stream)
+        return self.write(
+            f'{number} 0 obj\n<< {body}{" " if body else ""}'
+            f'/Length {len(stream)} /Filter /FlateDecode >>\nstream\n'.encode()
+            + stream + b'\nendstream\nendobj\n'
+        )
+
+    def start(self):
+        return self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def encode(self, text):
+        """Куски строки (имя шрифта в ресурсах, байты кодов)."""
+        if isinstance(self.font, TTFont):
+            return [
+                (f'F{subset}', codes)
+                for subset, codes in self.font.splitString(text, self)
+            ]
+        return [('F0', text.encode('cp1252', 'replace'))]
+
+    def page(self, lines):
+        """Страница из строк (x, y, текст)."""
+        content = []
+        for x, y, text in lines:
+            content.append(f'BT {x} {y} Td')
+            for name, codes in self.encode(text):
+                content.append(
+                    f'/{name} {self.font_size} Tf <{codes.hex()}> Tj'
+                )
+            content.append('ET')
+        contents, page = self.allocate(), self.allocate()
+        self.kids.append(page)
+        return self.object(
+            contents, '', '\n'.join(content).encode()
+        ) + self.object(
+            page,
+            f'<< /Type /Page /Parent {self.pages} 0 R '
+            f'/MediaBox [0 0 {self.width} {self.height}] '
+            f'/Resources {self.resources} 0 R /Contents {contents} 0 R >>'
+        )
+
+    def fonts(self):
+        """Объекты шрифтов и их имена в ресурсах страниц."""
+        if not isinstance(self.font, TTFont):
+            number = self.allocate()
+            yield 'F0', number, self.object(
+                number,
+                f'<< /Type /Font /Subtype /Type1 '
+                f'/BaseFont /{self.font.face.name} '
+                f'/Encoding /WinAnsiEncoding >>'
+            )
+            return
+        face = self.font.face
+        state = self.font.state.get(self)
+        for subset_number, subset in enumerate(
+                state.subsets if state else ()
+        ):
+            name = (
+                SUBSETN(subset_number) + b'+' + face.name
+                + face.subfontNameX
+            ).decode()
+            font_file, descriptor, to_unicode, font = (
+                self.allocate() for _ in range(4)
+            )
+            subset_font = face.makeSubset(subset)
+            widths = ' '.join(
+                str(round(face.getCharWidth(code), 2)) for code in subset
+            )
+            yield f'F{subset_number}', font, b''.join((
+                self.object(
+                    font_file, f'/Length1 {len(subset_font)}', subset_font
+                ),
+                self.object(
+                    descriptor,
+                    f'<< /Type /FontDescriptor /FontName /{name} '
+                    f'/Flags {face.flags & ~32 | 4} '
+                    f'/FontBBox [{" ".join(str(v) for v in face.bbox)}] '
+                    f'/ItalicAngle {face.italicAngle} '
+                    f'/Ascent {face.ascent} /Descent {face.descent} '
+                    f'/CapHeight {face.capHeight} /StemV {face.stemV} '
+                    f'/FontFile2 {font_file} 0 R >>'
+                ),
+                self.object(
+                    to_unicode, '',
+                    makeToUnicodeCMap(name, subset).encode()
+                ),
+                self.object(
+                    font,
+                    f'<< /Type /Font /Subtype /TrueType /BaseFont /{name} '
+                    f'/FirstChar 0 /LastChar {len(subset) - 1} '
+                    f'/Widths [{widths}] /FontDescriptor {descriptor} 0 R '
+                    f'/ToUnicode {to_unicode} 0 R >>'
+                ),
+            ))
+
+    def close(self):
+        """Коды символов документа больше не нужны шрифту."""
+        if isinstance(self.font, TTFont):
+            self.font.state.pop(self, None)
+
+    def finish(self):
+        """Шрифты, ресурсы, дерево страниц, каталог и таблица смещений."""
+        data, fonts = [], []
+        for name, number, objects in self.fonts():
+            data.append(objects)
+            fonts.append(f'/{name} {number} 0 R')
+        kids = ' '.join(f'{page} 0 R' for page in self.kids)
+        data.append(self.object(
+            self.resources, f'<< /Font << {" ".join(fonts)} >> >>'
+        ))
+        data.append(self.object(
+            self.pages,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(self.kids)} >>'
+        ))
+        data.append(self.object(
+            self.catalog, f'<< /Type /Catalog /Pages {self.pages} 0 R >>'
+        ))
+        xref = self.position
+        data.append(self.write(
+            f'xref\n0 {self.numbers + 1}\n0000000000 65535 f \n'.encode()
+            + b''.join(
+                f'{self.offsets[number]:010d} 00000 n \n'.encode()
+                for number in range(1, self.numbers + 1)
+            )
+            + f'trailer\n<< /Size {self.numbers + 1} '
+            f'/Root {self.catalog} 0 R >>\n'
+            f'startxref\n{xref}\n%%EOF\n'.encode()
+        ))
+        return b''.join(data)
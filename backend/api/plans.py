@@ -0,0 +1,165 @@
+import json
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from recipes.autocomplete import ingredient_autocomplete
+from recipes.models import (
+    FavoriteRecipe,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCartLine,
+    ShoppingRecipe,
+    Tag
+)
+from users.models import Follow
+
+User = get_user_model()
+
+# Строка EXPLAIN QUERY PLAN SQLite о полном проходе таблицы:
+# «SCAN t» или «SCAN TABLE t», в отличие от «SCAN t USING INDEX».
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+# Псевдонимы таблиц в SQL Django: «"recipes_recipe" T4», «... U0».
+TABLE_ALIAS = re.compile(r'"(\w+)" ([A-Z]\d+)\b')
+
+
+def hot_queries(user):
+    """Запросы, которые API выполняет чаще всего: имя -> queryset.
+
+    Списки строятся так же, как в представлениях. Вместо агрегата
+    времени изменения и числа рецептов берётся выборка updated_at
+    тех же строк: EXPLAIN нужен queryset, а план доступа у них общий.
+    """
+    page = settings.PAGINATION_PAGE_SIZE
+    recipes = Recipe.objects.with_related()
+    author = User.objects.filter(recipes_count__gt=0).order_by(
+        '-followers_count'
+    ).first()
+    tag_ids = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+    recipe_ids = list(Recipe.objects.values_list('pk', flat=True)[:page])
+    author_ids = list(
+        Follow.objects.filter(user=user).values_list(
+            'following_id', flat=True
+        )[:page]
+    )
+    prefix = Ingredient.objects.order_by('pk').values_list(
+        'name', flat=True
+    ).first()[:3]
+
+    def stats(queryset):
+        return queryset.order_by().values_list('updated_at', flat=True)
+
+    return {
+        'recipes.list': recipes.all()[:page],
+        'recipes.list.favorites_count': recipes.order_by(
+            '-favorites_count', '-id'
+        )[:page],
+        'recipes.list.in_carts_count': recipes.order_by(
+            '-in_carts_count', '-id'
+        )[:page],
+        'recipes.list.author': recipes.filter(author=author)[:page],
+        'recipes.list.author.stats': stats(
+            Recipe.objects.filter(author=author)
+        ),
+        'recipes.list.tags': recipes.with_tags(tag_ids[:1])[:page],
+        'recipes.list.tags.all': recipes.with_tags(
+            tag_ids[:2], match_all=True
+        )[:page],
+        'recipes.list.is_favorited': recipes.filter(
+            is_favorited__user=user
+        )[:page],
+        'recipes.list.is_favorited.stats': stats(
+            Recipe.objects.filter(is_favorited__user=user)
+        ),
+        'recipes.list.is_in_shopping_cart': recipes.filter(
+            is_in_shopping_cart__user=user
+        )[:page],
+        'recipes.list.user_flags': recipes.with_user_flags(user)[:page],
+        'recipes.detail': recipes.filter(pk=recipe_ids[0]),
+        'recipes.prefetch.tags': Tag.objects.filter(
+            recipes__in=recipe_ids
+        ),
+        'recipes.prefetch.ingredients': RecipeIngredient.objects.filter(
+            recipe__in=recipe_ids
+        ).select_related('ingredient'),
+        'users.favorite_ids': FavoriteRecipe.objects.filter(
+            user=user
+        ).values_list('recipe_id', flat=True),
+        'users.shopping_cart_ids': ShoppingRecipe.objects.filter(
+            user=user
+        ).values_list('recipe_id', flat=True),
+        'users.following_ids': Follow.objects.filter(
+            user=user
+        ).values_list('following_id', flat=True),
+        'users.subscriptions': User.objects.filter(
+            followings__user=user
+        )[:page],
+        'users.subscriptions.recipes': Recipe.objects.filter(
+            author__in=author_ids
+        ),
+        'users.followers': Follow.objects.filter(
+            following=author
+        ).values_list('user_id', flat=True),
+        'feed': FeedEntry.objects.filter(user=user)[:page + 1],
+        'shopping_cart.download': ShoppingCartLine.objects.filter(
+            user=user
+        ).order_by('ingredient__name').values_list(
+            'ingredient__name', 'total_amount', 'ingredient__measurement_unit'
+        ),
+        'ingredients.search': ingredient_autocomplete.filter(
+            Ingredient.objects.all(), prefix
+        ),
+    }
+
+
+def table_rows(table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}'
+        )
+        return cursor.fetchone()[0]
+
+
+def analyze():
+    """Обновляет статистику планировщика: сразу после генерации
+    данных её может ещё не быть."""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def sequential_scans(queryset):
+    """Таблицы, которые план запроса читает целиком."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return postgresql_scans(plan[0]['Plan'])
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            aliases = {
+                alias: table for table, alias in TABLE_ALIAS.findall(sql)
+            }
+            return [
+                aliases.get(match.group(1), match.group(1)) for match in (
+                    SQLITE_SCAN.match(row[-1]) for row in cursor.fetchall()
+                ) if match
+            ]
+    raise NotImplementedError(
+        f'Планы запросов {connection.vendor} не поддерживаются.'
+    )
+
+
+def postgresql_scans(node):
+    scans = []
+    if node['Node Type'] == 'Seq Scan':
+        scans.append(node['Relation Name'])
+    for child in node.get('Plans', ()):
+        scans.extend(postgresql_scans(child))
+    return scans
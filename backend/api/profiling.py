@@ -0,0 +1,254 @@
+import json
+import logging
+import re
+import sqlite3
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from threading import Lock
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import render
+
+logger = logging.getLogger(__name__)
+
+# Замер текущего запроса: по нему потоки, в которые асинхронные
+# представления выносят запросы к базе, подключают его к своим
+# соединениям.
+current_profile = ContextVar('current_profile', default=None)
+
+REPEATED_SHAPES_KEPT = 3
+TRIM_EVERY = 100
+ORDERINGS = {
+    'total': 'total_p95',
+    'queries': 'queries_max',
+    'db': 'db_avg',
+    'serialize': 'serialize_avg',
+}
+
+
+def sql_shape(sql):
+    """Запрос без значений: одинаковые по форме запросы с разными
+    параметрами и длиной списков IN дают одну строку."""
+    shape = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    shape = re.sub(r'\b\d+\b', '?', shape)
+    shape = re.sub(
+        r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)', '(...)', shape
+    )
+    return re.sub(r'\s+', ' ', shape).strip()
+
+
+def view_label(request):
+    """Имя представления: класс и действие вьюсета или имя функции."""
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    cls = getattr(match.func, 'cls', None)
+    if cls is None:
+        return f'{request.method} {match.view_name}'
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{request.method} {cls.__name__}.{action}'
+
+
+class RequestProfile:
+    """Запросы к базе и время одного HTTP-запроса.
+
+    Экземпляр подключается через connection.execute_wrapper и считает
+    число запросов, их суммарное время и повторы одинаковых по форме
+    запросов.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self._lock = Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            # Под ASGI запросы одного HTTP-запроса идут из нескольких
+            # потоков сразу.
+            with self._lock:
+                self.db_time += elapsed
+                self.queries += 1
+                self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        """Формы запросов, повторённые больше threshold раз: признак N+1."""
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common(REPEATED_SHAPES_KEPT)
+            if count > threshold
+        ]
+
+    def sample(self, request, response):
+        finished = time.perf_counter()
+        total = finished - self.started
+        # Время Python-кода представления без запросов: для вьюсетов DRF
+        # это в основном сериализаторы и рендеринг ответа.
+        serialize = (
+            max(finished - self.view_started - self.db_time, 0.0)
+            if self.view_started is not None else 0.0
+        )
+        return {
+            'created': time.time(),
+            'view': view_label(request),
+            'status': response.status_code,
+            'queries': self.queries,
+            'db': self.db_time * 1000,
+            'serialize': serialize * 1000,
+            'total': total * 1000,
+            'size': (
+                None if response.streaming else len(response.content)
+            ),
+            'repeated': self.repeated(settings.PROFILING_N_PLUS_ONE_THRESHOLD),
+        }
+
+    def server_timing(self, sample):
+        return ', '.join(
+            f'{name};dur={sample[name]:.1f}'
+            for name in ('db', 'serialize', 'total')
+        )
+
+
+class MemoryProfileStore:
+    """Кольцевой буфер последних замеров в памяти процесса."""
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+
+    def add(self, sample):
+        self._samples.append(sample)
+
+    def samples(self):
+        return list(self._samples)
+
+
+class SQLiteProfileStore:
+    """Замеры в локальном файле SQLite, общем для воркеров машины.
+
+    Хранятся последние size записей; запись, которую не удалось
+    сохранить из-за блокировки, теряется, а не задерживает ответ.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._connection = None
+        self._inserted = 0
+        self._lock = Lock()
+
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.path, timeout=0.1, isolation_level=None,
+                check_same_thread=False
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS profile_sample ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)'
+            )
+        return self._connection
+
+    def add(self, sample):
+        with self._lock:
+            try:
+                cursor = self.connection().execute(
+                    'INSERT INTO profile_sample (data) VALUES (?)',
+                    (json.dumps(sample),)
+                )
+                self._inserted += 1
+                if self._inserted % TRIM_EVERY == 0:
+                    self._connection.execute(
+                        'DELETE FROM profile_sample WHERE id <= ?',
+                        (cursor.lastrowid - self.size,)
+                    )
+            except sqlite3.Error as error:
+                logger.warning('Замер запроса не сохранён: %s', error)
+
+    def samples(self):
+        with self._lock:
+            rows = self.connection().execute(
+                'SELECT data FROM profile_sample ORDER BY id DESC LIMIT ?',
+                (self.size,)
+            ).fetchall()
+        return [json.loads(data) for data, in reversed(rows)]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(samples, order='total'):
+    """Сводка по представлениям от самых дорогих и найденные N+1."""
+    views, repeated = {}, {}
+    for sample in samples:
+        views.setdefault(sample['view'], []).append(sample)
+        for shape, count in sample['repeated']:
+            key = (sample['view'], shape)
+            repeated[key] = max(repeated.get(key, 0), count)
+    rows = []
+    for view, items in views.items():
+        sizes = [item['size'] for item in items if item['size'] is not None]
+        rows.append({
+            'view': view,
+            'requests': len(items),
+            'queries_avg': sum(item['queries'] for item in items) / len(items),
+            'queries_max': max(item['queries'] for item in items),
+            'db_avg': sum(item['db'] for item in items) / len(items),
+            'serialize_avg': (
+                sum(item['serialize'] for item in items) / len(items)
+            ),
+            'total_p95': percentile([item['total'] for item in items], 0.95),
+            'size_avg': sum(sizes) / len(sizes) if sizes else None,
+            'n_plus_one': sum(bool(item['repeated']) for item in items),
+        })
+    rows.sort(key=lambda row: row[ORDERINGS[order]], reverse=True)
+    patterns = [
+        {'view': view, 'shape': shape, 'count': count}
+        for (view, shape), count in sorted(
+            repeated.items(), key=lambda item: item[1], reverse=True
+        )
+    ]
+    return rows, patterns
+
+
+def get_store():
+    if settings.PROFILING_SINK:
+        return SQLiteProfileStore(
+            settings.PROFILING_SINK, settings.PROFILING_BUFFER_SIZE
+        )
+    return MemoryProfileStore(settings.PROFILING_BUFFER_SIZE)
+
+
+profile_store = get_store()
+
+
+@staff_member_required
+def profiling_dashboard(request):
+    """Страница админки с самыми дорогими представлениями."""
+    order = request.GET.get('order')
+    if order not in ORDERINGS:
+        order = 'total'
+    rows, patterns = summarize(profile_store.samples(), order)
+    return render(request, 'admin/profiling.html', {
+        **admin.site.each_context(request),
+        'title': 'Профилирование запросов',
+        'rows': rows,
+        'patterns': patterns,
+        'order': order,
+        'orderings': ORDERINGS,
+        'enabled': settings.PROFILING_ENABLED,
+        'threshold': settings.PROFILING_N_PLUS_ONE_THRESHOLD,
+        'sink': settings.PROFILING_SINK or 'память процесса',
+    })
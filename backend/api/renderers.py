@@ -0,0 +1,104 @@
+import csv
+import json
+import os
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from rest_framework.renderers import BaseRenderer
+
+from api.pdf import PDFStream
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Строки списка отдаются генератором, поэтому память на запрос
+    не зависит от размера корзины.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Используется только для ответов с ошибками."""
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def stream(self, rows):
+        """Отдаёт файл по частям для строк (название, количество, единица)."""
+        raise NotImplementedError
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        for name, amount, measurement_unit in rows:
+            yield f'- {name}: {amount} {measurement_unit}.\n'.encode('utf-8')
+
+
+class _Echo:
+    """Псевдо-буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        ).encode('utf-8')
+        for row in rows:
+            yield writer.writerow(row).encode('utf-8')
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    line_height = 18
+    margin = 50
+
+    def get_font(self):
+        """Регистрирует шрифт с кириллицей, если он есть в системе."""
+        if self.font_name in pdfmetrics.getRegisteredFontNames():
+            return self.font_name
+        if not os.path.exists(settings.SHOPPING_LIST_PDF_FONT):
+            return 'Helvetica'
+        pdfmetrics.registerFont(
+            TTFont(self.font_name, settings.SHOPPING_LIST_PDF_FONT)
+        )
+        return self.font_name
+
+    def stream(self, rows):
+        """PDF отдаётся по страницам, по мере чтения строк списка."""
+        pdf = PDFStream(
+            A4, pdfmetrics.getFont(self.get_font()), self.font_size
+        )
+        try:
+            yield pdf.start()
+            _, height = A4
+            y = height - self.margin
+            lines = [(self.margin, y, 'Список покупок')]
+            for name, amount, measurement_unit in rows:
+                y -= self.line_height
+                if y < self.margin:
+                    yield pdf.page(lines)
+                    lines = []
+                    y = height - self.margin
+                lines.append((
+                    self.margin, y,
+                    f'- {name}: {amount} {measurement_unit}.'
+                ))
+            yield pdf.page(lines)
+            yield pdf.finish()
+        finally:
+            pdf.close()
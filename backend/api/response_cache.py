@@ -0,0 +1,265 @@
+import asyncio
+import time
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from api.async_views import offload
+from recipes.cache import get_versions
+
+RESPONSE_KEY = 'response:{}'
+LOCK_KEY = 'response:lock:{}'
+LOCK_POLL_SECONDS = 0.05
+
+
+class ResponseCache:
+    """Готовые ответы в кэше Django.
+
+    Запись хранит версии наборов данных, из которых собран ответ,
+    и действительна, пока ни одна из них не изменилась; TTL - запасной
+    срок на случай, если смену версии пропустили. Устаревшую запись
+    пересобирает один воркер: остальные тем временем отдают старую,
+    но не дольше lock_timeout секунд с начала первой пересборки - если
+    она не удалась, ответ не может оставаться старым до конца TTL.
+    Потом, как и без записи, ждут новую не больше lock_timeout секунд.
+    """
+
+    def __init__(self, ttl, lock_timeout):
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def get(self, key):
+        """Запись и признак того, что её версии актуальны."""
+        entry = cache.get(RESPONSE_KEY.format(key))
+        if entry is None:
+            return None, False
+        return entry, get_versions(entry['versions']) == entry['versions']
+
+    def set(self, key, entry):
+        if entry['status'] == 200:
+            cache.set(RESPONSE_KEY.format(key), entry, self.ttl)
+
+    def mark_stale(self, key, entry):
+        """Запоминает в записи, когда её начали пересобирать."""
+        if 'stale_since' not in entry:
+            entry['stale_since'] = time.time()
+            cache.set(RESPONSE_KEY.format(key), entry, self.ttl)
+
+    def servable(self, entry):
+        """Устаревшую запись можно отдать, пока её пересобирают."""
+        return entry is not None and (
+            time.time() - entry.get('stale_since', time.time())
+            < self.lock_timeout
+        )
+
+    def lock(self, key):
+        return cache.add(LOCK_KEY.format(key), True, self.lock_timeout)
+
+    def unlock(self, key):
+        cache.delete(LOCK_KEY.format(key))
+
+    def poll(self, key):
+        """Свежая запись; False, пока ключ занят другим воркером;
+        None, если тот закончил, а записи нет."""
+        entry, fresh = self.get(key)
+        if fresh:
+            return entry
+        if cache.get(LOCK_KEY.format(key)):
+            return False
+        return None
+
+    def fetch(self, key, build):
+        """Запись из кэша или собранная build()."""
+        entry, fresh = self.get(key)
+        if fresh:
+            return entry
+        if not self.lock(key):
+            if self.servable(entry):
+                return entry
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                entry = self.poll(key)
+                if entry is not False:
+                    break
+            return entry or build()
+        try:
+            if entry is not None:
+                self.mark_stale(key, entry)
+            entry = build()
+            self.set(key, entry)
+            return entry
+        finally:
+            self.unlock(key)
+
+    async def async_fetch(self, key, build):
+        """fetch для корутины build; ожидание не занимает поток."""
+        entry, fresh = await offload(self.get)(key)
+        if fresh:
+            return entry
+        if not await offload(self.lock)(key):
+            if self.servable(entry):
+                return entry
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+                entry = await offload(self.poll)(key)
+                if entry is not False:
+                    break
+            return entry or await build()
+        try:
+            if entry is not None:
+                await offload(self.mark_stale)(key, entry)
+            entry = await build()
+            await offload(self.set)(key, entry)
+            return entry
+        finally:
+            await offload(self.unlock)(key)
+
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_TTL, settings.RESPONSE_CACHE_LOCK_TIMEOUT
+)
+
+
+class AnonymousResponseCacheMixin:
+    """Ответы анонимам на GET к response_cache_actions из кэша.
+
+    Анонимы получают одинаковый ответ на одинаковый запрос, поэтому
+    ключ - действие, параметры запроса в порядке имён и тип ответа.
+    С параметрами не из response_cache_params ответ не кэшируется;
+    значения response_cache_multi_params упорядочиваются, порядок
+    остальных важен. Наследник описывает зависимости ответа: версии,
+    известные до запроса, и версии объектов из данных ответа.
+    Нужен ConditionalResponseMixin: из кэша отдаются и ответы 304.
+    """
+
+    response_cache_actions = ('list', 'retrieve')
+    response_cache_params = ()
+    response_cache_multi_params = ()
+    # Запрос уже обслуживается через кэш: асинхронное действие может
+    # передать его синхронному, и тот не должен ждать свою же запись.
+    response_cache_used = False
+
+    def get_response_dependencies(self, request):
+        """Имена версий, от которых зависит ответ на запрос."""
+        raise NotImplementedError
+
+    def get_data_dependencies(self, data):
+        """Имена версий объектов, попавших в ответ."""
+        raise NotImplementedError
+
+    def get_response_cache_key(self, request):
+        params = request.query_params
+        if (
+                not settings.RESPONSE_CACHE_TTL
+                or self.response_cache_used
+                or request.user.is_authenticated
+                or self.action not in self.response_cache_actions
+                or request.accepted_renderer.format != 'json'
+                or not set(params) <= set(self.response_cache_params)
+        ):
+            return None
+        query = urlencode([
+            (name, value) for name in sorted(params)
+            for value in (
+                sorted(params.getlist(name))
+                if name in self.response_cache_multi_params
+                else params.getlist(name)
+            )
+        ])
+        return md5(':'.join((
+            type(self).__name__,
+            self.action,
+            request.build_absolute_uri(request.path),
+            query,
+            request.accepted_media_type
+        )).encode()).hexdigest()
+
+    def make_cache_entry(self, request, response, versions):
+        """Отрендеренный ответ и версии, с которыми он собран."""
+        if isinstance(response, Response):
+            # Как в finalize_response, но заголовки ответа добавит
+            # dispatch уже к ответу из записи.
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+        if response.status_code == 200:
+            versions.update(get_versions(
+                self.get_data_dependencies(response.data)
+            ))
+        return {
+            'versions': versions,
+            'status': response.status_code,
+            'content': response.content,
+            'content_type': response.get('Content-Type'),
+            'etag': response.get('ETag'),
+            'timestamp': parse_http_date_safe(response.get('Last-Modified')),
+        }
+
+    def cached_response(self, request, entry):
+        response = get_conditional_response(
+            request, etag=entry['etag'], last_modified=entry['timestamp']
+        )
+        if response is None:
+            response = HttpResponse(
+                entry['content'],
+                status=entry['status'],
+                content_type=entry['content_type']
+            )
+        return self.finish_conditional(
+            response, entry['etag'], entry['timestamp']
+        )
+
+    def cached(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        self.response_cache_used = True
+
+        def build():
+            versions = get_versions(self.get_response_dependencies(request))
+            return self.make_cache_entry(
+                request, handler(request, *args, **kwargs), versions
+            )
+
+        return self.cached_response(
+            request, response_cache.fetch(key, build)
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+    async def async_dispatch(self, handler, request, *args, **kwargs):
+        async def cached_handler(request, *args, **kwargs):
+            key = self.get_response_cache_key(request)
+            if key is None:
+                return await handler(request, *args, **kwargs)
+            self.response_cache_used = True
+
+            async def build():
+                versions = await offload(get_versions)(
+                    self.get_response_dependencies(request)
+                )
+                return await offload(self.make_cache_entry)(
+                    request, await handler(request, *args, **kwargs),
+                    versions
+                )
+
+            return self.cached_response(
+                request, await response_cache.async_fetch(key, build)
+            )
+
+        return await super().async_dispatch(
+            cached_handler, request, *args, **kwargs
+        )
@@ -5,21 +5,87 @@ from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from api.authentication import make_signed_token
+from recipes.cache import ingredient_cache, tag_cache
+from recipes.images import (
+    decode_image,
+    rendition_urls,
+    schedule_renditions,
+    store_image
+)
+from recipes.matching import recipe_matcher
 from recipes.models import (
     FavoriteRecipe,
     Ingredient,
     Recipe,
     RecipeIngredient,
+    RecipeTag,
+    ShoppingCartLine,
     ShoppingRecipe,
     Tag
 )
-from users.serializers import CustomUserSerializer
+from users.serializers import AuthorSerializer
 
 User = get_user_model()
 
 
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Ищет объект в кэше справочника, а не отдельным запросом к базе."""
+
+    def __init__(self, reference_cache, **kwargs):
+        self.reference_cache = reference_cache
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            obj = self.reference_cache.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    """Декодирует base64 по частям во временный файл под именем из хэша
+    содержимого. В хранилище файл пишут create и update сериализатора,
+    чтобы ошибка в других полях не оставляла ничейных файлов;
+    уменьшенные копии создаются в фоне."""
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        try:
+            return decode_image(data)
+        except ValueError:
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+
+
+class RenditionsField(serializers.Field):
+    """Ссылки на копии изображения рецепта разных размеров."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        request = self.context.get('request')
+        return {
+            rendition: (
+                request.build_absolute_uri(url) if request and url else url
+            )
+            for rendition, url in rendition_urls(recipe).items()
+        }
+
+
 class IngredientAmountSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = CachedPrimaryKeyRelatedField(
+        reference_cache=ingredient_cache,
         queryset=Ingredient.objects.all(),
         required=True
     )
@@ -59,11 +125,12 @@ class TagSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
-    author = CustomUserSerializer(read_only=True)
+    author = AuthorSerializer(read_only=True)
     ingredients = IngredientRecipeSerializer(
         source='recipe_ingredients', many=True, read_only=True
     )
     image = Base64ImageField(required=True)
+    images = RenditionsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -78,11 +145,21 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
-            'cooking_time'
+            'cooking_time',
+            'favorites_count',
+            'in_carts_count'
         )
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_subscribed'):
+            instance.author.is_subscribed = instance.author_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'favorited'):
+            return obj.favorited
         request = self.context.get('request')
         return (request is not None and (
                 request.user.is_authenticated
@@ -90,6 +167,8 @@ class RecipeSerializer(serializers.ModelSerializer):
                 )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'in_shopping_cart'):
+            return obj.in_shopping_cart
         request = self.context.get('request')
         return (request is not None and (
                 request.user.is_authenticated
@@ -98,8 +177,23 @@ class RecipeSerializer(serializers.ModelSerializer):
                 )
 
 
+class CookableRecipeSerializer(RecipeSerializer):
+    missing_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('missing_ingredients',)
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+
+
 class CreateUpdateRecipeSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = CachedPrimaryKeyRelatedField(
+        reference_cache=tag_cache,
         queryset=Tag.objects.all(),
         many=True,
         required=True,
@@ -111,7 +205,7 @@ class CreateUpdateRecipeSerializer(serializers.ModelSerializer):
             'not_a_list': 'Укажите список тегов.'
         }
     )
-    author = CustomUserSerializer(read_only=True)
+    author = AuthorSerializer(read_only=True)
     ingredients = IngredientAmountSerializer(
         many=True,
         required=True,
@@ -123,7 +217,7 @@ class CreateUpdateRecipeSerializer(serializers.ModelSerializer):
             'not_a_list': 'Укажите список ингредиентов.'
         }
     )
-    image = Base64ImageField(
+    image = StreamingBase64ImageField(
         required=True,
         error_messages={
             'required': 'Необходимо добавить изображение.'
@@ -159,38 +253,118 @@ class CreateUpdateRecipeSerializer(serializers.ModelSerializer):
             'invalid': 'Недопустимое значение.'
         }
 
-    def update_or_create_recipe_ingredients(self, recipe, ingredients):
-        ingredients = [
+    def update_or_create_recipe_ingredients(
+        self, recipe, ingredients, created=False
+    ):
+        """Приводит состав рецепта к переданному одной вставкой, одним
+        обновлением и одним удалением.
+
+        Возвращает изменения количества ингредиентов во вставленных
+        и обновлённых строках: bulk-операции не отправляют сигналов,
+        и в списки покупок их переносит вызывающий. Удалённые строки
+        вычтет из списков сигнал post_delete.
+        """
+        new_amounts = {
+            ingredient.get('id').id: ingredient.get('amount')
+            for ingredient in ingredients
+        }
+        old_ids, stored, to_update, to_delete, deltas = (
+            set(), {}, [], [], {}
+        )
+        rows = () if created else RecipeIngredient.objects.filter(
+            recipe=recipe
+        )
+        for row in rows:
+            old_ids.add(row.ingredient_id)
+            if row.ingredient_id not in new_amounts:
+                to_delete.append(row.pk)
+                continue
+            stored[row.ingredient_id] = row
+            if row.amount != new_amounts[row.ingredient_id]:
+                deltas[row.ingredient_id] = (
+                    new_amounts[row.ingredient_id] - row.amount
+                )
+                row.amount = new_amounts[row.ingredient_id]
+                to_update.append(row)
+        if to_delete:
+            RecipeIngredient.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        to_create = [
             RecipeIngredient(
-                ingredient_id=ingredient.get('id').id,
-                recipe=recipe,
-                amount=ingredient.get('amount'),
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
             )
-            for ingredient in ingredients
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in stored
         ]
-        RecipeIngredient.objects.bulk_create(ingredients)
+        RecipeIngredient.objects.bulk_create(to_create)
+        for row in to_create:
+            deltas[row.ingredient_id] = row.amount
+        if new_amounts.keys() != old_ids:
+            recipe_matcher.recipe_changed(recipe.pk)
+        return deltas
+
+    def update_or_create_recipe_tags(self, recipe, tags, created=False):
+        """Добавляет новые теги рецепта и удаляет снятые."""
+        new_ids = {tag.id for tag in tags}
+        old_ids = set() if created else set(
+            RecipeTag.objects.filter(
+                recipe=recipe
+            ).values_list('tag_id', flat=True)
+        )
+        if old_ids - new_ids:
+            RecipeTag.objects.filter(
+                recipe=recipe, tag_id__in=old_ids - new_ids
+            ).delete()
+        RecipeTag.objects.bulk_create([
+            RecipeTag(recipe=recipe, tag_id=tag_id)
+            for tag_id in new_ids - old_ids
+        ])
 
     @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        validated_data['image'] = store_image(validated_data['image'])
         recipe = Recipe.objects.create(
             author=self.context.get('request').user,
             **validated_data
         )
-        recipe.tags.set(tags)
-        self.update_or_create_recipe_ingredients(recipe, ingredients)
+        self.update_or_create_recipe_tags(recipe, tags, created=True)
+        self.update_or_create_recipe_ingredients(
+            recipe, ingredients, created=True
+        )
+        schedule_renditions(recipe.image.name)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
-        self.update_or_create_recipe_ingredients(instance, ingredients)
+        self.update_or_create_recipe_tags(
+            instance, validated_data.pop('tags')
+        )
+        ShoppingCartLine.objects.update_recipe(
+            instance.pk,
+            self.update_or_create_recipe_ingredients(instance, ingredients)
+        )
+        if validated_data.get('image') is not None:
+            image = store_image(validated_data['image'])
+            validated_data['image'] = image
+            if image != instance.image.name:
+                validated_data['image_renditions'] = {}
+                schedule_renditions(image)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
-        serializer = RecipeSerializer(instance)
-        return serializer.data
+        """Созданный или изменённый рецепт в том же виде, что и при
+        чтении: с флагами пользователя и полными ссылками."""
+        recipes = Recipe.objects.with_related()
+        request = self.context.get('request')
+        if request is not None:
+            recipes = recipes.with_user_flags(request.user)
+        return RecipeSerializer(
+            recipes.get(pk=instance.pk), context=self.context
+        ).data
 
     def validate_image(self, value):
         if not value:
@@ -214,9 +388,30 @@ class CreateUpdateRecipeSerializer(serializers.ModelSerializer):
 
 
 class FavoriteShoppingSerializer(serializers.ModelSerializer):
+    images = RenditionsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPES_BATCH_MAX_SIZE
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.RECIPES_BATCH_MAX_SIZE
+    )
 
 
 class FavoriteShoppingSerializerMixin(serializers.ModelSerializer):
@@ -244,3 +439,12 @@ class ShoppingRecipeSerializer(FavoriteShoppingSerializerMixin):
     class Meta:
         model = ShoppingRecipe
         fields = ('user', 'recipe')
+
+
+class SignedTokenSerializer(serializers.Serializer):
+    """Ответ входа с подписанным токеном вместо ключа из базы."""
+
+    auth_token = serializers.SerializerMethodField()
+
+    def get_auth_token(self, obj):
+        return make_signed_token(obj.user)
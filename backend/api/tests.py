@@ -0,0 +1,809 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api.authentication import make_signed_token
+from api.renderers import PDFShoppingListRenderer
+from api.serializers import CreateUpdateRecipeSerializer
+from recipes.cache import get_version, recipe_version_name
+from recipes.models import (
+    FavoriteRecipe,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCartLine,
+    ShoppingRecipe,
+    Tag
+)
+from users.models import Follow
+
+User = get_user_model()
+
+
+def make_image():
+    buffer = BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        first_name=username, last_name=username, password='password'
+    )
+
+
+def create_recipe(author, amounts, name='Рецепт'):
+    """Рецепт с ингредиентами {ингредиент: количество}."""
+    recipe = Recipe.objects.create(
+        author=author, name=name, text='Описание', cooking_time=10,
+        image='recipes/images/recipe.png'
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in amounts.items()
+    )
+    return recipe
+
+
+RECIPES = 8
+# Число записей пагинатора, страница с флагами пользователя, теги
+# и ингредиенты страницы; ETag собирается из версий в кэше.
+LIST_QUERIES = 4
+# Рецепт, его теги и ингредиенты.
+DETAIL_QUERIES = 3
+
+
+@override_settings(RESPONSE_CACHE_TTL=0)
+class RecipeQueriesTest(APITestCase):
+    """Число запросов к базе на чтение рецептов не зависит от числа
+    рецептов, тегов и ингредиентов в ответе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Reader', last_name='Reader', password='password'
+        )
+        authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                first_name='Author', last_name='Author', password='password'
+            )
+            for number in range(2)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        for number in range(RECIPES):
+            recipe = Recipe.objects.create(
+                author=authors[number % 2], name=f'Рецепт {number}',
+                text='Описание', cooking_time=10,
+                image='recipes/images/recipe.png'
+            )
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=100
+                )
+                for ingredient in ingredients
+            )
+            FavoriteRecipe.objects.create(user=cls.user, recipe=recipe)
+            ShoppingRecipe.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, following=authors[0])
+        cls.recipe = recipe
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_queries(self, url, num):
+        # Первый запрос заполняет кэши справочников и версий.
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_list_anonymous(self):
+        self.assert_queries('/api/recipes/', LIST_QUERIES)
+
+    def test_list_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_queries('/api/recipes/', LIST_QUERIES)
+
+    def test_detail_anonymous(self):
+        self.assert_queries(
+            f'/api/recipes/{self.recipe.pk}/', DETAIL_QUERIES
+        )
+
+    def test_detail_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_queries(
+            f'/api/recipes/{self.recipe.pk}/', DETAIL_QUERIES
+        )
+
+    @override_settings(RESPONSE_CACHE_TTL=60)
+    def test_cached_list_anonymous(self):
+        self.assert_queries('/api/recipes/', 0)
+
+
+class QueryPlansTest(TestCase):
+    """Горячие запросы API не читают большие таблицы целиком на данных
+    объёма QUERY_PLANS_TEST_USERS; планы проверяются на той базе,
+    на которой запущены тесты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', users=settings.QUERY_PLANS_TEST_USERS,
+            stdout=StringIO()
+        )
+
+    def test_hot_queries_use_indexes(self):
+        call_command('check_query_plans', stdout=StringIO())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BatchTest(APITestCase):
+    """Пакетные операции возвращают результат по каждому рецепту."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('batch')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/images/recipe.png'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def recipe_data(self, name):
+        return {
+            'name': name, 'text': 'Описание', 'cooking_time': 5,
+            'tags': [self.tag.pk], 'image': make_image(),
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+        }
+
+    def batch_favorite(self, method, recipe_ids):
+        response = getattr(self.client, method)(
+            '/api/recipes/batch/favorite/', {'recipes': recipe_ids},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (result['id'], result['status'])
+            for result in response.json()['results']
+        ]
+
+    def test_batch_favorite(self):
+        pk = self.recipe.pk
+        self.assertEqual(
+            self.batch_favorite('post', [pk, 999, pk]),
+            [(pk, 'created'), (999, 'not_found')]
+        )
+        self.assertEqual(
+            self.batch_favorite('post', [pk]), [(pk, 'exists')]
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(
+            self.batch_favorite('delete', [pk]), [(pk, 'deleted')]
+        )
+        self.assertEqual(
+            self.batch_favorite('delete', [pk]), [(pk, 'missing')]
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_batch_create_reports_each_recipe(self):
+        create = CreateUpdateRecipeSerializer.create
+
+        def create_or_fail(serializer, validated_data):
+            recipe = create(serializer, validated_data)
+            if recipe.name == 'Сбой':
+                raise IntegrityError
+            return recipe
+
+        with mock.patch.object(
+                CreateUpdateRecipeSerializer, 'create', create_or_fail
+        ):
+            response = self.client.post('/api/recipes/batch/', {'recipes': [
+                self.recipe_data('Новый'),
+                dict(self.recipe_data('Без тегов'), tags=[]),
+                self.recipe_data('Сбой'),
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        created, invalid, failed = response.json()['results']
+        self.assertEqual(created['status'], 'created')
+        self.assertEqual(created['recipe']['name'], 'Новый')
+        self.assertEqual(invalid['status'], 'invalid')
+        self.assertIn('tags', invalid['errors'])
+        self.assertEqual(failed['status'], 'invalid')
+        self.assertIn('non_field_errors', failed['errors'])
+        self.assertEqual(
+            set(Recipe.objects.values_list('name', flat=True)),
+            {'Рецепт', 'Новый'}
+        )
+
+    def test_client_errors_are_not_server_errors(self):
+        """Обработчик исключений API не падает на ответах без 404."""
+        response = self.client.post(
+            '/api/recipes/batch/favorite/', {'recipes': ['x']},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recipes', response.json())
+        self.assertEqual(
+            self.client.get('/api/recipes/?cursor=x').status_code, 404
+        )
+        token = Token.objects.create(user=self.user)
+        token.delete()
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 401)
+
+
+class ImportTest(TestCase):
+    """Повторный импорт справочников ничего не добавляет, CSV и JSON
+    загружаются одинаково."""
+
+    INGREDIENTS = [
+        {'name': 'мука', 'measurement_unit': 'г'},
+        {'name': ' молоко ', 'measurement_unit': 'мл'},
+        {'name': 'мука', 'measurement_unit': 'г'},
+        {'name': 'мука', 'measurement_unit': 'кг'},
+        {'name': '', 'measurement_unit': 'г'},
+    ]
+    TAGS = [
+        {'id': 1, 'name': 'Завтрак', 'color': '#ED760E', 'slug': 'breakfast'},
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_csv(self, name, rows):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(','.join(rows[0]) + '\n')
+            for row in rows:
+                file.write(','.join(str(value) for value in row.values()))
+                file.write('\n')
+        return path
+
+    def write_json(self, name, rows):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(rows, file, ensure_ascii=False)
+        return path
+
+    def import_files(self, ingredients_path, tags_path):
+        out = StringIO()
+        call_command(
+            'import_csv', ingredients_path=ingredients_path,
+            tags_path=tags_path, stdout=out
+        )
+        return out.getvalue()
+
+    def assert_imported(self):
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('мука', 'г'), ('молоко', 'мл'), ('мука', 'кг')}
+        )
+        self.assertEqual(
+            list(Tag.objects.values_list('pk', 'name', 'color', 'slug')),
+            [(1, 'Завтрак', '#ED760E', 'breakfast')]
+        )
+
+    def test_csv_import_is_idempotent(self):
+        paths = (
+            self.write_csv('ingredients.csv', self.INGREDIENTS),
+            self.write_csv('tags.csv', self.TAGS),
+        )
+        output = self.import_files(*paths)
+        self.assertIn('ingredients: 5 rows, 3 added, 2 invalid', output)
+        self.assertIn('tags: 1 new, 0 changed', output)
+        output = self.import_files(*paths)
+        self.assertIn('ingredients: 5 rows, 0 added, 2 invalid', output)
+        self.assertIn('tags: 0 new, 0 changed', output)
+        self.assert_imported()
+
+    def test_json_import_matches_csv(self):
+        self.import_files(
+            self.write_csv('ingredients.csv', self.INGREDIENTS),
+            self.write_csv('tags.csv', self.TAGS)
+        )
+        output = self.import_files(
+            self.write_json('ingredients.json', self.INGREDIENTS),
+            self.write_json('tags.json', self.TAGS)
+        )
+        self.assertIn('ingredients: 5 rows, 0 added, 2 invalid', output)
+        self.assertIn('tags: 0 new, 0 changed', output)
+        self.assert_imported()
+        output = self.import_files(
+            self.write_json(
+                'more.json', [{'name': 'соль', 'measurement_unit': 'г'}]
+            ),
+            self.write_json('tags.json', [dict(self.TAGS[0], color='#000')])
+        )
+        self.assertIn('ingredients: 1 rows, 1 added', output)
+        self.assertIn('tags: 0 new, 1 changed', output)
+        self.assertEqual(Tag.objects.get().color, '#000')
+
+
+@override_settings(RESPONSE_CACHE_TTL=0, MEDIA_ROOT=tempfile.mkdtemp())
+class ShoppingCartTest(APITestCase):
+    """Строки списка покупок следуют за корзиной и рецептами,
+    расхождения находятся и исправляются, список выгружается
+    в txt, csv и pdf."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cart')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.flour, cls.milk, cls.eggs = (
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('Мука', 'г'), ('Молоко', 'мл'), ('Яйца', 'шт'))
+        )
+        cls.pancakes = create_recipe(
+            cls.user, {cls.flour: 100, cls.milk: 200}, 'Блины'
+        )
+        cls.cookies = create_recipe(
+            cls.user, {cls.flour: 50, cls.eggs: 2}, 'Печенье'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def lines(self):
+        return dict(ShoppingCartLine.objects.filter(
+            user=self.user
+        ).values_list('ingredient__name', 'total_amount'))
+
+    def cart(self, recipe, method='post'):
+        response = getattr(self.client, method)(
+            f'/api/recipes/{recipe.pk}/shopping_cart/'
+        )
+        self.assertLess(response.status_code, 300)
+
+    def rebuild(self, **kwargs):
+        out = StringIO()
+        call_command('rebuild_shopping_cart', stdout=out, **kwargs)
+        return out.getvalue()
+
+    def download(self, file_format):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': file_format}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="shopping_list.{file_format}"'
+        )
+        return response, b''.join(response.streaming_content)
+
+    def assert_valid_pdf(self, pdf):
+        """Смещения таблицы ссылок указывают на начала объектов."""
+        self.assertTrue(pdf.startswith(b'%PDF-1.4\n'))
+        self.assertTrue(pdf.endswith(b'%%EOF\n'))
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split()[0])
+        lines = pdf[xref:].split(b'\n')
+        self.assertEqual(lines[0], b'xref')
+        size = int(lines[1].split()[1])
+        for number, line in enumerate(lines[3:size + 2], start=1):
+            offset = int(line.split()[0])
+            self.assertTrue(
+                pdf[offset:].startswith(f'{number} 0 obj'.encode())
+            )
+
+    def test_lines_follow_cart(self):
+        self.cart(self.pancakes)
+        self.cart(self.cookies)
+        self.assertEqual(
+            self.lines(), {'Мука': 150, 'Молоко': 200, 'Яйца': 2}
+        )
+        self.cart(self.pancakes, 'delete')
+        self.assertEqual(self.lines(), {'Мука': 50, 'Яйца': 2})
+
+    def test_lines_follow_recipe_changes(self):
+        self.cart(self.pancakes)
+        self.cart(self.cookies)
+        response = self.client.patch(
+            f'/api/recipes/{self.pancakes.pk}/', {
+                'name': 'Блины', 'text': 'Описание', 'cooking_time': 10,
+                'tags': [self.tag.pk], 'image': make_image(),
+                'ingredients': [
+                    {'id': self.flour.pk, 'amount': 300},
+                    {'id': self.eggs.pk, 'amount': 1},
+                ],
+            }, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(), {'Мука': 350, 'Яйца': 3})
+        self.assertIn('Drifted lines: 0', self.rebuild(check=True))
+
+    def test_drift_is_reported_and_rebuilt(self):
+        self.cart(self.pancakes)
+        self.cart(self.cookies)
+        self.assertIn('Drifted lines: 0', self.rebuild(check=True))
+        ShoppingCartLine.objects.filter(ingredient=self.flour).update(
+            total_amount=1
+        )
+        output = self.rebuild(check=True)
+        self.assertIn(
+            f'user={self.user.pk} ingredient={self.flour.pk} '
+            f'stored=1 expected=150', output
+        )
+        self.assertIn('Drifted lines: 1', output)
+        self.assertEqual(self.lines()['Мука'], 1)
+        self.rebuild()
+        self.assertEqual(
+            self.lines(), {'Мука': 150, 'Молоко': 200, 'Яйца': 2}
+        )
+
+    def test_text_and_csv_export(self):
+        self.cart(self.pancakes)
+        self.cart(self.cookies)
+        _, content = self.download('txt')
+        self.assertEqual(
+            content.decode(),
+            '- Молоко: 200 мл.\n- Мука: 150 г.\n- Яйца: 2 шт.\n'
+        )
+        response, content = self.download('csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertEqual(
+            content.decode(),
+            'Ингредиент,Количество,Единица измерения\r\n'
+            'Молоко,200,мл\r\nМука,150,г\r\nЯйца,2,шт\r\n'
+        )
+
+    def test_pdf_export(self):
+        self.cart(self.pancakes)
+        response, content = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assert_valid_pdf(content)
+        self.assertIn(b'/Count 1 ', content)
+
+    def test_pdf_is_written_page_by_page(self):
+        rows = [(f'Ингредиент {number}', number, 'г') for number in range(100)]
+        chunks = list(PDFShoppingListRenderer().stream(iter(rows)))
+        # Начало файла, три страницы и общие объекты в конце.
+        self.assertEqual(len(chunks), 5)
+        content = b''.join(chunks)
+        self.assert_valid_pdf(content)
+        self.assertEqual(content.count(b'/Type /Page '), 3)
+        self.assertIn(b'/Count 3 ', content)
+
+
+@override_settings(RESPONSE_CACHE_TTL=0)
+class KeysetPaginationTest(APITestCase):
+    """Курсор проходит ленту рецептов без пропусков и повторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('keyset')
+        for number in range(5):
+            create_recipe(author, {}, f'Рецепт {number}')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_follow_cursor(self):
+        url, ids = '/api/recipes/?cursor=&limit=2', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertIsNone(data['count'])
+            self.assertLessEqual(len(data['results']), 2)
+            ids += [recipe['id'] for recipe in data['results']]
+            url = data['next']
+        self.assertEqual(ids, list(
+            Recipe.objects.order_by('-created_at', '-pk').values_list(
+                'pk', flat=True
+            )
+        ))
+
+    def test_exact_count(self):
+        response = self.client.get('/api/recipes/?cursor=&count=exact')
+        self.assertEqual(response.json()['count'], 5)
+
+
+@override_settings(RESPONSE_CACHE_TTL=0)
+class FeedTest(APITestCase):
+    """Лента подписок: рецепты раскладываются подписчикам при
+    публикации, у популярных авторов читаются при запросе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author, {}, 'Старый')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+    def feed(self, **params):
+        response = self.client.get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def subscribe(self, method='post'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                f'/api/users/{self.author.pk}/subscribe/'
+            )
+        self.assertLess(response.status_code, 300)
+
+    def publish(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_recipe(self.author, {}, name)
+
+    def test_fan_out_on_write(self):
+        self.assertEqual(self.feed(), [])
+        self.subscribe()
+        self.assertEqual(self.feed(), [self.recipe.pk])
+        recipe = self.publish('Новый')
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.reader).count(), 2
+        )
+        self.assertEqual(self.feed(), [recipe.pk, self.recipe.pk])
+        self.subscribe('delete')
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_author_is_read_on_request(self):
+        self.subscribe()
+        recipe = self.publish('Новый')
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.feed(), [recipe.pk, self.recipe.pk])
+        self.assertEqual(self.feed(limit=1), [recipe.pk])
+
+
+@override_settings(RESPONSE_CACHE_TTL=0)
+class CookableTest(APITestCase):
+    """Поиск по продуктам: сначала рецепты, для которых есть всё."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('cook')
+        cls.a, cls.b, cls.c, cls.d = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in 'abcd'
+        )
+        cls.ab = create_recipe(author, {cls.a: 1, cls.b: 1})
+        cls.ac = create_recipe(author, {cls.a: 1, cls.c: 1})
+        cls.only_d = create_recipe(author, {cls.d: 1})
+        cls.abc = create_recipe(author, {cls.a: 1, cls.b: 1, cls.c: 1})
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, *ingredients):
+        response = self.client.get(
+            '/api/recipes/cookable/',
+            {'ingredients': [ingredient.pk for ingredient in ingredients]}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (recipe['id'], recipe['missing_ingredients'])
+            for recipe in response.json()['results']
+        ]
+
+    def test_full_matches_first(self):
+        self.assertEqual(self.search(self.a, self.b), [
+            (self.ab.pk, 0), (self.abc.pk, 1), (self.ac.pk, 1)
+        ])
+
+    def test_index_follows_recipe_changes(self):
+        self.search(self.a)
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(
+                recipe=self.only_d, ingredient=self.a, amount=1
+            )
+        self.assertIn((self.only_d.pk, 1), self.search(self.a))
+
+
+class TokenRevocationTest(APITestCase):
+    """Токены перестают действовать при выходе и смене учётных данных,
+    но не при других правках профиля."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('token')
+
+    def setUp(self):
+        cache.clear()
+
+    def me(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return self.client.get('/api/users/me/').status_code
+
+    def logout(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.assertEqual(
+            self.client.post('/api/auth/token/logout/').status_code, 204
+        )
+
+    def test_logout_revokes_token(self):
+        response = self.client.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'password'
+        })
+        token = response.json()['auth_token']
+        self.assertEqual(self.me(token), 200)
+        self.logout(token)
+        self.assertEqual(self.me(token), 401)
+
+    @override_settings(AUTH_SIGNED_TOKENS=True)
+    def test_signed_token_revocation(self):
+        token = make_signed_token(self.user)
+        self.assertEqual(self.me(token), 200)
+        self.user.recipes_count = 3
+        self.user.save(update_fields=['recipes_count'])
+        self.assertEqual(self.me(token), 200)
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertEqual(self.me(token), 401)
+        token = make_signed_token(self.user)
+        self.assertEqual(self.me(token), 200)
+        self.user.first_name = 'Другое'
+        self.user.save()
+        self.assertEqual(self.me(token), 401)
+        token = make_signed_token(self.user)
+        self.assertEqual(self.me(token), 200)
+        self.logout(token)
+        self.assertEqual(self.me(token), 401)
+        token = make_signed_token(User.objects.get(pk=self.user.pk))
+        self.assertEqual(self.me(token), 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.me(token), 401)
+
+
+@override_settings(RESPONSE_CACHE_TTL=0)
+class ConditionalResponseTest(APITestCase):
+    """Рецепты отвечают 304 на If-None-Match, пока не изменились."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author, {})
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+    def get_etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def assert_changed(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def check_changes(self, url):
+        etag = self.get_etag(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assert_changed(url, etag)
+        etag = self.get_etag(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Новое название'
+            self.recipe.save()
+        self.assert_changed(url, etag)
+        self.client.force_authenticate(None)
+        self.assertNotEqual(self.get_etag(url), etag)
+
+    def test_list(self):
+        self.check_changes('/api/recipes/')
+
+    def test_detail(self):
+        self.check_changes(f'/api/recipes/{self.recipe.pk}/')
+
+
+class RecountTest(TestCase):
+    """recount находит расхождения счётчиков, исправляет их и сбрасывает
+    кэш ответов изменённых записей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author, {})
+        create_recipe(cls.author, {}, 'Другой')
+        FavoriteRecipe.objects.create(user=reader, recipe=cls.recipe)
+        Follow.objects.create(user=reader, following=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def recount(self, **kwargs):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('recount', stdout=out, **kwargs)
+        return out.getvalue()
+
+    def counters(self):
+        return (
+            dict(Recipe.objects.values_list('pk', 'favorites_count')),
+            User.objects.filter(pk=self.author.pk).values_list(
+                'recipes_count', 'followers_count'
+            ).get()
+        )
+
+    def corrupt(self):
+        Recipe.objects.update(favorites_count=3)
+        User.objects.filter(pk=self.author.pk).update(
+            recipes_count=0, followers_count=5
+        )
+
+    def test_check_only_reports(self):
+        self.corrupt()
+        corrupted = self.counters()
+        output = self.recount(check=True)
+        self.assertIn('recipes.Recipe.favorites_count: 2 drifted', output)
+        self.assertIn('users.CreateUser.recipes_count: 1 drifted', output)
+        self.assertIn('users.CreateUser.followers_count: 1 drifted', output)
+        self.assertEqual(self.counters(), corrupted)
+
+    def test_fixes_drift_and_bumps_versions(self):
+        expected = self.counters()
+        self.corrupt()
+        version = get_version(recipe_version_name(self.recipe.pk))
+        self.recount()
+        self.assertEqual(self.counters(), expected)
+        self.assertNotEqual(
+            get_version(recipe_version_name(self.recipe.pk)), version
+        )
+        self.assertNotIn('1 drifted', self.recount(check=True))
@@ -1,7 +1,7 @@
 from http import HTTPStatus
 
 from django.conf import settings
-from django.http import FileResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework.views import exception_handler
 
@@ -9,16 +9,25 @@ from rest_framework.views import exception_handler
 def page_not_found(exc, context):
     """Для обработки кастомной страниы с ошибкой 404."""
     response = exception_handler(exc, context)
-    if not settings.DEBUG:
-        if response.data['status_code'] == HTTPStatus.NOT_FOUND:
-            return render(context.get("request"), 'pages/404.html',
-                          status=HTTPStatus.NOT_FOUND)
+    if (
+            not settings.DEBUG
+            and response is not None
+            and response.status_code == HTTPStatus.NOT_FOUND
+    ):
+        return render(context.get("request"), 'pages/404.html',
+                      status=HTTPStatus.NOT_FOUND)
     return response
 
 
-def download_file(data, name):
-    """Метод для скачивания файла."""
-    with open(f'{name}.txt', '+w', encoding='utf-8') as file:
-        file.write(data)
-        file.close()
-    return FileResponse(open(f'{name}.txt', 'rb'))
+def download_file(rows, name, renderer):
+    """Отдаёт файл потоком, не сохраняя его на диск."""
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    response = StreamingHttpResponse(
+        renderer.stream(rows), content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{name}.{renderer.format}"'
+    )
+    return response
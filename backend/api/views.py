@@ -1,4 +1,8 @@
-from django.db.models import Sum
+import asyncio
+
+from django.db import DatabaseError, transaction
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
@@ -8,29 +12,109 @@ from rest_framework.permissions import (
     IsAuthenticated,
     IsAuthenticatedOrReadOnly
 )
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
-from api.filters import IngredientSearchFilter, RecipeSearchFilter
+from api.async_views import AsyncViewSetMixin, offload
+from api.conditional import ConditionalResponseMixin
+from api.filters import (
+    IngredientSearchFilter,
+    RecipeSearchFilter,
+    UniqueOrderingFilter
+)
+from api.pagination import (
+    FeedPagination,
+    PageSizeNumberPagination,
+    RecipePagination
+)
 from api.permissions import IsOwnerOrReadOnly
+from api.renderers import (
+    CSVShoppingListRenderer,
+    PDFShoppingListRenderer,
+    TextShoppingListRenderer
+)
+from api.response_cache import AnonymousResponseCacheMixin
 from api.serializers import (
+    CookableQuerySerializer,
+    CookableRecipeSerializer,
     CreateUpdateRecipeSerializer,
     FavoriteRecipeSerializer,
     IngredientSerializer,
+    RecipeBatchSerializer,
+    RecipeIdsSerializer,
     RecipeSerializer,
     ShoppingRecipeSerializer,
     TagSerializer
 )
 from api.utils import download_file
+from foodgram.db.routers import ReplicaReadMixin
+from recipes.cache import (
+    RECIPE_COUNTERS_VERSION,
+    RECIPES_VERSION,
+    USERS_VERSION,
+    author_recipes_version_name,
+    author_version_name,
+    get_version,
+    get_versions,
+    ingredient_cache,
+    recipe_version_name,
+    tag_cache
+)
+from recipes.feed import feed_sources
+from recipes.matching import recipe_matcher
 from recipes.models import (
     FavoriteRecipe,
     Ingredient,
     Recipe,
+    ShoppingCartLine,
     ShoppingRecipe,
-    Tag
+    Tag,
+    lock_users
 )
+from recipes.signals import relations_created_in_bulk
+from users.models import Follow
+
+
+class ReferenceViewSetMixin(ConditionalResponseMixin):
+    """Отдаёт справочник из кэша процесса без запросов к базе."""
+
+    reference_cache = None
+
+    def get_validators(self, request):
+        return (get_version(self.reference_cache.version_name),), None
 
+    def render_list(self, objects):
+        return JSONRenderer().render(
+            self.get_serializer(objects, many=True).data
+        )
+
+    def cached_list(self, request, *args, **kwargs):
+        return HttpResponse(
+            self.reference_cache.serialized('list', self.render_list),
+            content_type='application/json'
+        )
+
+    def list(self, request, *args, **kwargs):
+        if (
+                request.query_params
+                or request.accepted_renderer.format != 'json'
+        ):
+            return super().list(request, *args, **kwargs)
+        return self.conditional(self.cached_list, request, *args, **kwargs)
+
+    def get_object(self):
+        try:
+            obj = self.reference_cache.get(int(self.kwargs['pk']))
+        except ValueError:
+            obj = None
+        if obj is None:
+            raise Http404
+        return obj
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+
+class IngredientViewSet(AsyncViewSetMixin, ReplicaReadMixin,
+                        ReferenceViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    reference_cache = ingredient_cache
     pagination_class = None
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -38,42 +122,277 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientSearchFilter
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(AsyncViewSetMixin, ReplicaReadMixin, ReferenceViewSetMixin,
+                 viewsets.ReadOnlyModelViewSet):
+    reference_cache = tag_cache
     pagination_class = None
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousResponseCacheMixin, AsyncViewSetMixin,
+                    ReplicaReadMixin, ConditionalResponseMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     http_method_names = ('delete', 'get', 'patch', 'post')
     permission_classes = (IsOwnerOrReadOnly, IsAuthenticatedOrReadOnly)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, UniqueOrderingFilter)
     filterset_class = RecipeSearchFilter
+    ordering_fields = ('created_at', 'favorites_count', 'in_carts_count')
+    pagination_class = RecipePagination
+    response_cache_params = (
+        'author', 'tags', 'tags_mode', 'page', 'limit', 'cursor',
+        'ordering', 'search', 'is_favorited', 'is_in_shopping_cart'
+    )
+    response_cache_multi_params = ('tags',)
+
+    def get_queryset(self):
+        """Для чтения собираем один аннотированный запрос,
+        чтобы число запросов не зависело от размера страницы."""
+        if self.request.method != 'GET':
+            return self.queryset.all()
+        return self.queryset.with_related().with_user_flags(self.request.user)
+
+    def get_validators(self, request):
+        """ETag собираем из версий наборов данных, которые меняются
+        после фиксации каждой правки, без запросов к базе: состава
+        списков, рецепта, счётчиков, авторов, справочников и связей
+        пользователя. Без общего кэша чужая правка меняет ETag не позже
+        чем через CACHE_VERSION_TIMEOUT, как и в кэше ответов.
+        Last-Modified не отдаём: по времени изменения не видны удаления
+        из списка, правки авторов, тегов и ингредиентов."""
+        names = [
+            *self.get_response_dependencies(request),
+            RECIPE_COUNTERS_VERSION,
+            USERS_VERSION
+        ]
+        if self.action == 'retrieve':
+            if not str(self.kwargs.get('pk')).isdigit():
+                return None
+            names.append(recipe_version_name(self.kwargs['pk']))
+        versions = get_versions(names)
+        etag_parts = (
+            *(versions[name] for name in names),
+            *self.get_user_etag_parts(request)
+        )
+        return etag_parts, None
+
+    def get_response_dependencies(self, request):
+        """Ответы зависят от справочников и состава списка; список
+        только по автору меняется лишь с рецептами этого автора."""
+        names = [tag_cache.version_name, ingredient_cache.version_name]
+        if self.action == 'retrieve':
+            return names
+        params = request.query_params
+        author = params.get('author', '')
+        if (
+                author.isdigit()
+                and set(params) <= {'author', 'page', 'limit', 'cursor'}
+        ):
+            names.append(author_recipes_version_name(author))
+        else:
+            names.append(RECIPES_VERSION)
+        ordering = params.get('ordering', '')
+        if 'favorites_count' in ordering or 'in_carts_count' in ordering:
+            names.append(RECIPE_COUNTERS_VERSION)
+        return names
+
+    def get_data_dependencies(self, data):
+        recipes = data['results'] if self.action == 'list' else [data]
+        return [
+            name for recipe in recipes for name in (
+                recipe_version_name(recipe['id']),
+                author_version_name(recipe['author']['id'])
+            )
+        ]
+
+    def get_user_flag_queries(self):
+        """Флаг with_user_flags, поле рецепта и запрос множества id,
+        по которому флаг вычисляется без подзапроса на каждую строку."""
+        user = self.request.user
+        if not user.is_authenticated:
+            return ()
+        return (
+            ('favorited', 'pk', FavoriteRecipe.objects.filter(
+                user=user
+            ).values_list('recipe_id', flat=True)),
+            ('in_shopping_cart', 'pk', ShoppingRecipe.objects.filter(
+                user=user
+            ).values_list('recipe_id', flat=True)),
+            ('author_subscribed', 'author_id', Follow.objects.filter(
+                user=user
+            ).values_list('following_id', flat=True)),
+        )
+
+    async def get_user_flags(self):
+        queries = self.get_user_flag_queries()
+        found = await asyncio.gather(
+            *(offload(set)(query) for _, _, query in queries)
+        )
+        return [
+            (flag, field, ids)
+            for (flag, field, _), ids in zip(queries, found)
+        ]
+
+    @staticmethod
+    def set_user_flags(recipes, flags):
+        for recipe in recipes:
+            for flag, field, ids in flags:
+                setattr(recipe, flag, getattr(recipe, field) in ids)
+
+    async def async_list(self, request, *args, **kwargs):
+        """list, в котором строки страницы, число рецептов и id
+        избранного, списка покупок и подписок пользователя читаются
+        параллельно."""
+        paginator = self.paginator
+        keyset = (
+            paginator.keyset_class() if paginator.is_keyset(request)
+            else None
+        )
+        bounds = None if keyset else paginator.page_bounds(request)
+        if keyset is None and bounds is None:
+            return await offload(self.list)(request, *args, **kwargs)
+        queryset = await offload(self.filter_queryset)(Recipe.objects.all())
+        if keyset is None:
+            number, bottom, top = bounds
+            page = queryset.with_related()[bottom:top]
+        else:
+            page = keyset.page_queryset(queryset.with_related(), request)
+        count = (
+            offload(queryset.count)() if keyset is None
+            else offload(keyset.get_count)(queryset, request)
+        )
+        total, rows, flags = await asyncio.gather(
+            count, offload(list)(page), self.get_user_flags()
+        )
+        etag, timestamp, response = self.check_conditional(
+            request, await offload(self.get_validators)(request)
+        )
+        if response is None:
+            paginator.keyset = keyset
+            if keyset is None:
+                rows = paginator.paginate_rows(rows, total, number, request)
+            else:
+                rows = keyset.paginate_rows(rows, total, request)
+            self.set_user_flags(rows, flags)
+            response = paginator.get_paginated_response(
+                await offload(self.serialize)(rows, many=True)
+            )
+        return self.finish_conditional(response, etag, timestamp)
+
+    async def async_retrieve(self, request, *args, **kwargs):
+        """retrieve, в котором рецепт и флаги пользователя читаются
+        параллельно."""
+        pk = self.kwargs['pk']
+        if not str(pk).isdigit():
+            return await offload(self.retrieve)(request, *args, **kwargs)
+        queryset = await offload(self.filter_queryset)(Recipe.objects.all())
+        validators, rows, flags = await asyncio.gather(
+            offload(self.get_validators)(request),
+            offload(list)(queryset.with_related().filter(pk=pk)),
+            self.get_user_flags()
+        )
+        if not rows:
+            raise Http404
+        etag, timestamp, response = self.check_conditional(
+            request, validators
+        )
+        if response is None:
+            self.check_object_permissions(request, rows[0])
+            self.set_user_flags(rows, flags)
+            response = Response(await offload(self.serialize)(rows[0]))
+        return self.finish_conditional(response, etag, timestamp)
 
     def create_or_delete_related_record(
             self, request, pk, related_model, serializer
     ):
-        """Функция для создания или удаления связанной с рецептом записи."""
+        """Функция для создания или удаления связанной с рецептом записи.
+
+        Связи пользователя меняются под блокировкой его строки, поэтому
+        проверка наличия связи не расходится с тем, что затем будет
+        вставлено или удалено, а счётчики и список покупок сигналы
+        меняют ровно по изменённым записям.
+        """
         if request.method == 'POST':
             serializer = serializer(
                 data={'user': request.user.id, 'recipe': pk},
                 context={'request': request}
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                lock_users([request.user.pk])
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         recipe = get_object_or_404(Recipe, pk=pk)
-        if not related_model.objects.filter(
+        with transaction.atomic():
+            lock_users([request.user.pk])
+            if not related_model.objects.filter(
+                    user=request.user, recipe=recipe
+            ).exists():
+                raise ValidationError('Такого рецепта нет в списке.')
+            related_model.objects.filter(
                 user=request.user, recipe=recipe
-        ).exists():
-            raise ValidationError('Такого рецепта нет в списке.')
-        related_model.objects.filter(user=request.user, recipe=recipe).delete()
+            ).delete()
         return Response(
             'Рецепт удалён из избранного.', status.HTTP_204_NO_CONTENT
         )
 
+    def batch_related_records(self, request, related_model):
+        """Добавляем или удаляем связи с несколькими рецептами сразу.
+
+        Рецепты и уже существующие связи читаются одним запросом,
+        новые записи вставляются одним bulk_create. Строка пользователя
+        заблокирована до конца транзакции, как и при изменении одной
+        связи, поэтому прочитанные связи не меняются параллельными
+        запросами, и счётчики сдвигаются ровно для вставленных
+        и удалённых записей. Статус рецепта следует из прочитанных
+        связей: created - для тех, которых не было. Связь, вставленную
+        в обход блокировки (админка, shell), bulk_create пропускает,
+        а не прерывает весь пакет ошибкой; сдвинутый ею счётчик
+        исправит команда recount.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        user = request.user
+        with transaction.atomic():
+            lock_users([user.pk])
+            stored = dict(Recipe.objects.filter(
+                pk__in=recipe_ids
+            ).annotate(stored=Exists(related_model.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))).order_by().values_list('pk', 'stored'))
+            if request.method == 'POST':
+                changed = [pk for pk in stored if not stored[pk]]
+                related_model.objects.bulk_create(
+                    [
+                        related_model(user=user, recipe_id=pk)
+                        for pk in changed
+                    ],
+                    ignore_conflicts=True
+                )
+                relations_created_in_bulk(related_model, user.pk, changed)
+                done, skipped = 'created', 'exists'
+            else:
+                changed = [pk for pk in stored if stored[pk]]
+                if changed:
+                    related_model.objects.filter(
+                        user=user, recipe_id__in=changed
+                    ).delete()
+                done, skipped = 'deleted', 'missing'
+        changed = set(changed)
+        return Response({'results': [
+            {
+                'id': pk,
+                'status': (
+                    'not_found' if pk not in stored
+                    else done if pk in changed else skipped
+                )
+            }
+            for pk in recipe_ids
+        ]})
+
     def get_serializer_class(self):
         """Выбирает сериализатор, в зависимости от метода запроса."""
         if self.request.method == 'GET':
@@ -113,23 +432,147 @@ class RecipeViewSet(viewsets.ModelViewSet):
         methods=['GET'],
         permission_classes=[IsAuthenticated]
     )
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь."""
+        paginator = FeedPagination()
+        recipe_ids = paginator.paginate_queryset(
+            feed_sources(request.user), request, view=self
+        )
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        return paginator.get_paginated_response(self.get_serializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True
+        ).data)
+
+    @action(detail=False, methods=['GET'])
+    def cookable(self, request):
+        """Рецепты из имеющихся продуктов: сначала те, для которых есть
+        всё, затем с наименьшим числом недостающих ингредиентов."""
+        query = CookableQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        paginator = PageSizeNumberPagination()
+        page = paginator.paginate_queryset(
+            recipe_matcher.match(query.validated_data['ingredients']),
+            request,
+            view=self
+        )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page]
+        )
+        for recipe_id, missing in page:
+            if recipe_id in recipes:
+                recipes[recipe_id].missing_ingredients = missing
+        return paginator.get_paginated_response(CookableRecipeSerializer(
+            [
+                recipes[recipe_id]
+                for recipe_id, _ in page if recipe_id in recipes
+            ],
+            many=True,
+            context=self.get_serializer_context()
+        ).data)
+
+    @action(
+        detail=False,
+        methods=['POST'],
+        url_path='batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def batch(self, request):
+        """Создаём несколько рецептов, результат - по каждому из них.
+
+        Теги и ингредиенты проверяются по кэшу справочников, без
+        запросов; корректные рецепты сохраняются в одной транзакции,
+        каждый в своей точке сохранения: ошибка при сохранении одного
+        откатывает только его и возвращается в его результате.
+        """
+        batch = RecipeBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        serializers = [
+            CreateUpdateRecipeSerializer(
+                data=data, context=self.get_serializer_context()
+            )
+            for data in batch.validated_data['recipes']
+        ]
+        errors = [
+            None if serializer.is_valid() else serializer.errors
+            for serializer in serializers
+        ]
+        with transaction.atomic():
+            for number, serializer in enumerate(serializers):
+                if errors[number] is not None:
+                    continue
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                except ValidationError as error:
+                    errors[number] = error.detail
+                except DatabaseError:
+                    errors[number] = {'non_field_errors': [
+                        'Не удалось сохранить рецепт.'
+                    ]}
+        recipes = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).in_bulk([
+            serializer.instance.pk
+            for serializer, error in zip(serializers, errors) if error is None
+        ])
+        return Response({'results': [
+            {
+                'status': 'created',
+                'recipe': RecipeSerializer(
+                    recipes[serializer.instance.pk],
+                    context=self.get_serializer_context()
+                ).data
+            } if error is None else {
+                'status': 'invalid',
+                'errors': error
+            }
+            for serializer, error in zip(serializers, errors)
+        ]})
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='batch/favorite',
+        url_name='batch-favorite',
+        permission_classes=[IsAuthenticated]
+    )
+    def batch_favorite(self, request):
+        """Добавляем или удаляем несколько рецептов из избранного."""
+        return self.batch_related_records(request, FavoriteRecipe)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='batch/shopping_cart',
+        url_name='batch-shopping-cart',
+        permission_classes=[IsAuthenticated]
+    )
+    def batch_shopping_cart(self, request):
+        """Добавляем или удаляем несколько рецептов из списка покупок."""
+        return self.batch_related_records(request, ShoppingRecipe)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=(
+            TextShoppingListRenderer,
+            CSVShoppingListRenderer,
+            PDFShoppingListRenderer
+        )
+    )
     def download_shopping_cart(self, request):
-        """Получить и скачать список покупок в файле."""
-        purchases_list = self.queryset.filter(
-            is_in_shopping_cart__user=request.user
-        ).values(
-            'ingredients__name', 'ingredients__measurement_unit'
+        """Получить и скачать список покупок в формате txt, csv или pdf."""
+        purchases_list = ShoppingCartLine.objects.filter(
+            user=request.user
         ).order_by(
-            'ingredients__name'
-        ).annotate(
-            amount=Sum('recipe_ingredients__amount')
-        )
-        shopping_list = '\n'.join(
-            '- {}: {} {}.'.format(
-                ingredient.get('ingredients__name'),
-                ingredient.get('amount'),
-                ingredient.get('ingredients__measurement_unit')
-            )
-            for ingredient in purchases_list
+            'ingredient__name'
+        ).values_list(
+            'ingredient__name', 'total_amount', 'ingredient__measurement_unit'
+        )
+        return download_file(
+            purchases_list.iterator(),
+            'shopping_list',
+            request.accepted_renderer
         )
-        return download_file(shopping_list, 'shopping_list.txt')
@@ -0,0 +1,78 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+PRIMARY_KEY = 'db:primary:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Реплика, с которой читает текущий запрос; None - основная база.
+# ContextVar, а не threading.local: значение видят и потоки,
+# в которые асинхронные представления выносят запросы к базе.
+read_database = ContextVar('read_database', default=None)
+
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def pin_to_primary(user_id):
+    """После записи пользователь читает из основной базы
+    DB_REPLICA_STICKY_SECONDS секунд, пока реплики догоняют её."""
+    cache.set(
+        PRIMARY_KEY.format(user_id), True, settings.DB_REPLICA_STICKY_SECONDS
+    )
+
+
+def read_from_replica(user):
+    """Направляет чтения текущего запроса на случайную реплику,
+    если пользователь недавно ничего не менял."""
+    aliases = replicas()
+    if not aliases:
+        return
+    if user.is_authenticated and cache.get(PRIMARY_KEY.format(user.pk)):
+        return
+    read_database.set(random.choice(aliases))
+
+
+def read_from_primary():
+    read_database.set(None)
+
+
+class ReplicaRouter:
+    """Чтения, которые представление разрешило вести с реплики,
+    идут на неё, всё остальное - в основную базу.
+
+    Реплики - копии основной базы, поэтому связи между объектами
+    из разных баз допустимы, а миграции выполняются только
+    на основной.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """Безопасные запросы к действиям replica_actions вьюсета
+    читают с реплики."""
+
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+                request.method in SAFE_METHODS
+                and self.action in self.replica_actions
+        ):
+            read_from_replica(request.user)
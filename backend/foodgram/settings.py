@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.utils import get_random_secret_key
 from dotenv import load_dotenv
 
@@ -17,8 +18,49 @@ USER_EMAIL_MAX_LENGTH = 254
 NUM_OF_WORDS_OF_NAME = 3
 NUM_OF_WORDS_OF_TEXT = 10
 PAGINATION_PAGE_SIZE = 6
+RECIPES_BATCH_MAX_SIZE = 50
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 1000))
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 20))
+INGREDIENT_CATALOG_PATH = os.getenv('INGREDIENT_CATALOG_PATH', '')
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+IMAGE_RENDITIONS_SYNC = os.getenv('IMAGE_RENDITIONS_SYNC', 'False') == 'true'
+IMAGE_SPOOL_MAX_SIZE = 1024 * 1024
+STREAMING_SPOOL_MAX_SIZE = 1024 * 1024
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 300))
+AUTH_SIGNED_TOKENS = os.getenv('AUTH_SIGNED_TOKENS', 'False') == 'true'
+AUTH_SIGNED_TOKEN_MAX_AGE = int(
+    os.getenv('AUTH_SIGNED_TOKEN_MAX_AGE', 14 * 24 * 60 * 60)
+)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'true'
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+RESPONSE_CACHE_LOCK_TIMEOUT = int(os.getenv('RESPONSE_CACHE_LOCK_TIMEOUT', 5))
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'true'
+PROFILING_HEADERS = os.getenv('PROFILING_HEADERS', 'False') == 'true'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 1.0))
+PROFILING_BUFFER_SIZE = int(os.getenv('PROFILING_BUFFER_SIZE', 1000))
+PROFILING_SINK = os.getenv('PROFILING_SINK', '')
+PROFILING_N_PLUS_ONE_THRESHOLD = int(
+    os.getenv('PROFILING_N_PLUS_ONE_THRESHOLD', 10)
+)
+# Сколько пользователей generate_data создаёт для проверки планов
+# запросов в тестах; около пяти рецептов и двадцати избранных на каждого.
+QUERY_PLANS_TEST_USERS = int(os.getenv('QUERY_PLANS_TEST_USERS', 1000))
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
 
 USE_SQLITE = os.getenv('USE_SQLITE', 'False') == 'true'
+# persistent - постоянные соединения с проверкой перед запросом,
+# pgbouncer - то же через внешний пул в режиме транзакций.
+DB_POOL = os.getenv('DB_POOL', '')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+# Реплики для чтения: host[:port] PostgreSQL или пути к файлам SQLite.
+DB_REPLICAS = [
+    replica for replica in os.getenv('DB_REPLICAS', '').split(',') if replica
+]
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 10))
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -35,6 +77,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -54,8 +97,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.QueryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -90,7 +135,7 @@ if USE_SQLITE:
 else:
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            'ENGINE': 'foodgram.db.postgresql',
             'NAME': os.getenv('POSTGRES_DB', 'foodgram'),
             'USER': os.getenv('POSTGRES_USER', 'foodgram_user'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
@@ -99,6 +144,50 @@ else:
         }
     }
 
+if DB_POOL in ('persistent', 'pgbouncer'):
+    DATABASES['default'].update(
+        CONN_MAX_AGE=DB_CONN_MAX_AGE, CONN_HEALTH_CHECKS=True
+    )
+if DB_POOL == 'pgbouncer':
+    # Серверные курсоры не переживают смену соединения между транзакциями.
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+for number, replica in enumerate(DB_REPLICAS, 1):
+    if USE_SQLITE:
+        location = {'NAME': replica}
+    else:
+        host, _, port = replica.partition(':')
+        location = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        **location,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = (
+    ['foodgram.db.routers.ReplicaRouter'] if DB_REPLICAS else []
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+# Кэш в памяти процесса (и фиктивный) другие воркеры не видят: версии
+# данных в нём живут LOCAL_CACHE_VERSION_TTL секунд, и чужие изменения
+# подхватываются хотя бы с такой задержкой. В общем кэше - бессрочно.
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache'
+)
+CACHE_VERSION_TIMEOUT = (
+    None if SHARED_CACHE
+    else int(os.getenv('LOCAL_CACHE_VERSION_TTL', 30))
+)
+
 AUTH_USER_MODEL = 'users.CreateUser'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -120,7 +209,7 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'api.utils.page_not_found',
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageSizeNumberPagination',
@@ -143,6 +232,15 @@ DJOSER = {
     }
 }
 
+if AUTH_SIGNED_TOKENS:
+    # Отзыв подписанного токена другие воркеры увидят только через
+    # общий кэш.
+    if not SHARED_CACHE:
+        raise ImproperlyConfigured(
+            'AUTH_SIGNED_TOKENS requires a shared CACHE_BACKEND.'
+        )
+    DJOSER['SERIALIZERS']['token'] = 'api.serializers.SignedTokenSerializer'
+
 """ Language code English 'en-us'
     Language code Russian 'ru-RU'"""
 LANGUAGE_CODE = 'ru-RU'
@@ -3,7 +3,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from api.profiling import profiling_dashboard
+
 urlpatterns = [
+    path(
+        'admin/profiling/', profiling_dashboard, name='profiling_dashboard'
+    ),
     path('admin/', admin.site.urls),
     path('api/', include('api.urls'))
 ]
@@ -8,6 +8,7 @@ from recipes.models import (
     Recipe,
     RecipeIngredient,
     RecipeTag,
+    ShoppingCartLine,
     ShoppingRecipe,
     Tag
 )
@@ -35,7 +36,8 @@ class RecipeAdmin(admin.ModelAdmin):
         'get_short_text',
         'cooking_time',
         'created_at',
-        'get_favorite_count',
+        'favorites_count',
+        'in_carts_count',
         'image_tag',
     )
     search_fields = ('name',)
@@ -63,11 +65,6 @@ class RecipeAdmin(admin.ModelAdmin):
             )
         return 'Не найдено'
 
-    @admin.display(description='В избранном')
-    def get_favorite_count(self, obj):
-        """Сколько раз рецепт добавлен в избранное."""
-        return FavoriteRecipe.objects.filter(recipe=obj).count()
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -102,3 +99,9 @@ class FavoriteRecipeAdmin(admin.ModelAdmin):
 class ShoppingRecipeAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
     list_filter = ('user', 'recipe')
+
+
+@admin.register(ShoppingCartLine)
+class ShoppingCartLineAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'total_amount')
+    list_filter = ('user',)
@@ -0,0 +1,81 @@
+from bisect import bisect_left
+from threading import Lock
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+
+from recipes.cache import ingredient_cache
+from recipes.catalog import IngredientCatalog
+
+
+class IngredientAutocomplete:
+    """Поиск ингредиентов для автодополнения.
+
+    Сначала идут совпадения по началу названия, затем по вхождению
+    подстроки; выдача ограничена INGREDIENT_SEARCH_LIMIT. Если задан
+    INGREDIENT_CATALOG_PATH, поиск идёт по файлу-каталогу. Иначе на
+    PostgreSQL запрос обслуживает триграммный индекс, на остальных
+    базах - отсортированный список названий по кэшу справочника.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._keys = []
+        self._ids = []
+        self._lock = Lock()
+
+    def _load(self):
+        ingredients, version = ingredient_cache.snapshot()
+        with self._lock:
+            if version != self._version:
+                rows = sorted(
+                    (ingredient.name.casefold(), pk)
+                    for pk, ingredient in ingredients.items()
+                )
+                self._ids = [pk for _, pk in rows]
+                self._keys = [key for key, _ in rows]
+                self._version = version
+            return self._keys, self._ids
+
+    def search_ids(self, query, limit):
+        """Идентификаторы ингредиентов в порядке ранжирования."""
+        if isinstance(ingredient_cache, IngredientCatalog):
+            return ingredient_cache.search_ids(query, limit)
+        keys, ids = self._load()
+        query = query.casefold()
+        result = []
+        position = bisect_left(keys, query)
+        while (
+                position < len(keys) and len(result) < limit
+                and keys[position].startswith(query)
+        ):
+            result.append(ids[position])
+            position += 1
+        if len(result) < limit:
+            for key, pk in zip(keys, ids):
+                if query in key and not key.startswith(query):
+                    result.append(pk)
+                    if len(result) == limit:
+                        break
+        return result
+
+    def filter(self, queryset, query, limit=None):
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        if (
+                connection.vendor == 'postgresql'
+                and not isinstance(ingredient_cache, IngredientCatalog)
+        ):
+            queryset = queryset.filter(name__icontains=query)
+        else:
+            queryset = queryset.filter(pk__in=self.search_ids(query, limit))
+        return queryset.annotate(
+            rank=Case(
+                When(name__istartswith=query, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        ).order_by('rank', 'name')[:limit]
+
+
+ingredient_autocomplete = IngredientAutocomplete()
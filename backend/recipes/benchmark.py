@@ -0,0 +1,222 @@
+import random
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeTag,
+    ShoppingRecipe,
+    Tag
+)
+from users.models import Follow
+
+User = get_user_model()
+
+WORDS = (
+    'суп', 'салат', 'пирог', 'запеканка', 'каша', 'соус', 'жаркое',
+    'рагу', 'котлеты', 'блины', 'оладьи', 'плов', 'борщ', 'десерт',
+    'быстрый', 'домашний', 'острый', 'сладкий', 'печёный', 'тушёный',
+    'жареный', 'постный', 'праздничный', 'летний', 'зимний', 'бабушкин',
+)
+
+
+def make_vocabulary(ingredients):
+    """Слова для текстов рецептов: словарь блюд и слова из названий
+    ингредиентов (id, название)."""
+    return list(WORDS) + sorted({
+        word for _, name in ingredients
+        for word in re.findall(r'\w{4,}', name.casefold())
+    })
+
+
+def generate_recipes(total, seed=0, ingredients_per_recipe=8):
+    """Рецепты из слов словаря и случайных ингредиентов для замеров.
+
+    Возвращает словарь слов, из которых составлены тексты.
+    """
+    rng = random.Random(seed)
+    ingredients = list(
+        Ingredient.objects.order_by('pk').values_list('pk', 'name')
+    )
+    vocabulary = make_vocabulary(ingredients)
+    author = User.objects.create(
+        username='benchmark',
+        email='benchmark@example.com',
+        first_name='Benchmark',
+        last_name='Benchmark'
+    )
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author=author,
+                name=' '.join(rng.choices(vocabulary, k=3)).capitalize(),
+                text=' '.join(rng.choices(vocabulary, k=30)),
+                image='recipes/images/benchmark.jpg',
+                cooking_time=rng.randint(settings.MIN_COOKING_TIME, 120)
+            )
+            for _ in range(total)
+        ),
+        batch_size=1000
+    )
+    recipe_ids = Recipe.objects.filter(
+        author=author
+    ).values_list('pk', flat=True)
+    RecipeIngredient.objects.bulk_create(
+        (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(settings.MIN_AMOUNT, 500)
+            )
+            for recipe_id in recipe_ids.iterator()
+            for ingredient_id, _ in rng.sample(
+                ingredients, ingredients_per_recipe
+            )
+        ),
+        batch_size=5000
+    )
+    return vocabulary
+
+
+def popular(rng, population, k):
+    """До k разных элементов; первые элементы популярнее остальных,
+    как авторы и рецепты в живой базе."""
+    if not population:
+        return set()
+    weights = [1 / (rank + 1) for rank in range(len(population))]
+    return set(rng.choices(population, weights, k=k * 2))
+
+
+def generate_data(users, recipes_per_user=5, follows_per_user=10,
+                  favorites_per_user=20, cart_per_user=5, seed=0,
+                  prefix='load', password='benchmark'):
+    """Пользователи, подписки, рецепты с тегами и ингредиентами,
+    избранное и корзины для нагрузочных тестов.
+
+    Всё вставляется через bulk_create, поэтому сигналы не срабатывают
+    и счётчики, корзины, поиск и ленты нужно пересобрать после вызова.
+    Возвращает число созданных записей по моделям.
+    """
+    rng = random.Random(seed)
+    ingredients = list(
+        Ingredient.objects.order_by('pk').values_list('pk', 'name')
+    )
+    tag_ids = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+    vocabulary = make_vocabulary(ingredients)
+    domain = f'@{prefix}.example.com'
+    hashed = make_password(password)
+    User.objects.bulk_create(
+        (
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}{domain}',
+                first_name=rng.choice(WORDS).capitalize(),
+                last_name=rng.choice(WORDS).capitalize(),
+                password=hashed
+            )
+            for number in range(users)
+        ),
+        batch_size=1000
+    )
+    user_ids = list(User.objects.filter(
+        email__endswith=domain
+    ).order_by('pk').values_list('pk', flat=True))
+    authors = user_ids[:]
+    rng.shuffle(authors)
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author_id=author_id,
+                name=' '.join(rng.choices(vocabulary, k=3)).capitalize(),
+                text=' '.join(rng.choices(vocabulary, k=30)),
+                image='recipes/images/benchmark.jpg',
+                cooking_time=rng.randint(settings.MIN_COOKING_TIME, 120)
+            )
+            for author_id in rng.choices(
+                authors,
+                [1 / (rank + 1) for rank in range(len(authors))],
+                k=users * recipes_per_user
+            )
+        ),
+        batch_size=1000
+    )
+    recipe_ids = list(Recipe.objects.filter(
+        author__email__endswith=domain
+    ).order_by('pk').values_list('pk', flat=True))
+    recipes = recipe_ids[:]
+    rng.shuffle(recipes)
+    RecipeTag.objects.bulk_create(
+        (
+            RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(
+                tag_ids, min(len(tag_ids), rng.randint(1, 3))
+            )
+        ),
+        batch_size=5000
+    )
+    RecipeIngredient.objects.bulk_create(
+        (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(settings.MIN_AMOUNT, 500)
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id, _ in rng.sample(
+                ingredients, rng.randint(3, 12)
+            )
+        ),
+        batch_size=5000
+    )
+    Follow.objects.bulk_create(
+        (
+            Follow(user_id=user_id, following_id=author_id)
+            for user_id in user_ids
+            for author_id in popular(rng, authors, follows_per_user)
+            if author_id != user_id
+        ),
+        batch_size=5000
+    )
+    for model, per_user in (
+            (FavoriteRecipe, favorites_per_user),
+            (ShoppingRecipe, cart_per_user)
+    ):
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in popular(rng, recipes, per_user)
+            ),
+            batch_size=5000
+        )
+    return {
+        model._meta.label: model.objects.filter(**{lookup: domain}).count()
+        for model, lookup in (
+            (User, 'email__endswith'),
+            (Recipe, 'author__email__endswith'),
+            (Follow, 'user__email__endswith'),
+            (FavoriteRecipe, 'user__email__endswith'),
+            (ShoppingRecipe, 'user__email__endswith'),
+        )
+    }
+
+
+def measure(queries, search, repeat):
+    """p50 и p99 времени запросов в мс и среднее число строк."""
+    timings, rows = [], []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            rows.append(len(list(search(query))))
+            timings.append((time.perf_counter() - start) * 1000)
+    percentiles = statistics.quantiles(timings, n=100)
+    return percentiles[49], percentiles[98], statistics.mean(rows)
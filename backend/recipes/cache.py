@@ -0,0 +1,195 @@
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+
+from recipes.catalog import IngredientCatalog
+from recipes.models import Ingredient, Tag
+
+User = get_user_model()
+
+VERSION_KEY = 'version:{}'
+AUTH_STATE_KEY = 'auth:state:{}'
+USERS_VERSION = 'users'
+# Состав списков рецептов: появление, удаление и правка рецептов.
+RECIPES_VERSION = 'recipes'
+# Порядок списков, отсортированных по счётчикам избранного и покупок.
+RECIPE_COUNTERS_VERSION = 'recipes:counters'
+
+
+def get_version(name):
+    """Текущая версия набора данных, общая для всех процессов.
+
+    Без общего кэша версия истекает через CACHE_VERSION_TIMEOUT, и
+    копии данных в процессе перечитываются хотя бы так часто.
+    """
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, settings.CACHE_VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(names):
+    """Текущие версии нескольких наборов одним обращением к кэшу."""
+    keys = {VERSION_KEY.format(name): name for name in names}
+    found = cache.get_many(keys)
+    return {
+        name: found[key] if key in found else get_version(name)
+        for key, name in keys.items()
+    }
+
+
+def bump_version(name):
+    """Объявляем закэшированные копии набора данных устаревшими."""
+    cache.set(
+        VERSION_KEY.format(name), uuid4().hex, settings.CACHE_VERSION_TIMEOUT
+    )
+
+
+def bump_versions(names):
+    cache.set_many(
+        {VERSION_KEY.format(name): uuid4().hex for name in names},
+        settings.CACHE_VERSION_TIMEOUT
+    )
+
+
+def relations_version_name(user_id):
+    """Версия избранного, списка покупок и подписок пользователя."""
+    return f'relations:{user_id}'
+
+
+def recipe_version_name(recipe_id):
+    """Версия ответа с рецептом: его поля, теги, состав и счётчики."""
+    return f'recipe:{recipe_id}'
+
+
+def author_recipes_version_name(author_id):
+    """Состав списка рецептов автора."""
+    return f'recipes:author:{author_id}'
+
+
+def author_version_name(user_id):
+    """Версия профиля пользователя в ответах с его рецептами."""
+    return f'author:{user_id}'
+
+
+def auth_state(user_id):
+    """Версия авторизации пользователя и признак активности;
+    None, если пользователя нет.
+
+    Источник - строка пользователя в базе, поэтому вытеснение из кэша
+    токены не отзывает: копия в кэше Django живёт AUTH_TOKEN_CACHE_TTL
+    секунд и удаляется при каждой смене версии.
+    """
+    key = AUTH_STATE_KEY.format(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = User.objects.using(DEFAULT_DB_ALIAS).filter(
+            pk=user_id
+        ).values_list('auth_version', 'is_active').first()
+        if state is None:
+            return None
+        cache.set(key, state, settings.AUTH_TOKEN_CACHE_TTL)
+    return tuple(state)
+
+
+def forget_auth_state(user_id):
+    """Удаляем копию версии авторизации сейчас и после фиксации
+    транзакции: иначе запрос между ними закэшировал бы старую."""
+    key = AUTH_STATE_KEY.format(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def revoke_tokens(user_id):
+    """Кэшированные и подписанные токены пользователя перестают
+    действовать."""
+    User.objects.filter(pk=user_id).update(auth_version=F('auth_version') + 1)
+    forget_auth_state(user_id)
+
+
+class ReferenceCache:
+    """Справочник, загруженный в память процесса целиком.
+
+    Таблица читается один раз и перечитывается, только когда меняется
+    её версия в кэше Django; так изменения, сделанные в одном воркере,
+    видят и остальные, а без общего кэша - не позже, чем истечёт
+    версия.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version_name = model._meta.label_lower
+        self._version = None
+        self._objects = {}
+        self._serialized = {}
+        self._lock = Lock()
+
+    def __deepcopy__(self, memo):
+        """Поля сериализаторов копируются, а кэш должен остаться общим."""
+        return self
+
+    def snapshot(self):
+        """Объекты справочника по id и версия, к которой они относятся."""
+        version = get_version(self.version_name)
+        with self._lock:
+            if version != self._version:
+                # Из основной базы: отстающая реплика закэшировала бы
+                # старые данные под новой версией.
+                self._objects = {
+                    obj.pk: obj for obj in self.model.objects.using(
+                        DEFAULT_DB_ALIAS
+                    ).order_by('pk')
+                }
+                self._serialized = {}
+                self._version = version
+            return self._objects, self._version
+
+    def objects(self):
+        return self.snapshot()[0]
+
+    def get(self, pk):
+        return self.objects().get(pk)
+
+    def serialized(self, name, render):
+        """Ответ, отрендеренный один раз на версию справочника."""
+        objects, version = self.snapshot()
+        with self._lock:
+            if version != self._version:
+                return render(list(objects.values()))
+            if name not in self._serialized:
+                self._serialized[name] = render(list(objects.values()))
+            return self._serialized[name]
+
+    def invalidate(self):
+        # После фиксации: иначе другой процесс перечитал бы таблицу
+        # под новой версией ещё со старыми данными.
+        transaction.on_commit(lambda: bump_version(self.version_name))
+
+
+class CatalogReferenceCache(IngredientCatalog):
+    """Справочник из файла-каталога, общего для всех воркеров машины
+    и собранного для текущей версии справочника в кэше Django."""
+
+    def current_version(self):
+        return get_version(self.version_name)
+
+    def invalidate(self):
+        # После фиксации: иначе файл пересобрали бы под новой версией
+        # ещё из старых данных.
+        transaction.on_commit(lambda: bump_version(self.version_name))
+
+
+tag_cache = ReferenceCache(Tag)
+if settings.INGREDIENT_CATALOG_PATH:
+    ingredient_cache = CatalogReferenceCache(
+        settings.INGREDIENT_CATALOG_PATH, Ingredient._meta.label_lower
+    )
+else:
+    ingredient_cache = ReferenceCache(Ingredient)
@@ -0,0 +1,254 @@
+import mmap
+import os
+import struct
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+from recipes.models import Ingredient
+
+MAGIC = b'FGIC'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sI32sIIIII')
+RECORD = struct.Struct('<IIIII')
+ORDER = struct.Struct('<III')
+KEY_SEPARATOR = b'\0'
+
+
+def write_catalog(path, ingredients, version=''):
+    """Записывает справочник ингредиентов в компактный файл.
+
+    ingredients - пары (id, название, единица измерения), version -
+    версия справочника, из которой они прочитаны. Файл состоит
+    из заголовка, записей (id, смещение и длина названия, смещение
+    и длина единицы), отсортированных по id, таблицы порядка по
+    названию в нижнем регистре, общего блока строк в UTF-8 и блока
+    ключей поиска через разделитель. Файл заменяется атомарно, поэтому
+    читатели видят либо старую, либо новую версию целиком.
+    """
+    rows = sorted(ingredients)
+    strings, offsets = bytearray(), {}
+
+    def intern(value):
+        data = value.encode('utf-8')
+        if data not in offsets:
+            offsets[data] = len(strings)
+            strings.extend(data)
+        return offsets[data], len(data)
+
+    records = bytearray()
+    for pk, name, unit in rows:
+        records.extend(RECORD.pack(pk, *intern(name), *intern(unit)))
+    keys, order = bytearray(), bytearray()
+    for key, index in sorted(
+            (name.casefold().encode('utf-8'), index)
+            for index, (_, name, _) in enumerate(rows)
+    ):
+        order.extend(ORDER.pack(index, len(keys), len(key)))
+        keys.extend(key + KEY_SEPARATOR)
+    records_offset = HEADER.size
+    order_offset = records_offset + len(records)
+    strings_offset = order_offset + len(order)
+    keys_offset = strings_offset + len(strings)
+    directory = os.path.dirname(os.path.abspath(path))
+    with NamedTemporaryFile(dir=directory, delete=False) as file:
+        file.write(HEADER.pack(
+            MAGIC, FORMAT_VERSION, version.encode('ascii'), len(rows),
+            records_offset, order_offset, strings_offset, keys_offset
+        ))
+        for block in (records, order, strings, keys):
+            file.write(block)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+    return len(rows)
+
+
+def build_catalog(path, version=''):
+    """Файл справочника из базы для данной версии."""
+    return write_catalog(path, Ingredient.objects.values_list(
+        'pk', 'name', 'measurement_unit'
+    ).iterator(), version)
+
+
+class CatalogFile:
+    """Файл справочника, отображённый в память только для чтения.
+
+    Страницы файла общие для всех процессов на машине; объекты
+    Ingredient создаются только для возвращаемых записей.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        (
+            magic, format_version, version, self.count, self.records,
+            self.order, self.strings, self.keys
+        ) = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not an ingredient catalog')
+        self.version = version.rstrip(b'\0').decode('ascii')
+
+    def _string(self, offset, length):
+        start = self.strings + offset
+        return str(self.buffer[start:start + length], 'utf-8')
+
+    def ingredient(self, index):
+        pk, name_offset, name_length, unit_offset, unit_length = (
+            RECORD.unpack_from(self.buffer, self.records + index * RECORD.size)
+        )
+        return Ingredient(
+            id=pk,
+            name=self._string(name_offset, name_length),
+            measurement_unit=self._string(unit_offset, unit_length)
+        )
+
+    def id_at(self, index):
+        return RECORD.unpack_from(
+            self.buffer, self.records + index * RECORD.size
+        )[0]
+
+    def find(self, pk):
+        """Индекс записи с данным id двоичным поиском или None."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.id_at(middle) < pk:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.id_at(low) == pk:
+            return low
+        return None
+
+    def _order(self, position):
+        return ORDER.unpack_from(
+            self.buffer, self.order + position * ORDER.size
+        )
+
+    def _key(self, position):
+        _, offset, length = self._order(position)
+        start = self.keys + offset
+        return self.buffer[start:start + length]
+
+    def search(self, query, limit):
+        """Индексы записей: сначала совпадения по началу названия,
+        затем по вхождению подстроки, внутри - по алфавиту."""
+        query = query.casefold().encode('utf-8')
+        result = []
+        if KEY_SEPARATOR in query:
+            return result
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < query:
+                low = middle + 1
+            else:
+                high = middle
+        while (
+                low < self.count and len(result) < limit
+                and self._key(low).startswith(query)
+        ):
+            result.append(self._order(low)[0])
+            low += 1
+        end = len(self.buffer)
+        found = self.buffer.find(query, self.keys, end)
+        while found != -1 and len(result) < limit:
+            position = self._key_position(found - self.keys)
+            _, offset, length = self._order(position)
+            if found - self.keys > offset:
+                result.append(self._order(position)[0])
+            found = self.buffer.find(
+                query, self.keys + offset + length + 1, end
+            )
+        return result
+
+    def _key_position(self, offset):
+        """Позиция ключа, в который попадает смещение в блоке ключей."""
+        low, high = 0, self.count - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._order(middle)[1] <= offset:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+
+class IngredientCatalog:
+    """Справочник ингредиентов из файла-каталога вместо объектов
+    в памяти каждого воркера.
+
+    Интерфейс совпадает с ReferenceCache. Файл хранит версию
+    справочника, из которой собран; если она расходится с текущей
+    версией из current_version(), любой процесс пересобирает файл
+    из базы. Так каталог на каждой машине следует общей версии,
+    где бы ни изменились ингредиенты.
+    """
+
+    def __init__(self, path, version_name):
+        self.path = path
+        self.version_name = version_name
+        self._file = None
+        self._serialized = {}
+        self._lock = Lock()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def current_version(self):
+        """Версия, которой должен соответствовать файл; None - любая."""
+        return None
+
+    def _open(self):
+        try:
+            return CatalogFile(self.path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def catalog(self):
+        version = self.current_version()
+        with self._lock:
+            if self._file is not None and version in (
+                    None, self._file.version
+            ):
+                return self._file
+        catalog = self._open()
+        if catalog is None or version not in (None, catalog.version):
+            build_catalog(self.path, version or '')
+            catalog = CatalogFile(self.path)
+        with self._lock:
+            self._file = catalog
+            self._serialized = {}
+            return catalog
+
+    def get(self, pk):
+        catalog = self.catalog()
+        index = catalog.find(pk)
+        return None if index is None else catalog.ingredient(index)
+
+    @staticmethod
+    def _objects(catalog):
+        return {
+            ingredient.pk: ingredient
+            for ingredient in map(catalog.ingredient, range(catalog.count))
+        }
+
+    def objects(self):
+        return self._objects(self.catalog())
+
+    def serialized(self, name, render):
+        """Ответ, отрендеренный один раз на версию файла."""
+        catalog = self.catalog()
+        with self._lock:
+            if catalog is not self._file:
+                return render(list(self._objects(catalog).values()))
+            if name not in self._serialized:
+                self._serialized[name] = render(
+                    list(self._objects(catalog).values())
+                )
+            return self._serialized[name]
+
+    def search_ids(self, query, limit):
+        catalog = self.catalog()
+        return [catalog.id_at(index) for index in catalog.search(query, limit)]
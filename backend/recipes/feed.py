@@ -0,0 +1,145 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from recipes.models import FeedEntry, Recipe
+from users.models import Follow
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+def fans_out_on_write(author):
+    """Рецепты авторов с очень большим числом подписчиков не
+    раскладываются по лентам, а читаются при запросе ленты."""
+    return author.followers_count <= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def fan_out(recipe_id):
+    """Добавляет новый рецепт в ленты подписчиков автора."""
+    recipe = Recipe.objects.select_related('author').filter(
+        pk=recipe_id
+    ).only('created_at', 'author__followers_count').first()
+    if recipe is None or not fans_out_on_write(recipe.author):
+        return
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id, recipe_id=recipe.pk,
+                created_at=recipe.created_at
+            )
+            for user_id in Follow.objects.filter(
+                following_id=recipe.author_id
+            ).values_list('user_id', flat=True).iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def add_author(user_id, author_id):
+    """Новая подписка: рецепты автора появляются в ленте сразу."""
+    author = User.objects.only('followers_count').get(pk=author_id)
+    if not fans_out_on_write(author):
+        return
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe_id=pk, created_at=created_at)
+            for pk, created_at in Recipe.objects.filter(
+                author_id=author_id
+            ).values_list('pk', 'created_at').iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def threshold_crossed(author_id):
+    """Автор пересёк порог FEED_FANOUT_MAX_FOLLOWERS: его рецепты
+    раскладываются по лентам всех подписчиков или убираются из них,
+    чтобы лента не теряла и не повторяла рецепты."""
+    author = User.objects.only('followers_count').filter(
+        pk=author_id
+    ).first()
+    if author is None:
+        return
+    if not fans_out_on_write(author):
+        FeedEntry.objects.filter(recipe__author_id=author_id).delete()
+        return
+    recipes = list(
+        Recipe.objects.filter(author_id=author_id).values_list(
+            'pk', 'created_at'
+        )
+    )
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe_id=pk, created_at=created_at)
+            for user_id in Follow.objects.filter(
+                following_id=author_id
+            ).values_list('user_id', flat=True).iterator()
+            for pk, created_at in recipes
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def remove_author(user_id, author_id):
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def backfill(user_id):
+    """Собирает ленту пользователя заново по его подпискам."""
+    FeedEntry.objects.filter(user_id=user_id).delete()
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe_id=pk, created_at=created_at)
+            for pk, created_at in Recipe.objects.filter(
+                author__followings__user_id=user_id,
+                author__followers_count__lte=(
+                    settings.FEED_FANOUT_MAX_FOLLOWERS
+                )
+            ).values_list('pk', 'created_at').iterator()
+        ),
+        batch_size=BATCH_SIZE
+    )
+
+
+def backfill_all():
+    """Собирает все ленты заново одним INSERT ... SELECT, без
+    построения объектов: при массовой загрузке это в разы быстрее,
+    чем backfill для каждого пользователя."""
+    FeedEntry.objects.all().delete()
+    sql, params = Follow.objects.filter(
+        following__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        following__recipes__isnull=False
+    ).order_by().values_list(
+        'user_id', 'following__recipes__id',
+        'following__recipes__created_at'
+    ).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FeedEntry._meta.db_table} '
+            f'(user_id, recipe_id, created_at) {sql}',
+            params
+        )
+
+
+def feed_sources(user):
+    """Источники ленты для курсорной пагинации: разложенные записи
+    и рецепты популярных авторов, читаемые при запросе."""
+    return (
+        (FeedEntry.objects.filter(user=user), ('created_at', 'recipe_id')),
+        (
+            Recipe.objects.filter(
+                author__followings__user=user,
+                author__followers_count__gt=(
+                    settings.FEED_FANOUT_MAX_FOLLOWERS
+                )
+            ),
+            ('created_at', 'pk')
+        ),
+    )
@@ -0,0 +1,178 @@
+import base64
+import binascii
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, features
+
+from recipes.cache import (
+    RECIPES_VERSION,
+    author_recipes_version_name,
+    bump_versions,
+    recipe_version_name
+)
+from recipes.models import Recipe
+
+IMAGES_DIR = 'recipes/images'
+ALLOWED_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+RENDITIONS = {
+    'thumb': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+RENDITION_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+RENDITION_EXTENSION = ALLOWED_FORMATS[RENDITION_FORMAT]
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_RENDITION_WORKERS,
+    thread_name_prefix='image-renditions'
+)
+
+
+def decode_base64(data, chunk_size=64 * 1024):
+    """Декодирует base64 по частям во временный файл и считает sha256.
+
+    Размер части кратен четырём символам, поэтому каждая часть
+    декодируется независимо; в памяти не появляется второй полной копии
+    файла, а большой файл уходит из памяти на диск.
+    """
+    if ';base64,' in data:
+        data = data.split(';base64,', 1)[1]
+    chunk_size -= chunk_size % 4
+    digest = hashlib.sha256()
+    decoded = SpooledTemporaryFile(max_size=settings.IMAGE_SPOOL_MAX_SIZE)
+    for start in range(0, len(data), chunk_size):
+        chunk = base64.b64decode(
+            data[start:start + chunk_size], validate=True
+        )
+        digest.update(chunk)
+        decoded.write(chunk)
+    decoded.seek(0)
+    return decoded, digest.hexdigest()
+
+
+def decode_image(data):
+    """Проверяет изображение в base64, не записывая его в хранилище.
+
+    Возвращает файл с содержимым под именем из хэша; сохраняет его
+    store_image. ValueError - если это не изображение.
+
+    Декодирование и проверка остаются в запросе, а не в пуле копий:
+    на испорченный файл клиент получает 400, а не рецепт с битой
+    картинкой, и имя файла из хэша содержимого нужно уже при записи
+    рецепта. Обе стоят столько же, сколько разбор JSON с этим файлом;
+    дорогие уменьшенные копии создаёт пул (schedule_renditions).
+    """
+    try:
+        decoded, digest = decode_base64(data)
+    except (binascii.Error, ValueError):
+        raise ValueError('Некорректные данные base64.')
+    try:
+        with Image.open(decoded) as image:
+            image_format = image.format
+            image.verify()
+    except Exception:
+        decoded.close()
+        raise ValueError('Файл не является изображением.')
+    if image_format not in ALLOWED_FORMATS:
+        decoded.close()
+        raise ValueError('Неподдерживаемый формат изображения.')
+    return File(decoded, name=posixpath.join(
+        IMAGES_DIR, f'{digest}.{ALLOWED_FORMATS[image_format]}'
+    ))
+
+
+def store_image(image):
+    """Сохраняет файл из decode_image; одинаковые файлы сохраняются
+    один раз. Возвращает имя файла в хранилище.
+
+    Оригинал записывается до ответа: ссылка на него отдаётся сразу,
+    пока копии не готовы (см. rendition_urls).
+    """
+    with image:
+        if default_storage.exists(image.name):
+            return image.name
+        image.seek(0)
+        return default_storage.save(image.name, image)
+
+
+def rendition_name(image_name, rendition):
+    root, _ = posixpath.splitext(image_name)
+    return f'{root}/{rendition}.{RENDITION_EXTENSION}'
+
+
+def build_renditions(image_name):
+    """Создаёт уменьшенные копии изображения, которых ещё нет."""
+    renditions = {}
+    with default_storage.open(image_name) as source:
+        with Image.open(source) as image:
+            image.load()
+            for rendition, size in RENDITIONS.items():
+                name = rendition_name(image_name, rendition)
+                if not default_storage.exists(name):
+                    copy = image.convert('RGB')
+                    copy.thumbnail(size)
+                    buffer = BytesIO()
+                    copy.save(buffer, RENDITION_FORMAT, quality=85)
+                    name = default_storage.save(
+                        name, ContentFile(buffer.getvalue())
+                    )
+                renditions[rendition] = name
+    return renditions
+
+
+def process_image(image_name):
+    """Создаёт копии изображения и сохраняет ссылки на них в рецептах."""
+    renditions = build_renditions(image_name)
+    recipes = Recipe.objects.filter(image=image_name)
+    rows = list(recipes.values_list('pk', 'author_id'))
+    recipes.update(image_renditions=renditions, updated_at=timezone.now())
+    # Копии изображения видны и в списках рецептов.
+    bump_versions((
+        RECIPES_VERSION,
+        *(recipe_version_name(pk) for pk, _ in rows),
+        *{author_recipes_version_name(author_id) for _, author_id in rows}
+    ))
+
+
+def process_image_in_worker(image_name):
+    try:
+        process_image(image_name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', image_name)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(image_name):
+    """Ставит обработку в пул после фиксации транзакции с рецептом."""
+    if settings.IMAGE_RENDITIONS_SYNC:
+        transaction.on_commit(lambda: process_image(image_name))
+    else:
+        transaction.on_commit(
+            lambda: executor.submit(process_image_in_worker, image_name)
+        )
+
+
+def rendition_urls(recipe):
+    """Ссылки на копии; пока копия не готова - на оригинал."""
+    original = recipe.image.url if recipe.image else None
+    return {
+        rendition: (
+            default_storage.url(recipe.image_renditions[rendition])
+            if rendition in recipe.image_renditions else original
+        )
+        for rendition in RENDITIONS
+    }
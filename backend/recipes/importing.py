@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from recipes.models import Ingredient, Tag
+
+INGREDIENT_FIELDS = ('name', 'measurement_unit')
+READ_SIZE = 64 * 1024
+SEPARATORS = '[,] \t\r\n'
+STAGING_TABLE = 'recipes_ingredient_import'
+
+
+def read_csv(path, fields):
+    """Строки CSV по одной; строка заголовка необязательна."""
+    with open(path, encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        first = next(reader, None)
+        if first is None:
+            return
+        header = [name.strip() for name in first]
+        if set(fields) <= set(header):
+            positions = [header.index(field) for field in fields]
+        else:
+            positions = range(len(fields))
+            yield dict(zip(fields, first))
+        for row in reader:
+            if row:
+                yield {
+                    field: row[position] if position < len(row) else ''
+                    for field, position in zip(fields, positions)
+                }
+
+
+def read_json(path, fields):
+    """Объекты из JSON-массива или JSON Lines по одному, не читая
+    файл в память целиком."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as file:
+        buffer, position, eof = '', 0, False
+        while True:
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                position += 1
+            if position == len(buffer):
+                if eof:
+                    return
+                buffer, position = file.read(READ_SIZE), 0
+                eof = not buffer
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = file.read(READ_SIZE)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            position = end
+            yield {field: value.get(field, '') for field in fields}
+
+
+def read_rows(path, fields, file_format=None):
+    """Строки файла как словари по полям fields; формат - по
+    расширению, если не указан."""
+    if file_format is None:
+        file_format = os.path.splitext(path)[1].lstrip('.').lower()
+    if file_format in ('json', 'jsonl'):
+        return read_json(path, fields)
+    return read_csv(path, fields)
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    chunk = list(islice(rows, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, size))
+
+
+class IngredientImport:
+    """Идемпотентная загрузка ингредиентов порциями.
+
+    Каждая порция вставляется в своей транзакции с пропуском строк,
+    уже занятых ограничением unique_title_measurement_unit_pair, поэтому
+    повторный запуск ничего не ломает, а память не зависит от размера
+    файла. На PostgreSQL порция может загружаться через COPY
+    во временную таблицу и переноситься одним INSERT ... ON CONFLICT.
+    """
+
+    def __init__(self, dry_run=False, copy=False):
+        if copy and connection.vendor != 'postgresql':
+            raise ValueError('COPY import needs PostgreSQL')
+        self.dry_run = dry_run
+        self.copy = copy and not dry_run
+        self.rows = self.created = self.skipped = 0
+
+    @staticmethod
+    def clean(rows):
+        """Пары (название, единица) без пробелов по краям и повторов
+        внутри порции; строки, не подходящие модели, отбрасываются."""
+        pairs = {}
+        for row in rows:
+            pair = tuple(
+                str(row[field]).strip() for field in INGREDIENT_FIELDS
+            )
+            if all(pair) and max(map(len, pair)) <= (
+                    settings.PECIPE_NAME_MAX_LENGTH
+            ):
+                pairs[pair] = None
+        return list(pairs)
+
+    def missing(self, pairs):
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in pairs}
+        ).values_list(*INGREDIENT_FIELDS))
+        return [pair for pair in pairs if pair not in existing]
+
+    def insert(self, pairs):
+        if self.copy:
+            return [], self.insert_copy(pairs)
+        new = self.missing(pairs)
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in new
+            ),
+            ignore_conflicts=True
+        )
+        return new, len(new)
+
+    def insert_copy(self, pairs):
+        table = Ingredient._meta.db_table
+        data = io.StringIO()
+        csv.writer(data).writerows(pairs)
+        data.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} '
+                '(name text, measurement_unit text) ON COMMIT DELETE ROWS'
+            )
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                data
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT name, measurement_unit FROM {STAGING_TABLE} '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return cursor.rowcount
+
+    def load(self, chunk):
+        """Загружает порцию и возвращает новые пары; в пробном режиме
+        только сверяет их с базой. При COPY сами пары не возвращаются,
+        база сообщает лишь их число."""
+        pairs = self.clean(chunk)
+        self.rows += len(chunk)
+        self.skipped += len(chunk) - len(pairs)
+        if self.dry_run:
+            new = self.missing(pairs)
+            created = len(new)
+        else:
+            with transaction.atomic():
+                new, created = self.insert(pairs)
+        self.created += created
+        return new
+
+
+def import_tags(rows, dry_run=False):
+    """Теги сверяются по id: новые создаются, изменённые обновляются.
+    Возвращает числа созданных и обновлённых тегов."""
+    fields = ('name', 'color', 'slug')
+    tags = {int(row['id']): row for row in rows}
+    existing = Tag.objects.in_bulk(tags)
+    new, changed = [], []
+    for pk, row in tags.items():
+        tag = existing.get(pk)
+        if tag is None:
+            new.append(Tag(id=pk, **{field: row[field] for field in fields}))
+        elif any(getattr(tag, field) != row[field] for field in fields):
+            for field in fields:
+                setattr(tag, field, row[field])
+            changed.append(tag)
+    if not dry_run:
+        with transaction.atomic():
+            Tag.objects.bulk_update(changed, fields)
+            Tag.objects.bulk_create(new, ignore_conflicts=True)
+    return len(new), len(changed)
@@ -0,0 +1,38 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import backfill, backfill_all
+from recipes.models import FeedEntry
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild subscription feed timelines from current subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='Only rebuild the timeline of this user id'
+        )
+
+    def handle(self, *args, **kwargs):
+        if not kwargs.get('users'):
+            with transaction.atomic():
+                backfill_all()
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt all timelines, '
+                f'{FeedEntry.objects.count()} entries in total'
+            ))
+            return
+        users = User.objects.filter(pk__in=kwargs['users'])
+        total = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            with transaction.atomic():
+                backfill(user_id)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {total} timelines, '
+            f'{FeedEntry.objects.count()} entries in total'
+        ))
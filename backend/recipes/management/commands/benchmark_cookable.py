@@ -0,0 +1,82 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+
+from recipes.benchmark import generate_recipes, measure
+from recipes.matching import RecipeMatcher
+from recipes.models import Ingredient, Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure "what can I cook" matching against an ORM aggregation '
+        'on generated recipes; generated data is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='How many recipes to generate'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='How many times each query is executed'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed of the generated data'
+        )
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs.get('seed'))
+        total, repeat = kwargs.get('recipes'), kwargs.get('repeat')
+        page_size = settings.PAGINATION_PAGE_SIZE
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        queries = [
+            rng.sample(ingredient_ids, size)
+            for size in (5, 10, 20, 40, 80) for _ in range(6)
+        ]
+        with transaction.atomic():
+            generate_recipes(total, kwargs.get('seed'))
+            matcher = RecipeMatcher()
+            start = time.perf_counter()
+            matcher.match([])
+            indexed = time.perf_counter() - start
+
+            def orm(ingredients):
+                return Recipe.objects.annotate(
+                    covered=Count(
+                        'recipe_ingredients',
+                        filter=Q(
+                            recipe_ingredients__ingredient_id__in=ingredients
+                        )
+                    ),
+                    missing=Count('recipe_ingredients') - F('covered')
+                ).filter(covered__gt=0).order_by(
+                    'missing', '-covered', '-id'
+                )[:page_size]
+
+            def index(ingredients):
+                page = matcher.match(ingredients)[:page_size]
+                return Recipe.objects.with_related().in_bulk(
+                    [recipe_id for recipe_id, _ in page]
+                ).values()
+
+            results = {
+                'ORM aggregation': measure(queries, orm, repeat),
+                'inverted index': measure(queries, index, repeat),
+            }
+            transaction.set_rollback(True)
+        self.stdout.write(
+            f'{connection.vendor}: {total} recipes, index built in '
+            f'{indexed:.1f}s, {len(queries)} queries x {repeat}, '
+            f'page {page_size}'
+        )
+        for name, (p50, p99, rows) in results.items():
+            self.stdout.write(
+                f'{name}: p50={p50:.2f}ms p99={p99:.2f}ms rows={rows:.1f}'
+            )
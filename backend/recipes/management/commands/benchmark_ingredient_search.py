@@ -0,0 +1,68 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.autocomplete import ingredient_autocomplete
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Compare ingredient autocomplete latency with the plain filter'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='How many times each query is executed'
+        )
+
+    def get_queries(self):
+        """Префиксы длиной 1-3 символа и подстроки из реальных названий."""
+        names = list(
+            Ingredient.objects.order_by('pk').values_list('name', flat=True)
+        )[::10]
+        queries = set()
+        for name in names:
+            for length in (1, 2, 3):
+                queries.add(name[:length])
+            if len(name) > 6:
+                queries.add(name[3:6])
+        return sorted(queries)
+
+    def measure(self, queries, search, repeat):
+        timings, rows = [], []
+        for _ in range(repeat):
+            for query in queries:
+                start = time.perf_counter()
+                rows.append(len(list(search(query))))
+                timings.append((time.perf_counter() - start) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        return percentiles[49], percentiles[98], statistics.mean(rows)
+
+    def handle(self, *args, **kwargs):
+        queries = self.get_queries()
+        repeat = kwargs.get('repeat')
+        queryset = Ingredient.objects.all()
+        list(ingredient_autocomplete.filter(queryset, queries[0]))
+        results = {
+            'istartswith filter': self.measure(
+                queries,
+                lambda query: queryset.filter(name__istartswith=query),
+                repeat
+            ),
+            'autocomplete': self.measure(
+                queries,
+                lambda query: ingredient_autocomplete.filter(queryset, query),
+                repeat
+            ),
+        }
+        self.stdout.write(
+            f'{Ingredient.objects.count()} ingredients, '
+            f'{len(queries)} queries x {repeat}, '
+            f'limit {settings.INGREDIENT_SEARCH_LIMIT}'
+        )
+        for name, (p50, p99, rows) in results.items():
+            self.stdout.write(
+                f'{name}: p50={p50:.2f}ms p99={p99:.2f}ms rows={rows:.1f}'
+            )
@@ -0,0 +1,80 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from recipes.benchmark import generate_recipes, measure
+from recipes.models import Recipe
+from recipes.search import recipe_search
+
+INGREDIENT_LOOKUP = 'recipe_ingredients__ingredient__name__icontains'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure full-text recipe search against icontains filtering '
+        'on generated recipes; generated data is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='How many recipes to generate'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='How many times each query is executed'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed of the generated data'
+        )
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs.get('seed'))
+        total, repeat = kwargs.get('recipes'), kwargs.get('repeat')
+        page_size = settings.PAGINATION_PAGE_SIZE
+        with transaction.atomic():
+            start = time.perf_counter()
+            vocabulary = generate_recipes(total, kwargs.get('seed'))
+            generated = time.perf_counter() - start
+            start = time.perf_counter()
+            recipe_search.update()
+            indexed = time.perf_counter() - start
+            queries = rng.sample(vocabulary, 20) + [
+                ' '.join(rng.sample(vocabulary, 2)) for _ in range(10)
+            ]
+            queryset = Recipe.objects.all()
+
+            def icontains(query):
+                condition = Q()
+                for word in query.split():
+                    condition &= (
+                        Q(name__icontains=word) | Q(text__icontains=word)
+                        | Q(**{INGREDIENT_LOOKUP: word})
+                    )
+                return queryset.filter(condition).distinct()[:page_size]
+
+            results = {
+                'icontains filter': measure(queries, icontains, repeat),
+                'full-text search': measure(
+                    queries,
+                    lambda query: recipe_search.filter(
+                        queryset, query
+                    )[:page_size],
+                    repeat
+                ),
+            }
+            transaction.set_rollback(True)
+        self.stdout.write(
+            f'{connection.vendor}: {total} recipes generated in '
+            f'{generated:.1f}s, indexed in {indexed:.1f}s, '
+            f'{len(queries)} queries x {repeat}, page {page_size}'
+        )
+        for name, (p50, p99, rows) in results.items():
+            self.stdout.write(
+                f'{name}: p50={p50:.2f}ms p99={p99:.2f}ms rows={rows:.1f}'
+            )
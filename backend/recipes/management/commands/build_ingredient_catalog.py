@@ -0,0 +1,75 @@
+import gc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.cache import ReferenceCache, get_version
+from recipes.catalog import IngredientCatalog, build_catalog
+from recipes.models import Ingredient
+
+
+def memory_usage():
+    """Анонимная и файловая части RSS процесса в КиБ (Linux)."""
+    usage = {}
+    with open('/proc/self/status') as status:
+        for line in status:
+            name, _, value = line.partition(':')
+            if name in ('RssAnon', 'RssFile'):
+                usage[name] = int(value.split()[0])
+    return usage['RssAnon'], usage['RssFile']
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the memory-mapped ingredient catalog shared by workers '
+        'from the database; workers also rebuild it themselves whenever '
+        'the ingredient version changes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.INGREDIENT_CATALOG_PATH,
+            help='Catalog path, INGREDIENT_CATALOG_PATH by default'
+        )
+        parser.add_argument(
+            '--measure', action='store_true',
+            help='Compare per-process memory of the catalog and the '
+                 'in-memory reference cache'
+        )
+
+    def handle(self, *args, **kwargs):
+        path = kwargs.get('output')
+        if not path:
+            raise CommandError(
+                'Set INGREDIENT_CATALOG_PATH or pass --output.'
+            )
+        total = build_catalog(
+            path, get_version(Ingredient._meta.label_lower)
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} ingredients written to {path}'
+        ))
+        if kwargs.get('measure'):
+            self.measure(path)
+
+    def measure(self, path):
+        """Память, которую справочник занимает в каждом воркере:
+        каталог читается из общих страниц файла, кэш держит объекты."""
+        queries = ('а', 'мол', 'сыр', 'ово')
+        anon, file = memory_usage()
+        catalog = IngredientCatalog(path, Ingredient._meta.label_lower)
+        for pk in Ingredient.objects.values_list('pk', flat=True):
+            catalog.get(pk)
+        for query in queries:
+            catalog.search_ids(query, settings.INGREDIENT_SEARCH_LIMIT)
+        gc.collect()
+        catalog_anon, catalog_file = memory_usage()
+        cache = ReferenceCache(Ingredient)
+        cache.snapshot()
+        gc.collect()
+        cache_anon, _ = memory_usage()
+        self.stdout.write(
+            f'catalog: +{catalog_anon - anon} KiB private, '
+            f'+{catalog_file - file} KiB shared file pages\n'
+            f'reference cache: +{cache_anon - catalog_anon} KiB private'
+        )
@@ -0,0 +1,129 @@
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.benchmark import generate_data
+from recipes.cache import (
+    RECIPES_VERSION,
+    USERS_VERSION,
+    bump_versions,
+    ingredient_cache,
+    tag_cache
+)
+from recipes.importing import (
+    INGREDIENT_FIELDS,
+    IngredientImport,
+    chunks,
+    import_tags,
+    read_rows
+)
+from recipes.matching import recipe_matcher
+from recipes.models import Ingredient, Tag
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic users, follows, recipes, favorites and '
+        'shopping carts for load testing'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='How many users to create'
+        )
+        parser.add_argument(
+            '--recipes-per-user', type=int, default=5,
+            help='Average recipes per user; authors follow a power law'
+        )
+        parser.add_argument(
+            '--follows-per-user', type=int, default=10,
+            help='Subscriptions per user'
+        )
+        parser.add_argument(
+            '--favorites-per-user', type=int, default=20,
+            help='Favorite recipes per user'
+        )
+        parser.add_argument(
+            '--cart-per-user', type=int, default=5,
+            help='Recipes in the shopping cart of each user'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed of the generated data'
+        )
+        parser.add_argument(
+            '--prefix', default='load',
+            help='Username prefix and e-mail domain of generated users'
+        )
+        parser.add_argument(
+            '--password', default='benchmark',
+            help='Password of every generated user'
+        )
+        parser.add_argument(
+            '--ingredients-path', default='data/ingredients.csv',
+            help='Ingredients imported first if they are missing'
+        )
+        parser.add_argument(
+            '--tags-path', default='data/tags.csv',
+            help='Tags imported first if they are missing'
+        )
+
+    def handle(self, *args, **kwargs):
+        prefix = kwargs.get('prefix')
+        if User.objects.filter(
+                email__endswith=f'@{prefix}.example.com'
+        ).exists():
+            raise CommandError(
+                f'Data with prefix "{prefix}" already exists, '
+                'pass another --prefix.'
+            )
+        start = time.perf_counter()
+        if not Tag.objects.exists():
+            import_tags(read_rows(
+                kwargs.get('tags_path'), ('id', 'name', 'color', 'slug')
+            ))
+            tag_cache.invalidate()
+        if not Ingredient.objects.exists():
+            importer = IngredientImport()
+            for chunk in chunks(read_rows(
+                    kwargs.get('ingredients_path'), INGREDIENT_FIELDS
+            ), 5000):
+                importer.load(chunk)
+            ingredient_cache.invalidate()
+        with transaction.atomic():
+            counts = generate_data(
+                kwargs.get('users'),
+                recipes_per_user=kwargs.get('recipes_per_user'),
+                follows_per_user=kwargs.get('follows_per_user'),
+                favorites_per_user=kwargs.get('favorites_per_user'),
+                cart_per_user=kwargs.get('cart_per_user'),
+                seed=kwargs.get('seed'),
+                prefix=prefix,
+                password=kwargs.get('password')
+            )
+        # bulk_create не отправляет сигналы: списки рецептов и данные
+        # авторов в кэше ответов объявляем устаревшими сами.
+        bump_versions((RECIPES_VERSION, USERS_VERSION))
+        generated = time.perf_counter() - start
+        for name, total in counts.items():
+            self.stdout.write(f'{name}: {total}')
+        self.stdout.write(f'generated in {generated:.1f}s, rebuilding')
+        for command in (
+                'recount', 'rebuild_shopping_cart', 'rebuild_search_index',
+                'backfill_feed'
+        ):
+            # Сами команды печатают каждое расхождение, здесь нужен итог.
+            output = StringIO()
+            call_command(command, stdout=output)
+            self.stdout.write(output.getvalue().splitlines()[-1])
+        recipe_matcher.reload()
+        self.stdout.write(self.style.SUCCESS(
+            f'done in {time.perf_counter() - start:.1f}s'
+        ))
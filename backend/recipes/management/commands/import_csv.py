@@ -1,55 +1,109 @@
-import csv
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, reset_queries
 
-from recipes.models import Ingredient, Tag
+from recipes.cache import ingredient_cache, tag_cache
+from recipes.importing import (
+    INGREDIENT_FIELDS,
+    IngredientImport,
+    chunks,
+    import_tags,
+    read_rows
+)
 
 
 class Command(BaseCommand):
-    help = 'Import data from CSV files into the database'
+    help = (
+        'Import ingredients and tags from CSV or JSON files; rows that '
+        'already exist are skipped, so the import can be re-run'
+    )
 
     INGREDIENTS_CSV_PATH = 'data/ingredients.csv'
     TAGS_CSV_PATH = 'data/tags.csv'
+    CHUNK_SIZE = 5000
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--ingredients-path', type=str, default=self.INGREDIENTS_CSV_PATH,
-            help='Path to the ingredients CSV file'
+            help='Path to the ingredients CSV or JSON file'
         )
         parser.add_argument(
             '--tags-path', type=str, default=self.TAGS_CSV_PATH,
-            help='Path to the tags CSV file'
-        )
-
-    def handle_ingredients(self, path):
-        with open(path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            objs = [
-                Ingredient(
-                    name=row['name'],
-                    measurement_unit=row['measurement_unit']
-                )
-                for row in reader
-            ]
-            Ingredient.objects.bulk_create(objs)
-
-    def handle_tags(self, path):
-        with open(path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            objs = [
-                Tag(
-                    id=row['id'],
-                    name=row['name'],
-                    color=row['color'],
-                    slug=row['slug'],
-                )
-                for row in reader
-            ]
-            Tag.objects.bulk_create(objs)
+            help='Path to the tags CSV or JSON file'
+        )
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='File format, detected by extension by default'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=self.CHUNK_SIZE,
+            help='Rows per transaction'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report what would be added or changed; '
+                 'with -v 2 every new ingredient is listed'
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Load chunks with COPY through a staging table '
+                 '(PostgreSQL only)'
+        )
+
+    def handle_ingredients(self, path, file_format, chunk_size, importer):
+        start = time.perf_counter()
+        for chunk in chunks(
+                read_rows(path, INGREDIENT_FIELDS, file_format), chunk_size
+        ):
+            new = importer.load(chunk)
+            # С DEBUG журнал запросов рос бы вместе с файлом.
+            reset_queries()
+            if importer.dry_run and self.verbosity > 1:
+                for name, unit in new:
+                    self.stdout.write(f'+ {name} ({unit})')
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{importer.rows} rows, {importer.created} new, '
+                f'{importer.rows / elapsed:.0f} rows/s'
+            )
+
+    def handle_tags(self, path, file_format, dry_run):
+        try:
+            created, updated = import_tags(
+                read_rows(path, ('id', 'name', 'color', 'slug'), file_format),
+                dry_run
+            )
+        except IntegrityError as error:
+            raise CommandError(f'Tags conflict with existing ones: {error}')
+        self.stdout.write(f'tags: {created} new, {updated} changed')
+        return created + updated
 
     def handle(self, *args, **kwargs):
-        ingredients_path = kwargs.get('ingredients_path',
-                                      self.INGREDIENTS_CSV_PATH)
-        tags_path = kwargs.get('tags_path', self.TAGS_CSV_PATH)
-        self.handle_tags(tags_path)
-        self.handle_ingredients(ingredients_path)
+        self.verbosity = kwargs.get('verbosity')
+        file_format = kwargs.get('format')
+        dry_run = kwargs.get('dry_run')
+        if kwargs.get('chunk_size') < 1:
+            raise CommandError('--chunk-size must be positive.')
+        try:
+            importer = IngredientImport(dry_run, kwargs.get('copy'))
+        except ValueError as error:
+            raise CommandError(error)
+        tags_changed = self.handle_tags(
+            kwargs.get('tags_path'), file_format, dry_run
+        )
+        self.handle_ingredients(
+            kwargs.get('ingredients_path'), file_format,
+            kwargs.get('chunk_size'), importer
+        )
+        action = 'would be added' if dry_run else 'added'
+        self.stdout.write(self.style.SUCCESS(
+            f'ingredients: {importer.rows} rows, {importer.created} '
+            f'{action}, {importer.skipped} invalid or repeated'
+        ))
+        if dry_run:
+            return
+        if tags_changed:
+            tag_cache.invalidate()
+        if importer.created:
+            ingredient_cache.invalidate()
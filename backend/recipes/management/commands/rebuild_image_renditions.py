@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import RENDITIONS, process_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the missing image renditions of recipes, e.g. after '
+        'a worker died before its background renditions were saved'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Check every image, not only recipes without links to '
+                 'all renditions; rendition files missing from the '
+                 'storage are built again'
+        )
+
+    def handle(self, *args, **kwargs):
+        recipes = Recipe.objects.exclude(image='')
+        if not kwargs.get('all'):
+            recipes = recipes.exclude(
+                image_renditions__has_keys=list(RENDITIONS)
+            )
+        images = recipes.order_by('image').values_list(
+            'image', flat=True
+        ).distinct()
+        total = failed = 0
+        for image in list(images):
+            try:
+                process_image(image)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'{image}: {error}')
+            else:
+                total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Built renditions of {total} images, {failed} failed'
+        ))
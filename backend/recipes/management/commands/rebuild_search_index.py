@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.search import recipe_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of recipes'
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            recipe_search.update()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
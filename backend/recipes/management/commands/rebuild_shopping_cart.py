@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingCartLine
+
+
+class Command(BaseCommand):
+    help = 'Rebuild aggregated shopping cart lines and check them for drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift without rebuilding the table'
+        )
+
+    def handle(self, *args, **kwargs):
+        drift = ShoppingCartLine.objects.drift()
+        for (user_id, ingredient_id), (stored, expected) in sorted(
+                drift.items()
+        ):
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id} '
+                f'stored={stored} expected={expected}'
+            )
+        self.stdout.write(f'Drifted lines: {len(drift)}')
+        if kwargs.get('check'):
+            return
+        with transaction.atomic():
+            ShoppingCartLine.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS('Shopping cart lines rebuilt'))
@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.cache import (
+    RECIPE_COUNTERS_VERSION,
+    USERS_VERSION,
+    author_version_name,
+    recipe_version_name
+)
+from recipes.models import FavoriteRecipe, Recipe, ShoppingRecipe
+from recipes.signals import bump_versions_on_commit
+from users.models import Follow
+
+User = get_user_model()
+
+
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized counters and fix drift'
+
+    COUNTERS = (
+        (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+        (Recipe, 'in_carts_count', ShoppingRecipe, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+        (User, 'followers_count', Follow, 'following'),
+    )
+    # Версии кэша ответов, в которые входят счётчики модели:
+    # общая и версия одной записи.
+    VERSIONS = {
+        Recipe: (RECIPE_COUNTERS_VERSION, recipe_version_name),
+        User: (USERS_VERSION, author_version_name),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift without fixing it'
+        )
+
+    def handle(self, *args, **kwargs):
+        for model, counter, related_model, field in self.COUNTERS:
+            with transaction.atomic():
+                drifted = model.objects.annotate(
+                    actual=count_subquery(related_model, field)
+                ).exclude(**{counter: F('actual')})
+                pks = list(drifted.values_list('pk', flat=True))
+                total = len(pks)
+                if pks and not kwargs.get('check'):
+                    model.objects.filter(pk__in=pks).update(
+                        **{counter: count_subquery(related_model, field)}
+                    )
+                    version, version_name = self.VERSIONS[model]
+                    bump_versions_on_commit((
+                        version, *(version_name(pk) for pk in pks)
+                    ))
+            self.stdout.write(
+                f'{model._meta.label}.{counter}: {total} drifted'
+            )
@@ -0,0 +1,152 @@
+import heapq
+from array import array
+from collections import Counter
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import RecipeIngredient
+
+VERSION_KEY = 'matching:version'
+CHANGE_KEY = 'matching:change:{}'
+CHANGE_TIMEOUT = 24 * 60 * 60
+MAX_CHANGES = 1000
+
+
+class RecipeMatcher:
+    """Подбор рецептов по набору продуктов пользователя.
+
+    В памяти процесса хранится обратный индекс: для каждого ингредиента
+    массив id рецептов, в которые он входит. Покрытие рецептов
+    считается проходом только по спискам выбранных ингредиентов,
+    без соединений в базе. Изменённые рецепты публикуются в кэше
+    Django под возрастающими номерами, и остальные процессы
+    перечитывают только их; если журнал потерян, индекс строится
+    заново. Без общего кэша номер изменений истекает, и индекс
+    перестраивается не реже раза в CACHE_VERSION_TIMEOUT секунд.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._recipes = {}
+        self._postings = {}
+        self._lock = Lock()
+
+    def recipe_changed(self, recipe_id):
+        """Публикуем изменение состава рецепта после фиксации
+        транзакции."""
+        transaction.on_commit(lambda: self._publish(recipe_id))
+
+    @staticmethod
+    def reload():
+        """Все процессы перестроят индекс целиком: нужно после
+        массовой загрузки, минующей сигналы."""
+        cache.add(VERSION_KEY, 0, settings.CACHE_VERSION_TIMEOUT)
+        cache.incr(VERSION_KEY, MAX_CHANGES + 1)
+
+    @staticmethod
+    def _publish(recipe_id):
+        cache.add(VERSION_KEY, 0, settings.CACHE_VERSION_TIMEOUT)
+        version = cache.incr(VERSION_KEY)
+        cache.set(CHANGE_KEY.format(version), recipe_id, CHANGE_TIMEOUT)
+
+    def _load(self):
+        self._recipes, self._postings = {}, {}
+        recipes = {}
+        for recipe_id, ingredient_id in RecipeIngredient.objects.order_by(
+                'recipe_id'
+        ).values_list('recipe_id', 'ingredient_id').iterator():
+            recipes.setdefault(recipe_id, []).append(ingredient_id)
+        self._apply(recipes)
+
+    def _apply(self, recipes):
+        """Заменяет в индексе состав рецептов; пустой состав - удаление."""
+        for recipe_id, ingredient_ids in recipes.items():
+            for ingredient_id in self._recipes.pop(recipe_id, ()):
+                self._postings[ingredient_id].remove(recipe_id)
+            if not ingredient_ids:
+                continue
+            self._recipes[recipe_id] = tuple(ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                self._postings.setdefault(
+                    ingredient_id, array('q')
+                ).append(recipe_id)
+
+    def _sync(self):
+        version = cache.get(VERSION_KEY)
+        # Номер вытеснен или истёк (без общего кэша - каждые
+        # CACHE_VERSION_TIMEOUT секунд): журнал изменений потерян.
+        lost = version is None
+        if lost:
+            cache.add(VERSION_KEY, 0, settings.CACHE_VERSION_TIMEOUT)
+            version = cache.get(VERSION_KEY, 0)
+        with self._lock:
+            if version == self._version and not lost:
+                return
+            if (
+                    lost or self._version is None
+                    or version < self._version
+                    or version - self._version > MAX_CHANGES
+            ):
+                self._load()
+                self._version = version
+                return
+            changes = cache.get_many([
+                CHANGE_KEY.format(number)
+                for number in range(self._version + 1, version + 1)
+            ])
+            if len(changes) < version - self._version:
+                self._load()
+            else:
+                recipes = {recipe_id: [] for recipe_id in changes.values()}
+                rows = RecipeIngredient.objects.filter(
+                    recipe_id__in=recipes
+                ).values_list('recipe_id', 'ingredient_id')
+                for recipe_id, ingredient_id in rows:
+                    recipes[recipe_id].append(ingredient_id)
+                self._apply(recipes)
+            self._version = version
+
+    def match(self, ingredient_ids):
+        """Рецепты, в которые входит хотя бы один из продуктов."""
+        self._sync()
+        with self._lock:
+            covered = Counter()
+            for ingredient_id in set(ingredient_ids):
+                covered.update(self._postings.get(ingredient_id, ()))
+            return CookableRecipes(covered, {
+                recipe_id: len(self._recipes[recipe_id])
+                for recipe_id in covered
+            })
+
+
+class CookableRecipes:
+    """Рецепты по убыванию покрытия: сначала те, для которых есть всё,
+    затем с наименьшим числом недостающих ингредиентов, при равенстве -
+    более новые. Сортируется только запрошенная страница и всё, что
+    выше неё, поэтому объект можно отдать пагинатору как список."""
+
+    def __init__(self, covered, sizes):
+        self.covered = covered
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.covered)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(len(self))
+        ranked = heapq.nsmallest(stop, (
+            (self.sizes[recipe_id] - covered, -covered, -recipe_id)
+            for recipe_id, covered in self.covered.items()
+        ))
+        return [
+            (-negative_id, missing)
+            for missing, _, negative_id in ranked[start:stop]
+        ]
+
+
+recipe_matcher = RecipeMatcher()
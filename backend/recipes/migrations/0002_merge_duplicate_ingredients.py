@@ -0,0 +1,87 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+BATCH_SIZE = 500
+
+
+def batches(items):
+    items = list(items)
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start + BATCH_SIZE]
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Старый PATCH дописывал ингредиенты к рецепту, не удаляя прежние,
+    и пары (рецепт, ингредиент) повторялись. Из повторов остаётся
+    последняя строка - количество из последней правки; списки покупок
+    пользователей с такими рецептами в корзине считаются заново.
+    Счётчики рецептов и пользователей строки ингредиентов не учитывают.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartLine = apps.get_model('recipes', 'ShoppingCartLine')
+    ShoppingRecipe = apps.get_model('recipes', 'ShoppingRecipe')
+    recipe_ids = set(
+        RecipeIngredient.objects.values(
+            'recipe_id', 'ingredient_id'
+        ).annotate(rows=Count('pk')).filter(rows__gt=1).values_list(
+            'recipe_id', flat=True
+        )
+    )
+    if not recipe_ids:
+        return
+    latest, duplicates = set(), []
+    for recipe_ids_batch in batches(recipe_ids):
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids_batch
+        ).order_by('-pk').values_list('pk', 'recipe_id', 'ingredient_id')
+        for pk, recipe_id, ingredient_id in rows:
+            if (recipe_id, ingredient_id) in latest:
+                duplicates.append(pk)
+            else:
+                latest.add((recipe_id, ingredient_id))
+    for pks in batches(duplicates):
+        RecipeIngredient.objects.filter(pk__in=pks).delete()
+    # Меняется время изменения: ETag рецептов и списков не совпадёт
+    # с выданным до слияния.
+    for recipe_ids_batch in batches(recipe_ids):
+        Recipe.objects.filter(pk__in=recipe_ids_batch).update(
+            updated_at=timezone.now()
+        )
+    user_ids = set()
+    for recipe_ids_batch in batches(recipe_ids):
+        user_ids.update(ShoppingRecipe.objects.filter(
+            recipe_id__in=recipe_ids_batch
+        ).values_list('user_id', flat=True))
+    for user_ids_batch in batches(user_ids):
+        ShoppingCartLine.objects.filter(user_id__in=user_ids_batch).delete()
+        ShoppingCartLine.objects.bulk_create(
+            ShoppingCartLine(
+                user_id=user_id, ingredient_id=ingredient_id,
+                total_amount=total
+            )
+            for user_id, ingredient_id, total in RecipeIngredient.objects.
+            filter(
+                recipe__is_in_shopping_cart__user_id__in=user_ids_batch
+            ).values(
+                'recipe__is_in_shopping_cart__user_id', 'ingredient_id'
+            ).annotate(total=Sum('amount')).values_list(
+                'recipe__is_in_shopping_cart__user_id',
+                'ingredient_id',
+                'total'
+            ).order_by()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+    ]
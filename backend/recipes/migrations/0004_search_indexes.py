@@ -0,0 +1,56 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+from django.db.models.functions import Upper
+
+
+class AddPostgreSQLIndex(migrations.AddIndex):
+    """AddIndex для индексов, которые есть только в PostgreSQL: на других
+    базах меняется лишь состояние моделей, одинаковое для всех баз."""
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_unique_recipe_ingredient_pair'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Те же индексы под прежними именами создавал вручную
+        # обработчик post_migrate.
+        migrations.RunSQL(
+            [
+                'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+                'DROP INDEX IF EXISTS recipes_recipe_search_vector_gin',
+            ],
+            migrations.RunSQL.noop
+        ),
+        AddPostgreSQLIndex(
+            model_name='ingredient',
+            index=GinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='ingredient_name_trgm_idx'
+            ),
+        ),
+        AddPostgreSQLIndex(
+            model_name='recipe',
+            index=GinIndex(
+                fields=['search_vector'], name='recipe_search_vector_idx'
+            ),
+        ),
+    ]
@@ -1,10 +1,16 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (
     MaxValueValidator,
     MinValueValidator,
-    RegexValidator)
-from django.db import models
+    RegexValidator
+)
+from django.db import models, transaction
+from django.db.models.functions import Upper
+
+from users.models import Follow
 
 User = get_user_model()
 
@@ -56,15 +62,76 @@ class Ingredient(models.Model):
                 name="unique_title_measurement_unit_pair"
             )
         ]
+        # Триграммный индекс по UPPER(name) обслуживает и istartswith,
+        # и icontains, которые Django строит через UPPER(...) LIKE.
+        # GIN-индексы создаются только на PostgreSQL, см. миграцию 0004.
+        indexes = [
+            GinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='ingredient_name_trgm_idx'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """Подгружаем автора, теги и ингредиенты фиксированным числом
+        запросов вместо отдельных запросов на каждый рецепт.
+        Поисковый вектор в ответах не нужен и не читается."""
+        return self.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def with_tags(self, tag_ids, match_all=False):
+        """Рецепты с любым из тегов, а с match_all - с каждым.
+
+        Один подзапрос EXISTS к RecipeTag вместо соединения с тегами:
+        строки рецептов не размножаются, и DISTINCT не нужен.
+        """
+        tag_ids = set(tag_ids)
+        recipe_tags = RecipeTag.objects.filter(
+            recipe=models.OuterRef('pk'), tag_id__in=tag_ids
+        )
+        if match_all:
+            recipe_tags = recipe_tags.order_by().values('recipe').annotate(
+                matched=models.Count('tag_id')
+            ).filter(matched=len(tag_ids))
+        return self.filter(models.Exists(recipe_tags))
+
+    def with_user_flags(self, user):
+        """Аннотируем рецепты флагами избранного, списка покупок
+        и подписки на автора для текущего пользователя."""
+        if not user.is_authenticated:
+            return self
+        return self.annotate(
+            favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            in_shopping_cart=models.Exists(ShoppingRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            author_subscribed=models.Exists(Follow.objects.filter(
+                user=user, following=models.OuterRef('author')
+            ))
+        )
+
+
 class Recipe(models.Model):
+    # Поиск по автору обслуживает recipe_author_created_at_idx.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Автор рецепта'
     )
     name = models.CharField(
@@ -75,6 +142,9 @@ class Recipe(models.Model):
         'Изображение',
         upload_to='recipes/images/',
     )
+    image_renditions = models.JSONField(
+        'Копии изображения', default=dict, blank=True
+    )
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -97,22 +167,58 @@ class Recipe(models.Model):
         ]
     )
     created_at = models.DateTimeField('Дата публикации', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    favorites_count = models.PositiveIntegerField('В избранном', default=0)
+    in_carts_count = models.PositiveIntegerField(
+        'В списках покупок', default=0
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ('-created_at',)
+        ordering = ('-created_at', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
+        indexes = [
+            models.Index(
+                fields=('-created_at', '-id'),
+                name='recipe_created_at_id_idx'
+            ),
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=('-in_carts_count', '-id'),
+                name='recipe_in_carts_count_idx'
+            ),
+            models.Index(
+                fields=('author', '-created_at', '-id'),
+                name='recipe_author_created_at_idx'
+            ),
+            GinIndex(
+                fields=('search_vector',), name='recipe_search_vector_idx'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
 class RecipeTag(models.Model):
+    # Отдельные индексы внешних ключей не нужны: по рецепту ищет
+    # уникальный индекс пары, по тегу - recipe_tag_tag_recipe_idx.
     recipe = models.ForeignKey(
-        Recipe, on_delete=models.CASCADE, verbose_name='Рецепт'
+        Recipe, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Рецепт'
+    )
+    tag = models.ForeignKey(
+        Tag, on_delete=models.CASCADE, db_index=False, verbose_name='Тег'
     )
-    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, verbose_name='Тег')
 
     class Meta:
         verbose_name = 'Тег рецепта'
@@ -124,14 +230,21 @@ class RecipeTag(models.Model):
                 name="unique_recipe_tag_pair"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('tag', 'recipe'), name='recipe_tag_tag_recipe_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.recipe} {self.tag}'
 
 
 class RecipeIngredient(models.Model):
+    # По рецепту ищет уникальный индекс пары.
     recipe = models.ForeignKey(
-        Recipe, on_delete=models.CASCADE, verbose_name='Рецепт')
+        Recipe, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Рецепт')
     ingredient = models.ForeignKey(
         Ingredient, on_delete=models.CASCADE, verbose_name='Ингредиент')
     amount = models.PositiveSmallIntegerField(
@@ -146,21 +259,28 @@ class RecipeIngredient(models.Model):
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиенты рецепта'
         default_related_name = 'recipe_ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'ingredient'),
+                name='unique_recipe_ingredient_pair'
+            )
+        ]
 
     def __str__(self):
         return f'{self.recipe} {self.ingredient}'
 
 
 class RecipeUserBase(models.Model):
+    # По пользователю ищет уникальный индекс пары (user, recipe).
     user = models.ForeignKey(
-        User, on_delete=models.CASCADE, verbose_name='Пользователь'
+        User, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Пользователь'
     )
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE, verbose_name='Рецепт'
     )
 
     class Meta:
-        ordering = ('recipe__name',)
         abstract = True
 
     def __str__(self):
@@ -191,3 +311,207 @@ class ShoppingRecipe(RecipeUserBase):
                 name="shopping_unique_user_recipe_pair"
             )
         ]
+
+
+def lock_users(user_ids):
+    """Блокирует строки пользователей до конца транзакции: изменения
+    связей и списка покупок одного пользователя идут по очереди.
+    По возрастанию id, чтобы параллельные вызовы не ждали друг друга
+    по кругу."""
+    list(User.objects.select_for_update().filter(
+        pk__in=user_ids
+    ).order_by('pk').values_list('pk', flat=True))
+
+
+class ShoppingCartLineManager(models.Manager):
+
+    @staticmethod
+    def recipes_amounts(recipe_ids):
+        """Суммарное количество каждого ингредиента в рецептах."""
+        return dict(
+            RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values('ingredient_id').annotate(
+                total=models.Sum('amount')
+            ).values_list('ingredient_id', 'total')
+        )
+
+    def apply(self, user_ids, deltas):
+        """Прибавляем изменения количества ингредиентов к строкам
+        списка покупок пользователей.
+
+        Строки пользователей блокируются вместе со строками списка:
+        иначе два параллельных добавления нового ингредиента
+        вставили бы одну строку дважды.
+        """
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        with transaction.atomic(savepoint=False):
+            lock_users(user_ids)
+            lines = {
+                (line.user_id, line.ingredient_id): line
+                for line in self.select_for_update().filter(
+                    user_id__in=user_ids, ingredient_id__in=deltas
+                )
+            }
+            to_create, to_update, to_delete = [], [], []
+            for user_id in user_ids:
+                for ingredient_id, delta in deltas.items():
+                    line = lines.get((user_id, ingredient_id))
+                    if line is None:
+                        if delta > 0:
+                            to_create.append(self.model(
+                                user_id=user_id,
+                                ingredient_id=ingredient_id,
+                                total_amount=delta
+                            ))
+                        continue
+                    line.total_amount += delta
+                    if line.total_amount > 0:
+                        to_update.append(line)
+                    else:
+                        to_delete.append(line.pk)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ('total_amount',))
+            self.filter(pk__in=to_delete).delete()
+
+    def add_recipes(self, user_id, recipe_ids):
+        if recipe_ids:
+            self.apply([user_id], self.recipes_amounts(recipe_ids))
+
+    def remove_recipes(self, user_id, recipe_ids):
+        if recipe_ids:
+            self.apply([user_id], {
+                ingredient_id: -amount
+                for ingredient_id, amount
+                in self.recipes_amounts(recipe_ids).items()
+            })
+
+    def add_recipe(self, user_id, recipe_id):
+        self.add_recipes(user_id, [recipe_id])
+
+    def remove_recipe(self, user_id, recipe_id):
+        self.remove_recipes(user_id, [recipe_id])
+
+    def update_recipe(self, recipe_id, deltas):
+        """Переносим изменение состава рецепта в списки покупок
+        всех пользователей, у которых он в корзине."""
+        user_ids = list(ShoppingRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True))
+        self.apply(user_ids, deltas)
+
+    def expected(self):
+        """Строки списков покупок, посчитанные заново по корзинам."""
+        return {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in RecipeIngredient.objects.
+            filter(recipe__is_in_shopping_cart__isnull=False).values(
+                'recipe__is_in_shopping_cart__user_id', 'ingredient_id'
+            ).annotate(
+                total=models.Sum('amount')
+            ).values_list(
+                'recipe__is_in_shopping_cart__user_id',
+                'ingredient_id',
+                'total'
+            ).order_by()
+        }
+
+    def drift(self):
+        """Расхождения между сохранёнными и посчитанными строками."""
+        expected = self.expected()
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in self.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )
+        }
+        return {
+            key: (stored.get(key), expected.get(key))
+            for key in expected.keys() | stored.keys()
+            if stored.get(key) != expected.get(key)
+        }
+
+    def rebuild(self):
+        self.all().delete()
+        self.bulk_create(
+            self.model(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total
+            )
+            for (user_id, ingredient_id), total in self.expected().items()
+        )
+
+
+class ShoppingCartLine(models.Model):
+    """Агрегированная строка списка покупок пользователя."""
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingCartLineManager()
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списка покупок'
+        default_related_name = 'shopping_cart_lines'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='shopping_cart_line_unique_user_ingredient_pair'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписок пользователя.
+
+    Строки пишутся при создании рецепта всем подписчикам автора;
+    дата рецепта копируется, чтобы лента читалась по одному индексу.
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, verbose_name='Рецепт'
+    )
+    created_at = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        # recipe_id, а не recipe: сортировка по внешнему ключу
+        # присоединяет рецепты ради их порядка по умолчанию.
+        ordering = ('-created_at', '-recipe_id')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        default_related_name = 'feed_entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='feed_entry_unique_user_recipe_pair'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-created_at', '-recipe'),
+                name='feed_entry_user_created_at_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
@@ -0,0 +1,193 @@
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector
+)
+from django.db import connection, connections
+from django.db.models import (
+    F,
+    FloatField,
+    Func,
+    OuterRef,
+    Subquery,
+    TextField,
+    Value
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_WEIGHTS = '10.0, 1.0, 4.0'
+
+
+class FtsRank(Func):
+    """Ранг bm25 рецепта в выдаче FTS5 по запросу match.
+
+    Выдача с рангами собирается один раз: LIMIT -1 не даёт SQLite
+    развернуть её в коррелированный подзапрос, который выполнял бы
+    MATCH для каждой строки. Столбец рецепта компилирует Django,
+    так что псевдоним таблицы верен и во вложенном запросе.
+    """
+
+    template = (
+        '(SELECT ranked.rank FROM ('
+        f'SELECT rowid AS id, -bm25({FTS_TABLE}, {FTS_WEIGHTS}) AS rank '
+        f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %(match)s LIMIT -1'
+        ') ranked WHERE ranked.id = %(recipe_id)s)'
+    )
+    output_field = FloatField()
+
+    def __init__(self, match, recipe_id):
+        super().__init__(Value(match), recipe_id)
+
+    def as_sql(self, compiler, connection):
+        match, recipe_id = (
+            compiler.compile(expression)
+            for expression in self.get_source_expressions()
+        )
+        return self.template % {
+            'match': match[0], 'recipe_id': recipe_id[0]
+        }, (*match[1], *recipe_id[1])
+
+
+class RecipeSearch:
+    """Полнотекстовый поиск по названию, описанию и ингредиентам рецепта.
+
+    На PostgreSQL вектор хранится в Recipe.search_vector с GIN-индексом,
+    слова приводятся к основе словарём russian, а выдача сортируется
+    по SearchRank. На SQLite рядом ведётся теневая таблица FTS5
+    с ранжированием bm25; основ слов FTS5 не знает, поэтому каждое
+    слово запроса ищется как префикс.
+    """
+
+    def create_index(self, using):
+        """Заполняет вектор рецептов, у которых его нет, - GIN-индекс
+        по нему описан в Meta; на SQLite создаёт таблицу FTS5, которую
+        в Meta не описать."""
+        db = connections[using]
+        if db.vendor == 'postgresql':
+            Recipe.objects.using(using).filter(
+                search_vector__isnull=True
+            ).update(search_vector=self.search_vector())
+        elif db.vendor == 'sqlite':
+            with db.cursor() as cursor:
+                if FTS_TABLE in db.introspection.table_names(cursor):
+                    return
+                cursor.execute(
+                    f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+                    'name, text, ingredients, '
+                    "tokenize='unicode61 remove_diacritics 2')"
+                )
+            self.update(using=using)
+
+    @staticmethod
+    def search_vector():
+        ingredients = Subquery(
+            RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names'),
+            output_field=TextField()
+        )
+        return (
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(ingredients, Value(''), output_field=TextField()),
+                weight='B',
+                config=SEARCH_CONFIG
+            )
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        )
+
+    def update(self, recipe_ids=None, using='default'):
+        """Пересчитывает индекс для рецептов, None - для всех."""
+        db = connections[using]
+        if recipe_ids is not None:
+            recipe_ids = list(recipe_ids)
+            if not recipe_ids:
+                return
+        if db.vendor == 'postgresql':
+            recipes = Recipe.objects.using(using)
+            if recipe_ids is not None:
+                recipes = recipes.filter(pk__in=recipe_ids)
+            recipes.update(search_vector=self.search_vector())
+        elif db.vendor == 'sqlite':
+            where, params = self.where_ids(recipe_ids)
+            with db.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {FTS_TABLE} WHERE 1 {where("rowid")}',
+                    params
+                )
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} '
+                    '(rowid, name, text, ingredients) '
+                    'SELECT recipe.id, recipe.name, recipe.text, '
+                    "COALESCE(GROUP_CONCAT(ingredient.name, ' '), '') "
+                    f'FROM {Recipe._meta.db_table} recipe '
+                    f'LEFT JOIN {RecipeIngredient._meta.db_table} amount '
+                    'ON amount.recipe_id = recipe.id '
+                    f'LEFT JOIN {Ingredient._meta.db_table} ingredient '
+                    'ON ingredient.id = amount.ingredient_id '
+                    f'WHERE 1 {where("recipe.id")} GROUP BY recipe.id',
+                    params
+                )
+
+    def delete(self, recipe_ids):
+        """Строки удалённых рецептов из теневой таблицы SQLite."""
+        if connection.vendor != 'sqlite':
+            return
+        where, params = self.where_ids(list(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE 1 {where("rowid")}', params
+            )
+
+    @staticmethod
+    def where_ids(recipe_ids):
+        if recipe_ids is None:
+            return lambda column: '', []
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        return (
+            lambda column: f'AND {column} IN ({placeholders})',
+            recipe_ids
+        )
+
+    @staticmethod
+    def fts_query(query):
+        """Запрос FTS5 из слов строки: синтаксис FTS5 пользователю
+        недоступен, каждое слово ищется как префикс."""
+        return ' '.join(
+            '"{}"*'.format(word) for word in re.findall(r'\w+', query)
+        )
+
+    def filter(self, queryset, query):
+        """Рецепты, подходящие под запрос, от более релевантных."""
+        vendor = connections[queryset.db].vendor
+        if vendor == 'postgresql':
+            search_query = SearchQuery(
+                query, search_type='websearch', config=SEARCH_CONFIG
+            )
+            queryset = queryset.filter(
+                search_vector=search_query
+            ).annotate(rank=SearchRank(F('search_vector'), search_query))
+        elif vendor == 'sqlite':
+            match = self.fts_query(query)
+            if not match:
+                return queryset.none()
+            queryset = queryset.filter(pk__in=RawSQL(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                (match,)
+            )).annotate(rank=FtsRank(match, F('pk')))
+        else:
+            return queryset.filter(name__icontains=query)
+        return queryset.order_by('-rank', '-created_at', '-id')
+
+
+recipe_search = RecipeSearch()
@@ -0,0 +1,318 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.cache import (
+    RECIPE_COUNTERS_VERSION,
+    RECIPES_VERSION,
+    USERS_VERSION,
+    author_recipes_version_name,
+    author_version_name,
+    bump_versions,
+    forget_auth_state,
+    ingredient_cache,
+    recipe_version_name,
+    relations_version_name,
+    revoke_tokens,
+    tag_cache
+)
+from recipes.feed import add_author, fan_out, remove_author, threshold_crossed
+from recipes.matching import recipe_matcher
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCartLine,
+    ShoppingRecipe,
+    Tag
+)
+from recipes.search import recipe_search
+from users.models import Follow
+
+User = get_user_model()
+
+RECIPE_COUNTERS = {
+    FavoriteRecipe: 'favorites_count',
+    ShoppingRecipe: 'in_carts_count',
+}
+
+
+def bump_versions_on_commit(names):
+    """Версии кэша ответов меняются после фиксации транзакции: иначе
+    запрос между сменой версии и фиксацией закэшировал бы старые данные
+    под новой версией."""
+    names = list(names)
+    transaction.on_commit(lambda: bump_versions(names))
+
+
+def create_search_indexes(sender, using, **kwargs):
+    """Поисковый индекс, который нельзя описать в Meta моделей."""
+    recipe_search.create_index(using)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(sender, **kwargs):
+    ingredient_cache.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    """Названия ингредиентов входят в поисковый индекс рецептов."""
+    if created:
+        return
+    transaction.on_commit(lambda: recipe_search.update(
+        RecipeIngredient.objects.filter(
+            ingredient_id=instance.pk
+        ).values_list('recipe_id', flat=True)
+    ))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_search_changed(sender, instance, **kwargs):
+    """Индекс пересчитывается после фиксации транзакции, когда
+    ингредиенты рецепта уже записаны."""
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: recipe_search.update([recipe_id]))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    """Правки состава вне сериализаторов, например в админке,
+    и удаление рецептов тоже должны попасть в индекс подбора."""
+    recipe_matcher.recipe_changed(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_search_deleted(sender, instance, **kwargs):
+    recipe_search.delete([instance.pk])
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(sender, **kwargs):
+    tag_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=ShoppingRecipe)
+@receiver((post_save, post_delete), sender=Follow)
+def relations_changed(sender, instance, **kwargs):
+    """Избранное, покупки и подписки входят в ETag пользователя."""
+    bump_versions_on_commit((relations_version_name(instance.user_id),))
+
+
+@receiver((post_save, post_delete), sender=User)
+def users_changed(sender, instance, update_fields=None, **kwargs):
+    """Данные авторов входят в ответы с рецептами; вход в систему
+    обновляет только last_login и на них не влияет. Копия версии
+    авторизации перечитывается: её могло изменить сохранение
+    (см. CreateUser.save)."""
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    forget_auth_state(instance.pk)
+    bump_versions_on_commit((USERS_VERSION, author_version_name(instance.pk)))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    revoke_tokens(instance.user_id)
+
+
+@receiver(user_logged_out)
+def user_logged_out_everywhere(sender, user, **kwargs):
+    """Выход через djoser отзывает и подписанные токены, у которых
+    нет строки в базе."""
+    if user is not None:
+        revoke_tokens(user.pk)
+
+
+def change_counter(queryset, field, created, **extra):
+    """Атомарно меняем счётчик на единицу в той же транзакции,
+    в которой создаётся или удаляется связанная запись.
+
+    Счётчик строки, созданной до его появления, может быть нулём при
+    существующих связях: уменьшение останавливается на нуле, иначе
+    удаление связи нарушило бы ограничение положительного поля.
+    Точные значения восстанавливает команда recount.
+    """
+    value = F(field) + 1 if created else Greatest(F(field) - 1, 0)
+    queryset.update(**{field: value}, **extra)
+
+
+def relations_created_in_bulk(sender, user_id, recipe_ids):
+    """bulk_create не отправляет post_save, поэтому счётчики рецептов
+    и версию связей пользователя меняем одним запросом сами, а рецепты
+    корзины переносим в список покупок."""
+    if not recipe_ids:
+        return
+    field = RECIPE_COUNTERS[sender]
+    change_counter(
+        Recipe.objects.filter(pk__in=recipe_ids), field,
+        True, updated_at=timezone.now()
+    )
+    if sender is ShoppingRecipe:
+        ShoppingCartLine.objects.add_recipes(user_id, recipe_ids)
+    bump_versions_on_commit((
+        relations_version_name(user_id),
+        RECIPE_COUNTERS_VERSION,
+        *(recipe_version_name(recipe_id) for recipe_id in recipe_ids)
+    ))
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+def favorites_count_changed(sender, instance, created=False, **kwargs):
+    """Счётчик входит в ответ API, поэтому сдвигаем и updated_at."""
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), 'favorites_count',
+        created, updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=ShoppingRecipe)
+@receiver(post_delete, sender=ShoppingRecipe)
+def in_carts_count_changed(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), 'in_carts_count',
+        created, updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=ShoppingRecipe)
+@receiver(post_delete, sender=ShoppingRecipe)
+def shopping_cart_changed(sender, instance, created=False, **kwargs):
+    """Рецепт в корзине или вне её - где бы ни менялась корзина.
+
+    Количества берутся из текущего состава рецепта. При каскадном
+    удалении рецепта его строки состава могут быть удалены раньше:
+    тогда их уже вычел recipe_ingredient_deleted, и здесь вычитать
+    нечего.
+    """
+    if kwargs['signal'] is post_save and not created:
+        return
+    if created:
+        ShoppingCartLine.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+    else:
+        ShoppingCartLine.objects.remove_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def recipe_ingredient_saving(sender, instance, raw=False, **kwargs):
+    """Запоминаем прежнюю строку состава, чтобы перенести в списки
+    покупок разницу."""
+    instance._previous_row = None
+    if instance.pk is not None and not raw:
+        instance._previous_row = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(sender, instance, raw=False, **kwargs):
+    """Строки состава, сохранённые по одной (в админке); сериализаторы
+    пишут состав bulk-операциями и переносят разницу сами."""
+    if raw:
+        return
+    deltas = {instance.ingredient_id: instance.amount}
+    if getattr(instance, '_previous_row', None) is not None:
+        ingredient_id, amount = instance._previous_row
+        deltas[ingredient_id] = deltas.get(ingredient_id, 0) - amount
+    ShoppingCartLine.objects.update_recipe(instance.recipe_id, deltas)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    """Удалённая строка состава уходит из списков покупок тех, у кого
+    рецепт ещё в корзине; при каскадном удалении рецепта корзины
+    могут быть удалены раньше - тогда её вычел shopping_cart_changed.
+    """
+    ShoppingCartLine.objects.update_recipe(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount}
+    )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    """Правка рецепта меняет его ответ и состав списков."""
+    bump_versions_on_commit((
+        RECIPES_VERSION,
+        recipe_version_name(instance.pk),
+        author_recipes_version_name(instance.author_id)
+    ))
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingRecipe)
+@receiver(post_delete, sender=ShoppingRecipe)
+def recipe_counters_changed(sender, instance, created=False, **kwargs):
+    """Счётчики входят в ответ с рецептом и в порядок списков."""
+    if kwargs['signal'] is post_save and not created:
+        return
+    bump_versions_on_commit(
+        (RECIPE_COUNTERS_VERSION, recipe_version_name(instance.recipe_id))
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    """Новый рецепт раскладывается по лентам подписчиков."""
+    if created:
+        recipe_id = instance.pk
+        transaction.on_commit(lambda: fan_out(recipe_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def feed_follow_changed(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_delete:
+        remove_author(instance.user_id, instance.following_id)
+    elif created:
+        user_id, author_id = instance.user_id, instance.following_id
+        transaction.on_commit(lambda: add_author(user_id, author_id))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipes_count_changed(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_count', created
+    )
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def followers_count_changed(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        User.objects.filter(pk=instance.following_id),
+        'followers_count',
+        created
+    )
+    # Порог пересечён, если подписка подняла счётчик до порога + 1
+    # или отписка опустила до порога. Обновление счётчика блокирует
+    # строку автора, так что каждое значение видит одна транзакция.
+    author_id = instance.following_id
+    followers_count = User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if followers_count == settings.FEED_FANOUT_MAX_FOLLOWERS + created:
+        transaction.on_commit(lambda: threshold_crossed(author_id))
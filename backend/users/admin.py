@@ -13,6 +13,8 @@ class UserAdmin(BaseUserAdmin):
         'username',
         'first_name',
         'last_name',
+        'recipes_count',
+        'followers_count',
     )
     search_fields = (
         'email',
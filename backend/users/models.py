@@ -34,8 +34,22 @@ class CreateUser(AbstractUser):
     password = models.CharField(
         max_length=settings.USER_NAME_MAX_LENGTH, verbose_name='Пароль'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество подписчиков'
+    )
+    auth_version = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Версия авторизации'
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    # Смена пароля или блокировка отзывает токены пользователя.
+    CREDENTIAL_FIELDS = ('password', 'is_active')
+    # Поля профиля внутри подписанных токенов (AUTH_SIGNED_TOKENS):
+    # с ними отзываются и токены, иначе request.user остался бы старым.
+    SIGNED_TOKEN_FIELDS = ('email', 'username', 'first_name', 'last_name')
 
     class Meta:
         ordering = ('username',)
@@ -45,11 +59,70 @@ class CreateUser(AbstractUser):
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        user.remember_credentials()
+        return user
+
+    def get_credential_fields(self):
+        if settings.AUTH_SIGNED_TOKENS:
+            return self.CREDENTIAL_FIELDS + self.SIGNED_TOKEN_FIELDS
+        return self.CREDENTIAL_FIELDS
+
+    def remember_credentials(self, update_fields=None):
+        """Значения из базы, с которыми сравнивает save(); отложенные
+        и не сохранённые поля не запоминаются."""
+        saved = getattr(self, '_saved_credentials', {})
+        self._saved_credentials = {
+            **saved,
+            **{
+                name: self.__dict__[name]
+                for name in self.get_credential_fields()
+                if name in self.__dict__
+                and (update_fields is None or name in update_fields)
+            }
+        }
+
+    def credentials_changed(self, update_fields):
+        saved = getattr(self, '_saved_credentials', {})
+        return any(
+            name in self.__dict__
+            and (name not in saved or self.__dict__[name] != saved[name])
+            for name in self.get_credential_fields()
+            if update_fields is None or name in update_fields
+        )
+
+    def save(self, *args, **kwargs):
+        """Смена пароля, активности и полей подписанных токенов отзывает
+        токены; выход отзывает их сам (см. revoke_tokens).
+
+        Версия растёт в том же UPDATE, а не из значения в памяти:
+        сохранение устаревшего объекта не откатит отзыв, сделанный
+        другим запросом. Новое значение читается из базы, только если
+        к нему обратятся.
+        """
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding or not self.credentials_changed(update_fields):
+            super().save(*args, **kwargs)
+            self.remember_credentials(update_fields)
+            return
+        self.auth_version = models.F('auth_version') + 1
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'auth_version'}
+        super().save(*args, **kwargs)
+        del self.auth_version
+        self.remember_credentials(update_fields)
+
 
 class Follow(models.Model):
+    # Отдельные индексы внешних ключей не нужны: подписки пользователя
+    # ищет уникальный индекс пары, подписчиков автора -
+    # follow_following_user_idx.
     user = models.ForeignKey(
         CreateUser,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='subscribers',
         verbose_name='Подписчик'
     )
@@ -57,11 +130,14 @@ class Follow(models.Model):
         CreateUser,
         on_delete=models.CASCADE,
         related_name='followings',
+        db_index=False,
         verbose_name='Пользователь'
     )
 
     class Meta:
-        ordering = ('user',)
+        # user_id, а не user: иначе каждый запрос присоединял бы
+        # пользователей ради сортировки по username.
+        ordering = ('user_id', 'following_id')
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
         constraints = [
@@ -73,6 +149,11 @@ class Follow(models.Model):
                 check=~models.Q(user_id=models.F("following_id")),
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=('following', 'user'), name='follow_following_user_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user} {self.following}'
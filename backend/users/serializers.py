@@ -31,10 +31,15 @@ class CustomUserSerializer(UserSerializer, serializers.ModelSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
+        read_only_fields = ('recipes_count', 'followers_count')
 
     def get_is_subscribed(self, obj):
         """Подписан ли текущий пользователь на другого пользователя."""
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return (request is not None and (
                 request.user.is_authenticated
@@ -42,25 +47,34 @@ class CustomUserSerializer(UserSerializer, serializers.ModelSerializer):
                 )
 
     def to_representation(self, instance):
-        """Добавляет рецепты и возможность изменять их количество в ответе."""
+        """Добавляет рецепты, если сериализатор используется
+        для подписок."""
         representation = super().to_representation(instance)
-
-        if self.context.get('request'):
-            endpoint = self.context.get('request').build_absolute_uri()
-            if 'subscribe' in endpoint or 'subscriptions' in endpoint:
-                recipes_limit = (self.context.get('request').
-                                 query_params.get('recipes_limit'))
-                recipes = instance.recipes.all()
-                if recipes_limit and recipes_limit.isdigit():
-                    recipes_limit = int(recipes_limit)
-                    recipes = recipes[:recipes_limit]
-
-                serializer = SubscribeRecipeSerializer(recipes, many=True)
-                representation['recipes'] = serializer.data
-                representation['recipes_count'] = recipes.count()
+        if not self.context.get('with_recipes'):
+            return representation
+        recipes = getattr(instance, 'preview_recipes', None)
+        if recipes is None:
+            recipes = instance.recipes.all()
+            if self.context.get('recipes_limit') is not None:
+                recipes = recipes[:self.context['recipes_limit']]
+        representation['recipes'] = SubscribeRecipeSerializer(
+            recipes, many=True
+        ).data
         return representation
 
 
+class AuthorSerializer(CustomUserSerializer):
+    """Автор в ответах с рецептами: без счётчиков, которые меняются
+    с каждой подпиской, - ответы с рецептами кэшируются по версии
+    автора."""
+
+    class Meta(CustomUserSerializer.Meta):
+        fields = (
+            'email', 'id', 'username', 'first_name', 'last_name',
+            'is_subscribed'
+        )
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     """Сериализатор для создания пользователей."""
 
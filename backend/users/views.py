@@ -1,4 +1,8 @@
+import asyncio
+
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import BooleanField, OuterRef, Prefetch, Subquery, Value
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status
@@ -7,25 +11,64 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from api.async_views import AsyncViewSetMixin, offload
+from foodgram.db.routers import ReplicaReadMixin
+from recipes.models import Recipe
 from users.models import Follow
 from users.serializers import FollowSerializer
 
 User = get_user_model()
 
 
-class FoodgramUserViewSet(UserViewSet):
+class FoodgramUserViewSet(AsyncViewSetMixin, ReplicaReadMixin, UserViewSet):
     """Обрабатывает запрос на получение, создание, редактирование,
     удаления пользователей и подписок."""
 
+    replica_actions = ('list',)
+
     @action(
         detail=False,
         methods=['GET'],
         permission_classes=[IsAuthenticated]
     )
     def me(self, request):
-        """Получаем данные пользователя сделавшего запрос."""
+        """Получаем данные пользователя сделавшего запрос.
+
+        Пользователь из подписанного токена загружен без счётчиков:
+        дочитываем их одним запросом, а не по полю.
+        """
+        counters = {'recipes_count', 'followers_count'}
+        deferred = request.user.get_deferred_fields() & counters
+        if deferred:
+            request.user.refresh_from_db(fields=deferred)
         return super().me(request)
 
+    def get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            return int(recipes_limit)
+        return None
+
+    def get_serializer_context(self):
+        """Для подписок пользователи выводятся вместе с рецептами."""
+        context = super().get_serializer_context()
+        if self.action in ('subscriptions', 'subscribe'):
+            context['with_recipes'] = True
+            context['recipes_limit'] = self.get_recipes_limit()
+        return context
+
+    def get_preview_recipes(self):
+        """Первые recipes_limit рецептов каждого автора одним запросом."""
+        recipes = Recipe.objects.all()
+        recipes_limit = self.get_recipes_limit()
+        if recipes_limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('pk')[:recipes_limit]
+            ))
+        return Prefetch('recipes', queryset=recipes, to_attr='preview_recipes')
+
     @action(
         detail=False,
         methods=['GET'],
@@ -33,20 +76,35 @@ class FoodgramUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         """Получаем подписки принадлежащие пользователю."""
-        subscribed_users = []
-        subscribes = request.user.subscribers.all()
+        authors = self.get_subscriptions_queryset()
         paginator = self.pagination_class()
-        result_page = paginator.paginate_queryset(subscribes, request)
+        result_page = paginator.paginate_queryset(authors, request)
+        serializer = self.get_serializer(result_page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-        for subscription in result_page:
-            subscribed_user = subscription.following
-            subscribed_users.append(subscribed_user)
+    def get_subscriptions_queryset(self):
+        return User.objects.filter(
+            followings__user=self.request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).prefetch_related(self.get_preview_recipes())
 
-        serializer = self.get_serializer(
-            subscribed_users, many=True
+    async def async_subscriptions(self, request):
+        """subscriptions, в котором авторы страницы с их рецептами
+        и число подписок читаются параллельно."""
+        paginator = self.pagination_class()
+        bounds = paginator.page_bounds(request)
+        if bounds is None:
+            return await offload(self.subscriptions)(request)
+        number, bottom, top = bounds
+        authors = self.get_subscriptions_queryset()
+        count, rows = await asyncio.gather(
+            offload(authors.count)(), offload(list)(authors[bottom:top])
+        )
+        rows = paginator.paginate_rows(rows, count, number, request)
+        return paginator.get_paginated_response(
+            await offload(self.serialize)(rows, many=True)
         )
-
-        return paginator.get_paginated_response(serializer.data)
 
     @action(
         detail=True,
@@ -60,15 +118,23 @@ class FoodgramUserViewSet(UserViewSet):
         if request.method == 'POST':
             serializer = FollowSerializer(
                 data={'following': id, 'user': request.user.id},
-                context={'request': request}
+                context=self.get_serializer_context()
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+            # Счётчик подписчиков сигнал меняет в базе, минуя объект.
+            serializer.instance.following.refresh_from_db(
+                fields=('followers_count',)
+            )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if not Follow.objects.filter(
             following=following, user=request.user,
         ).exists():
             raise ValidationError('Вы не подписаны на этого пользователя.')
-        Follow.objects.filter(user=request.user, following=following).delete()
+        with transaction.atomic():
+            Follow.objects.filter(
+                user=request.user, following=following
+            ).delete()
         return Response('Подписка удалена.', status.HTTP_204_NO_CONTENT)